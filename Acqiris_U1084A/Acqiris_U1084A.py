@@ -146,7 +146,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
                 trigLev = float(self.getValue('Trig level'))
                 self.sendValueToOther('Trig level', trigLev)
         elif quant.name in ('Modulation frequency', 'Skip start', 'Length',
-                            'Use Ch2 as reference'):
+                            'Use Ch2 as reference', 'Integer data transfer'):
              # do nothing for these quantities, the value will be stored in local quant
              pass
         # finish set value with get value, to make sure we catch any coercing
@@ -250,7 +250,8 @@ class Driver(InstrumentDriver.InstrumentWorker):
                 else:
                     value = self.lTrace[indx]
         elif quant.name in ('Modulation frequency', 'Skip start', 'Length',
-                            'Use Ch2 as reference', 'Enable demodulation'):
+                            'Use Ch2 as reference', 'Enable demodulation',
+                            'Integer data transfer'):
             # just return the quantity value
             value = quant.getValue()
         return value
@@ -275,8 +276,10 @@ class Driver(InstrumentDriver.InstrumentWorker):
             (seq_no, n_seq) = self.getHardwareLoopIndex(options)
             nSample = int(self.getValue('Number of samples'))
             nAverage = int(self.getValue('Number of averages'))
+            bInteger = bool(self.getValue('Integer data transfer'))
             self.dig.getRoundRobinData(nSample, n_seq, nAverage, 
-                                       bConfig=True, bArm=True, bMeasure=False)
+                                       bConfig=True, bArm=True, bMeasure=False,
+                                       bInteger=bInteger)
         else:
             self.getTraces(bArm=True, bMeasure=False)
 
@@ -331,16 +334,17 @@ class Driver(InstrumentDriver.InstrumentWorker):
             lChannel.append(2)
         aqType = self.getValue('Acquisition type')
         bAverageMode = True if aqType == 'Average' else False
+        bInteger = bool(self.getValue('Integer data transfer'))
         if bMeasure:
             (vData, self.dt) = self.dig.readChannelsToNumpy(nSample, lChannel=lChannel, nAverage=nAverage,
                             nSegment=nSegment, timeout=int(1000*self.timeout), 
                             bAverageMode=bAverageMode,
-                            bArm=bArm, bMeasure=bMeasure)
+                            bArm=bArm, bMeasure=bMeasure, bInteger=bInteger)
         else:
             self.dig.readChannelsToNumpy(nSample, lChannel=lChannel, nAverage=nAverage,
                             nSegment=nSegment, timeout=int(1000*self.timeout), 
                             bAverageMode=bAverageMode,
-                            bArm=bArm, bMeasure=bMeasure)
+                            bArm=bArm, bMeasure=bMeasure, bInteger=bInteger)
             return
         # put the resulting data in arrays for Ch1/Ch2
         if bGetCh1:
@@ -15,8 +15,9 @@ class Driver(InstrumentDriver.InstrumentWorker):
         """Perform the operation of opening the instrument connection"""
         # init object
         self.dig = None
-        # keep track of sampled traces
+        # keep track of sampled traces, and demodulated values of each tone
         self.lTrace = [np.array([]), np.array([])]
+        self.lDemod = np.zeros((0, 0), dtype=complex)
         self.signal_index = {
             'Ch1 - Data': 0,
             'Ch2 - Data': 1,
@@ -24,6 +25,10 @@ class Driver(InstrumentDriver.InstrumentWorker):
         # add single-frequency values
         for n in range(9):
             self.signal_index['FFT - Value %d' % (n+1)] = 0
+        # add demodulated values, index is tone
+        for n in range(9):
+            self.signal_index['Demodulation - Value %d' % (n+1)] = n
+            self.signal_index['Demodulation - Data %d' % (n+1)] = n
         self.dt = 1.0
         # open connection
         boardId = int(self.comCfg.address)
@@ -70,6 +75,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
             if self.isFirstCall(options):
                 # clear trace buffer
                 self.lTrace = [np.array([]), np.array([])]
+                self.lDemod = np.zeros((0, 0), dtype=complex)
                 # read traced to buffer, proceed depending on model
                 if self.getModel() in ('9870',):
                     self.getTracesNonDMA()
@@ -101,6 +107,7 @@ class Driver(InstrumentDriver.InstrumentWorker):
         nMemSize = int(self.getValue('Max buffer size'))
         nMaxBuffer = int(self.getValue('Max number of buffers'))
         fft_config = self.get_fft_config()
+        demod_config = self.get_demod_config()
         if (not bGetCh1) and (not bGetCh2):
             return
         # configure and start acquisition
@@ -116,10 +123,13 @@ class Driver(InstrumentDriver.InstrumentWorker):
                                    fft_config=fft_config)
         else:
             # if not hardware looping, just trig the card, buffers are already configured 
+            # in background mode, traces are acquired while other instruments are set
+            bBackground = bool(self.getValue('Background acquisition'))
             self.dig.readTracesDMA(bGetCh1, bGetCh2, nSample, nRecord, nBuffer, nAverage,
-                                   bConfig=False, bArm=True, bMeasure=False,
+                                   bConfig=False, bArm=True, bMeasure=bBackground,
                                    bufferSize=nMemSize, maxBuffers=nMaxBuffer,
-                                   fft_config=fft_config)
+                                   fft_config=fft_config, bBackground=bBackground,
+                                   demod_config=demod_config)
 
 
     def _callbackProgress(self, progress):
@@ -141,10 +151,11 @@ class Driver(InstrumentDriver.InstrumentWorker):
             nMemSize = int(self.getValue('Max buffer size'))
             nMaxBuffer = int(self.getValue('Max number of buffers'))
             fft_config = self.get_fft_config()
+            demod_config = self.get_demod_config()
             # show status before starting acquisition
             self.reportStatus('Digitizer - Waiting for signal')
             # get data
-            (vCh1, vCh2) = self.dig.readTracesDMA(bGetCh1, bGetCh2,
+            vData = self.dig.readTracesDMA(bGetCh1, bGetCh2,
                            nSample, n_seq, nBuffer, nAverage,
                            bConfig=False, bArm=False, bMeasure=True,
                            funcStop=self.isStopped,
@@ -152,11 +163,19 @@ class Driver(InstrumentDriver.InstrumentWorker):
                            firstTimeout=self.dComCfg['Timeout']+180.0,
                            bufferSize=nMemSize,
                            maxBuffers=nMaxBuffer,
-                           fft_config=fft_config)
+                           fft_config=fft_config,
+                           demod_config=demod_config)
+            self.setTraces(vData)
             # re-shape data and place in trace buffer
-            nSample = len(vCh1) / n_seq
-            self.lTrace[0] = vCh1.reshape((n_seq, nSample))
-            self.lTrace[1] = vCh2.reshape((n_seq, nSample))
+            nSample = len(self.lTrace[0]) // n_seq
+            self.lTrace[0] = self.lTrace[0].reshape((n_seq, nSample))
+            self.lTrace[1] = self.lTrace[1].reshape((n_seq, nSample))
+            # demodulated values with shape (tones, values per step, n_seq)
+            if self.lDemod.size > 0:
+                self.lDemod = self.lDemod.reshape(
+                    (self.lDemod.shape[0], -1, n_seq))
+            else:
+                self.lDemod = np.zeros((0, 0, n_seq), dtype=complex)
         # after getting data, pick values to return
         value = self.extract_trace_value(quant, seq_no)
         return value
@@ -286,17 +305,33 @@ class Driver(InstrumentDriver.InstrumentWorker):
         nMemSize = int(self.getValue('Max buffer size'))
         nMaxBuffer = int(self.getValue('Max number of buffers'))
         fft_config = self.get_fft_config()
+        demod_config = self.get_demod_config()
         # in hardware trig mode, there is no noed to re-arm the card
         bArm = not hardware_trig
+        # get data from background acquisition started when arming
+        if hardware_trig and self.dig.hasAcquisitionDMA():
+            self.setTraces(self.dig.getTracesDMAResult(
+                funcStop=self.isStopped))
+            return
         # get data
-        self.lTrace[0], self.lTrace[1] = self.dig.readTracesDMA(
+        self.setTraces(self.dig.readTracesDMA(
             bGetCh1, bGetCh2,
             nPostSize, nRecord, nBuffer, nAverage,
             bConfig=False, bArm=bArm, bMeasure=True,
             funcStop=self.isStopped,
             bufferSize=nMemSize,
             maxBuffers=nMaxBuffer,
-            fft_config=fft_config)
+            fft_config=fft_config,
+            demod_config=demod_config))
+
+
+    def setTraces(self, vData):
+        """Keep traces, and demodulated values if returned by the digitizer"""
+        self.lTrace[0], self.lTrace[1] = vData[0], vData[1]
+        if len(vData) > 2:
+            self.lDemod = vData[2]
+        else:
+            self.lDemod = np.zeros((0, 0), dtype=complex)
 
 
     def getTracesNonDMA(self):
@@ -350,6 +385,24 @@ class Driver(InstrumentDriver.InstrumentWorker):
         d['df'] = 1 / (self.dt*fft_length)
         return d
 
+    def get_demod_config(self):
+        """Get demodulation configuration, with one dict per tone"""
+        d = {}
+        d['enabled'] = bool(self.getValue('Demodulation - Enabled'))
+        d['channel'] = 1 + self.getValueIndex('Demodulation - Channel')
+        d['single_shot'] = (
+            self.getValue('Demodulation - Output') == 'Single shot')
+        d['dt'] = self.dt
+        n_tone = int(self.getValue('Demodulation - Number of tones'))
+        d['tones'] = []
+        for n in range(n_tone):
+            d['tones'].append({
+                'frequency': self.getValue('Demodulation - Frequency %d' % (n+1)),
+                'skip': self.getValue('Demodulation - Skip start %d' % (n+1)),
+                'length': self.getValue('Demodulation - Length %d' % (n+1)),
+                'window': self.getValue('Demodulation - Window %d' % (n+1))})
+        return d
+
     def extract_trace_value(self, quant, record=None):
         """Get value from traces, either as pure data, fft, or fft value
         
@@ -361,6 +414,8 @@ class Driver(InstrumentDriver.InstrumentWorker):
             Record to get, by default None
         """
         indx = self.signal_index[quant.name]
+        if quant.name.startswith('Demodulation - '):
+            return self.extract_demod_value(quant, indx, record)
         # return correct data
         fft_config = self.get_fft_config()
         dt = fft_config['df'] if fft_config['enabled'] else self.dt
@@ -380,6 +435,28 @@ class Driver(InstrumentDriver.InstrumentWorker):
             value = float(interp1(freq))
         return value
 
+    def extract_demod_value(self, quant, tone, record=None):
+        """Get average or all demodulated values of a tone
+
+        Parameters
+        ----------
+        quant : Quantity
+            Quantity to extract
+        tone : int
+            Index of tone
+        record : int, optional
+            Step of hardware loop, by default None
+        """
+        if tone < self.lDemod.shape[0]:
+            vIQ = self.lDemod[tone]
+            if record is not None:
+                vIQ = vIQ[:, record]
+        else:
+            vIQ = np.zeros(0, dtype=complex)
+        if quant.name.startswith('Demodulation - Value'):
+            return complex(np.mean(vIQ)) if len(vIQ) > 0 else 0j
+        return quant.getTraceDict(vIQ, dt=1.0)
+
 
 if __name__ == '__main__':
     pass
@@ -8,6 +8,13 @@ import numpy as np
 import logging
 log = logging.getLogger('LabberDriver')
 import time
+import threading
+import queue
+try:
+    from queue import SimpleQueue
+except ImportError:
+    # python < 3.7
+    from queue import Queue as SimpleQueue
 
 # define constants
 ADMA_NPT = 0x200
@@ -101,6 +108,314 @@ class Error(Exception):
 class TimeoutError(Error):
     pass
 
+
+class BufferDemodulation:
+    """Demodulate the records of DMA buffers, with one kernel per tone
+
+    Records are integrated with cosine and sine kernels, weighted by the
+    window and normalized to give the amplitude of each tone. Tones with the
+    same skip and length are demodulated with one matrix product.
+    """
+
+    WINDOWS = {'None': None,
+               'Hanning': np.hanning,
+               'Hamming': np.hamming,
+               'Blackman': np.blackman,
+               'Bartlett': np.bartlett}
+
+    def __init__(self, demod_config, samplesPerRecord, samplesPerRecordValue,
+                 nRecord, nAverage, nAvPerBuffer, recordsPerAcquisition,
+                 channels, channelCount, range1, range2, offset):
+        channel = demod_config.get('channel', 1)
+        if not channels & channel:
+            raise Error('Channel %d must be enabled for demodulation.' %
+                        channel)
+        # column of the channel, if channels are interleaved
+        self.channelIndex = (channel - 1) if channelCount > 1 else 0
+        self.vRange = range1 if channel == 1 else range2
+        self.offset = offset
+        self.samplesPerRecord = samplesPerRecord
+        self.channelCount = channelCount
+        self.nRecord = nRecord
+        self.nAverage = nAverage
+        self.nAvPerBuffer = nAvPerBuffer
+        self.singleShot = demod_config.get('single_shot', False)
+        tones = demod_config['tones']
+        self.nTone = len(tones)
+        # group tones with same integration interval
+        dt = demod_config['dt']
+        groups = {}
+        for n, tone in enumerate(tones):
+            skip = int(round(tone['skip'] / dt))
+            length = 1 + int(round(tone['length'] / dt))
+            length = min(length, samplesPerRecordValue - skip)
+            if length <= 1:
+                raise Error('Demodulation length of tone %d is too short.' %
+                            (n + 1))
+            groups.setdefault((skip, length), []).append(n)
+        self.kernels = []
+        for (skip, length), indices in groups.items():
+            vTime = dt * (skip + np.arange(length, dtype=float))
+            lFreq = [tones[n]['frequency'] for n in indices]
+            mPhase = 2*np.pi * np.outer(vTime, lFreq)
+            mWeight = np.column_stack(
+                [self.getWeight(tones[n].get('window', 'None'), length)
+                 for n in indices])
+            mKernel = np.hstack((mWeight * np.cos(mPhase),
+                                 mWeight * np.sin(mPhase)))
+            # offset of sample codes is subtracted after integration
+            self.kernels.append((skip, length, indices, mKernel,
+                                 mKernel.sum(0)))
+        if self.singleShot:
+            self.vIQ = np.zeros((self.nTone, recordsPerAcquisition),
+                                dtype=complex)
+            self.nRecordTotal = nRecord * nAverage
+        else:
+            self.vIQ = np.zeros((self.nTone, nRecord), dtype=complex)
+            self.nSum = 0
+        self.recordsCompleted = 0
+
+    @classmethod
+    def getWeight(cls, window, length):
+        """Get integration weights, normalized to give tone amplitude"""
+        func = cls.WINDOWS.get(window)
+        if func is None:
+            # trapezoidal integration
+            vWindow = np.ones(length)
+            vWindow[0] = vWindow[-1] = 0.5
+        else:
+            vWindow = func(length)
+        return 2. * vWindow / vWindow.sum()
+
+    def add(self, buf):
+        """Demodulate all records in a completed buffer"""
+        mCode = buf.reshape((-1, self.samplesPerRecord, self.channelCount))
+        mCode = mCode[:, :, self.channelIndex]
+        nRecordBuffer = mCode.shape[0]
+        mIQ = np.zeros((self.nTone, nRecordBuffer), dtype=complex)
+        for skip, length, indices, mKernel, vKernelSum in self.kernels:
+            mRes = np.dot(mCode[:, skip:skip + length], mKernel)
+            mRes -= self.offset * vKernelSum
+            mRes *= self.vRange
+            nTone = len(indices)
+            mIQ[indices] = (mRes[:, :nTone] + 1j*mRes[:, nTone:]).T
+        if self.singleShot:
+            n0 = self.recordsCompleted
+            self.vIQ[:, n0:n0 + nRecordBuffer] = mIQ
+        else:
+            self.vIQ += mIQ.reshape(
+                (self.nTone, self.nAvPerBuffer, self.nRecord)).sum(1)
+            self.nSum += self.nAvPerBuffer
+        self.recordsCompleted += nRecordBuffer
+
+    def getValues(self):
+        """Get I/Q values with shape (tones, records)"""
+        if self.singleShot:
+            return self.vIQ[:, :self.nRecordTotal]
+        return self.vIQ / float(max(1, self.nSum))
+
+
+class BufferReduction:
+    """Convert and average DMA buffers to traces, one buffer at a time"""
+
+    def __init__(self, nPtsOut, nAverage, nAvPerBuffer, buffersPerAcquisition,
+                 channels, channelCount, sampleType, range1, range2, offset,
+                 trim=None, logOffset=None, demodulation=None):
+        self.nAverage = nAverage
+        self.nAvPerBuffer = nAvPerBuffer
+        self.buffersPerAcquisition = buffersPerAcquisition
+        self.nPtsOut = nPtsOut
+        self.channels = channels
+        self.channelCount = channelCount
+        self.range1 = range1
+        self.range2 = range2
+        self.offset = offset
+        # (nRecord, samplesPerRecord, samplesPerRecordValue), if the records
+        # are longer than requested due to 128-sample alignment
+        self.trim = trim
+        # offset of log amplitude FFT output
+        self.logOffset = logOffset
+        # if demodulating, only I/Q values of the records are kept
+        self.demodulation = demodulation
+        if demodulation is not None:
+            return
+        self.vData = [np.zeros(nPtsOut, dtype=float),
+                      np.zeros(nPtsOut, dtype=float)]
+        if nAverage > 1:
+            # sum raw sample codes of all buffers, scaling and offset
+            # are applied once at the end
+            self.nSum = nAvPerBuffer * buffersPerAcquisition
+            if sampleType.kind == 'f':
+                sumType = self.bufferSumType = np.float64
+            else:
+                # sum of one buffer fits in 32 bits for typical sizes,
+                # which is faster than summing in 64 bits
+                sumType = np.int64
+                if nAvPerBuffer * 2.0**(8 * sampleType.itemsize) < 2**31:
+                    self.bufferSumType = np.int32
+                else:
+                    self.bufferSumType = np.int64
+            self.vSum = np.zeros(nPtsOut * channelCount, dtype=sumType)
+
+    def add(self, buf):
+        """Add data from a completed buffer, without extra elements"""
+        # reshape, sort and average data
+        if self.demodulation is not None:
+            self.demodulation.add(buf)
+        elif self.nAverage > 1:
+            # records are summed without conversion, channels are
+            # interleaved and separated at the end
+            rs = buf.reshape((self.nAvPerBuffer,
+                              self.nPtsOut * self.channelCount))
+            self.vSum += rs.sum(0, dtype=self.bufferSumType)
+        else:
+            self.vData = self._convert(buf, self.vData)
+        #
+        # Sample codes are unsigned by default. As a result:
+        # - 0x00 represents a negative full scale input signal.
+        # - 0x80 represents a ~0V signal.
+        # - 0xFF represents a positive full scale input signal.
+
+    def _convert(self, codes, vData):
+        """Convert interleaved codes to voltages of each channel"""
+        if self.channels == 1:
+            vData[0] = self.range1 * (codes - self.offset)
+        elif self.channels == 2:
+            vData[1] = self.range2 * (codes - self.offset)
+        elif self.channels == 3:
+            rs = codes.reshape((self.nPtsOut, 2))
+            vData[0] = self.range1 * (rs[:, 0] - self.offset)
+            vData[1] = self.range2 * (rs[:, 1] - self.offset)
+        return vData
+
+    def getTraces(self):
+        """Get averaged traces of all added buffers"""
+        if self.demodulation is not None:
+            return [np.array([], dtype=float), np.array([], dtype=float),
+                    self.demodulation.getValues()]
+        vData = self.vData
+        # normalize
+        if self.nAverage > 1:
+            # convert summed codes to average voltage
+            vData = self._convert(self.vSum / float(self.nSum), vData)
+        else:
+            vData[0] /= self.buffersPerAcquisition
+            vData[1] /= self.buffersPerAcquisition
+        # return data - requested length, not restricted to 128 multiple
+        if self.trim is not None:
+            (nRecord, samplesPerRecord, samplesPerRecordValue) = self.trim
+            for n in range(2):
+                if len(vData[n]) > 0:
+                    vData[n] = (
+                        vData[n].reshape((nRecord, samplesPerRecord))
+                        [:, :samplesPerRecordValue].flatten())
+        if self.logOffset is not None:
+            # log amp, 32bit float, re-scale by subtracting
+            vData[0] *= 0.1
+            vData[0] += self.logOffset
+        return vData
+
+
+class BackgroundAcquisition:
+    """Acquire DMA buffers in one worker thread and reduce them in another
+
+    The acquisition thread owns the DMA buffers. It waits for each buffer,
+    copies the data and posts the buffer back to the board right away, so
+    the board never waits for the averaging. The copies are passed to the
+    reduction thread through a queue, and re-used once reduced.
+    """
+
+    def __init__(self, dig, reduction, buffersPerAcquisition,
+                 nSamplesBuffer, timeout, firstTimeout, fft=False):
+        self.dig = dig
+        self.reduction = reduction
+        self.buffersPerAcquisition = buffersPerAcquisition
+        self.nSamplesBuffer = nSamplesBuffer
+        self.timeout = timeout
+        self.firstTimeout = firstTimeout
+        self.fft = fft
+        self.buffersCompleted = 0
+        self.error = None
+        self.traces = None
+        self.stopEvent = threading.Event()
+        self.doneEvent = threading.Event()
+        # buffer copies waiting for reduction, and copies free for re-use
+        self.filled = SimpleQueue()
+        self.free = SimpleQueue()
+        self.acquisitionThread = threading.Thread(
+            target=self._acquire, name='AlazarTech acquisition')
+        self.acquisitionThread.daemon = True
+        self.reductionThread = threading.Thread(
+            target=self._reduce, name='AlazarTech reduction')
+        self.reductionThread.daemon = True
+
+    def start(self):
+        """Start threads, the board must be armed with all buffers posted"""
+        self.acquisitionThread.start()
+        self.reductionThread.start()
+
+    def stop(self):
+        """Stop acquiring, traces are averaged from the completed buffers"""
+        if not self.acquisitionThread.is_alive():
+            return
+        self.stopEvent.set()
+        # cancel the buffer wait of the acquisition thread
+        self.dig.abortAsyncReadDMA(self.fft)
+        self.acquisitionThread.join()
+
+    def wait(self, timeout=None):
+        """Wait for the traces, returns True if done"""
+        return self.doneEvent.wait(timeout)
+
+    def _acquire(self):
+        buffers = self.dig.buffers
+        timeout_ms = int(self.firstTimeout*1000)
+        try:
+            while (self.buffersCompleted < self.buffersPerAcquisition):
+                # Wait for the buffer at the head of the list of available
+                # buffers to be filled by the board.
+                buf = buffers[self.buffersCompleted % len(buffers)]
+                self.dig.AlazarWaitAsyncBufferComplete(
+                    buf.addr, timeout_ms=timeout_ms)
+                # reset timeout time, can be different than first call
+                timeout_ms = int(self.timeout*1000)
+                if self.stopEvent.is_set():
+                    break
+                # copy data and give buffer back to board before reducing
+                data = buf.buffer[:self.nSamplesBuffer]
+                try:
+                    copy = self.free.get(block=False)
+                except queue.Empty:
+                    copy = np.empty_like(data)
+                np.copyto(copy, data)
+                self.buffersCompleted += 1
+                if (self.buffersCompleted < self.buffersPerAcquisition):
+                    self.dig.AlazarPostAsyncBuffer(buf.addr, buf.size_bytes)
+                self.filled.put(copy)
+        except Exception as e:
+            # the wait fails if the acquisition is stopped from outside
+            if not self.stopEvent.is_set():
+                self.error = e
+        finally:
+            # release resources
+            self.dig.abortAsyncReadDMA(self.fft)
+            self.filled.put(None)
+
+    def _reduce(self):
+        try:
+            while True:
+                copy = self.filled.get()
+                if copy is None:
+                    break
+                self.reduction.add(copy)
+                self.free.put(copy)
+            self.traces = self.reduction.getTraces()
+        except Exception as e:
+            self.error = e
+            self.stop()
+        finally:
+            self.doneEvent.set()
+
 class AlazarTechDigitizer():
     """Represent the Alazartech digitizer, redefines the dll functions in python"""
 
@@ -129,6 +444,11 @@ class AlazarTechDigitizer():
             self.fft_enabled = False
             self.fft_module = None
         self.ignore_buffer_overflow = False
+        # background acquisitions, one slot is being acquired while the
+        # previous one can still be reduced and its traces read out
+        self.acquisitionSlots = [None, None]
+        self.acquisitionIndex = 0
+        self.acquisition = None
 
     def testLED(self):
         import time
@@ -374,11 +694,27 @@ class AlazarTechDigitizer():
                       bConfig=True, bArm=True, bMeasure=True,
                       funcStop=None, funcProgress=None, timeout=None, bufferSize=512,
                       firstTimeout=None, maxBuffers=1024,
-                      fft_config={'enabled': False}):
-        """read traces in NPT AutoDMA mode, convert to float, average to single trace"""
+                      fft_config={'enabled': False}, bBackground=False,
+                      demod_config={'enabled': False}):
+        """read traces in NPT AutoDMA mode, convert to float, average to single trace
+
+        If bBackground is True, the traces are acquired in background threads
+        and this function returns directly, use getTracesDMAResult to get
+        the traces.
+
+        If demodulation is enabled, the records are demodulated as the buffers
+        complete. Empty traces are returned for both channels, followed by an
+        array with complex I/Q values of all tones, with shape (tones,
+        records). The values are averaged over the number of averages, or
+        kept for all records in single-shot mode.
+        """
         t0 = time.perf_counter()
         lT = []
 
+        # the board can not be re-configured or re-armed while acquiring
+        if bConfig or bArm:
+            self.stopAcquisitionDMA()
+
         # use global timeout if not given
         timeout = self.timeout if timeout is None else timeout
         # first timeout can be different in case of slow initial arming
@@ -463,10 +799,6 @@ class AlazarTechDigitizer():
         bufferCount = max(1, 2*maxBufferCount)
         # don't allocate more buffers than needed for all data
         bufferCount = min(bufferCount, buffersPerAcquisition, maxBuffers)
-        # initialize data array, if measure
-        if bMeasure:
-            vData = [np.zeros(nPtsOut, dtype=float),
-                     np.zeros(nPtsOut, dtype=float)]
 
         lT.append('Total buffers needed: %d' % buffersPerAcquisition)
         lT.append('Buffer count: %d' % bufferCount)
@@ -555,24 +887,55 @@ class AlazarTechDigitizer():
         if not bMeasure:
             return
 
+        nAvPerBuffer = int(recordsPerBuffer // nRecord)
+        # range and zero for conversion to voltages
+        trim = None
+        logOffset = None
+        if fft_config.get('enabled', False):
+            range1 = range2 = self.fft_scale
+            offset = 0.0
+            if fft_config['output'] in (11, ):
+                logOffset = np.log10(
+                    ((self.dRange[1] / 2**(self.bitsPerSample - 1)) /
+                    (fftLength / 2))**2)
+        else:
+            codeZero = 2 ** (float(self.bitsPerSample) - 1) - 0.5
+            codeRange = 2 ** (float(self.bitsPerSample) - 1) - 0.5
+            # range and zero for each channel, combined with bit shifting
+            range1 = self.dRange[1]/codeRange/16.
+            range2 = self.dRange[2]/codeRange/16.
+            offset = 16.*codeZero
+            if nPtsOut != (samplesPerRecordValue*nRecord):
+                trim = (nRecord, samplesPerRecord, samplesPerRecordValue)
+        demodulation = None
+        if (demod_config.get('enabled', False) and
+                not fft_config.get('enabled', False)):
+            demodulation = BufferDemodulation(
+                demod_config, samplesPerRecord, samplesPerRecordValue,
+                nRecord, nAverage, nAvPerBuffer, recordsPerAcquisition,
+                channels, channelCount, range1, range2, offset)
+        reduction = BufferReduction(
+            nPtsOut, nAverage, nAvPerBuffer, buffersPerAcquisition,
+            channels, channelCount, self.buffers[0].buffer.dtype,
+            range1, range2, offset, trim=trim, logOffset=logOffset,
+            demodulation=demodulation)
+        # remove extra elements for getting even 256*16 buffer sizes
+        if bytesPerBuffer == bytesPerBufferMem:
+            nSamplesBuffer = None
+        else:
+            nSamplesBuffer = int(bytesPerBuffer//bytesPerSample)
+
+        if bBackground:
+            self.startAcquisitionDMA(BackgroundAcquisition(
+                self, reduction, buffersPerAcquisition, nSamplesBuffer,
+                timeout, firstTimeout, fft_config.get('enabled', False)))
+            return
+
         lT.append('Post: %.1f ms' % ((time.perf_counter()-t0)*1000))
         try:
             lT.append('Start: %.1f ms' % ((time.perf_counter()-t0)*1000))
             buffersCompleted = 0
             bytesTransferred = 0
-            nAvPerBuffer = int(recordsPerBuffer // nRecord)
-            # range and zero for conversion to voltages
-            if fft_config.get('enabled', False):
-                range1 = self.fft_scale
-                offset = 0.0
-            else:
-                codeZero = 2 ** (float(self.bitsPerSample) - 1) - 0.5
-                codeRange = 2 ** (float(self.bitsPerSample) - 1) - 0.5
-                # range and zero for each channel, combined with bit shifting
-                range1 = self.dRange[1]/codeRange/16.
-                range2 = self.dRange[2]/codeRange/16.
-                offset = 16.*codeZero
-
             timeout_ms = int(firstTimeout*1000)
 
             while (buffersCompleted < buffersPerAcquisition):
@@ -595,42 +958,11 @@ class AlazarTechDigitizer():
                 if funcProgress is not None:
                     funcProgress(float(buffersCompleted)/float(buffersPerAcquisition))
 
-                # remove extra elements for getting even 256*16 buffer sizes
-                if bytesPerBuffer == bytesPerBufferMem:
-                    buf_truncated = buf.buffer
-                else:
-                    buf_truncated = buf.buffer[:int(bytesPerBuffer//bytesPerSample)]
-
-                # reshape, sort and average data
-                if nAverage > 1:
-                    if channels == 1:
-                        rs = buf_truncated.reshape((nAvPerBuffer, nPtsOut))
-                        vData[0] += range1 * (np.mean(rs, 0) - offset)
-                    elif channels == 2:
-                        rs = buf_truncated.reshape((nAvPerBuffer, nPtsOut))
-                        vData[1] += range2 * (np.mean(rs, 0) - offset)
-                    elif channels == 3:
-                        rs = buf_truncated.reshape((nAvPerBuffer, nPtsOut, 2))
-                        vData[0] += range1 * (np.mean(rs[:, :, 0], 0) - offset)
-                        vData[1] += range2 * (np.mean(rs[:, :, 1], 0) - offset)
-                else:
-                    if channels == 1:
-                        vData[0] = range1 * (buf_truncated - offset)
-                    elif channels == 2:
-                        vData[1] = range2 * (buf_truncated - offset)
-                    elif channels == 3:
-                        rs = buf_truncated.reshape((nPtsOut, 2))
-                        vData[0] = range1 * (rs[:, 0] - offset)
-                        vData[1] = range2 * (rs[:, 1] - offset)
+                reduction.add(buf.buffer[:nSamplesBuffer])
 
                 # lT.append('Sort/Avg: %.1f ms' % ((time.perf_counter()-t0)*1000))
                 # log.info(str(lT))
                 # lT = []
-                #
-                # Sample codes are unsigned by default. As a result:
-                # - 0x00 represents a negative full scale input signal.
-                # - 0x80 represents a ~0V signal.
-                # - 0xFF represents a positive full scale input signal.
     
                 # Add the buffer to the end of the list of available buffers.
                 if (buffersCompleted < buffersPerAcquisition):
@@ -644,45 +976,75 @@ class AlazarTechDigitizer():
                 raise e
         finally:
             # release resources
-            try:
-                if fft_config.get('enabled', False):
-                    self.AlazarDSPAbortCapture()
-                else:
-                    self.AlazarAbortAsyncRead()
-            except Exception:
-                pass
+            self.abortAsyncReadDMA(fft_config.get('enabled', False))
             lT.append('Abort: %.1f ms' % ((time.perf_counter()-t0)*1000))
-        # normalize
-        # log.info('Average: %.1f ms' % np.mean(lAvTime))
-        vData[0] /= buffersPerAcquisition
-        vData[1] /= buffersPerAcquisition
+        vData = reduction.getTraces()
         # # log timing information
         lT.append('Done: %.1f ms' % ((time.perf_counter()-t0)*1000))
         log.info(str(lT))
-        if not fft_config.get('enabled', False):
-            # return data - requested length, not restricted to 128 multiple
-            if nPtsOut != (samplesPerRecordValue*nRecord):
-                if len(vData[0]) > 0:
-                    vData[0] = (
-                        vData[0].reshape((nRecord, samplesPerRecord))
-                        [:, :samplesPerRecordValue].flatten())
-                if len(vData[1]) > 0:
-                    vData[1] = (
-                        vData[1].reshape((nRecord, samplesPerRecord))
-                        [:, :samplesPerRecordValue].flatten())
-
-        else:
-            if fft_config['output'] in (11, ):
-                # log amp, 32bit float, re-scale by subtracting
-                vData[0] *= 0.1
-                vData[0] += np.log10(
-                    ((self.dRange[1] / 2**(self.bitsPerSample - 1)) /
-                    (fftLength / 2))**2)
         return vData
 
 
+    def abortAsyncReadDMA(self, fft=False):
+        """Stop DMA acquisition, ignoring errors"""
+        try:
+            if fft:
+                self.AlazarDSPAbortCapture()
+            else:
+                self.AlazarAbortAsyncRead()
+        except Exception:
+            pass
+
+
+    def startAcquisitionDMA(self, acquisition):
+        """Start background acquisition on armed board, in next free slot"""
+        self.acquisitionIndex = (self.acquisitionIndex + 1) % 2
+        # traces of the acquisition before the previous one must be done
+        old = self.acquisitionSlots[self.acquisitionIndex]
+        if old is not None:
+            old.wait()
+        self.acquisitionSlots[self.acquisitionIndex] = acquisition
+        self.acquisition = acquisition
+        acquisition.start()
+
+
+    def stopAcquisitionDMA(self):
+        """Stop background acquisition, if running"""
+        for acquisition in self.acquisitionSlots:
+            if acquisition is not None:
+                acquisition.stop()
+
+
+    def hasAcquisitionDMA(self):
+        """Return True if traces of a background acquisition can be read"""
+        return self.acquisition is not None
+
+
+    def getTracesDMAResult(self, funcStop=None, funcProgress=None):
+        """Wait for and return traces of the latest background acquisition"""
+        acquisition = self.acquisition
+        if acquisition is None:
+            raise Error('No background acquisition has been started.')
+        while not acquisition.wait(0.05):
+            # stop acquisition if stopped from outside
+            if funcStop is not None and funcStop():
+                acquisition.stop()
+            elif funcProgress is not None:
+                funcProgress(float(acquisition.buffersCompleted) /
+                             float(acquisition.buffersPerAcquisition))
+        self.acquisition = None
+        if acquisition.error is not None and not self.ignore_buffer_overflow:
+            try:
+                self.removeBuffersDMA()
+            except Exception:
+                pass
+            raise acquisition.error
+        return acquisition.traces
+
+
     def removeBuffersDMA(self):
         """Clear and remove DMA buffers, to release memory"""
+        self.stopAcquisitionDMA()
         # make sure buffers release memory
         for buf in self.buffers:
             buf.__exit__()
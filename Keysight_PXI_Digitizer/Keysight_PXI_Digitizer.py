@@ -5,6 +5,8 @@ sys.path.append('C:\Program Files (x86)\Keysight\SD1\Libraries\Python')
 from BaseDriver import LabberDriver, Error, IdError
 import keysightSD1
 
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import numpy as np
 
 
@@ -50,6 +52,14 @@ class Driver(LabberDriver):
             self.nCh = 4
         # create list of sampled data
         self.lTrace = [np.array([])] * self.nCh
+        # receive buffers and accumulators, kept between acquisitions
+        self.lBuffer = [None] * self.nCh
+        self.lSum = [None] * self.nCh
+        # channels are accumulated concurrently in worker threads. The SD1
+        # library is not documented as thread-safe, so calls to the module
+        # are serialized with a lock
+        self.pool = ThreadPoolExecutor(max_workers=self.nCh)
+        self.lockDAQ = threading.Lock()
         self.dig.openWithSlot(AWGPart, self.chassis, int(self.comCfg.address))
         # get hardware version - changes numbering of channels
         hw_version = self.dig.getHardwareVersion()
@@ -76,6 +86,7 @@ class Driver(LabberDriver):
                 self.log('Close ch:', n, self.dig.DAQflush(self.getHwCh(n)))
             # close instrument
             self.dig.close()
+            self.pool.shutdown()
         except:
             # never return error here
             pass
@@ -208,8 +219,6 @@ class Driver(LabberDriver):
             self.lTrace = [np.array([])] * self.nCh
             # configure trigger for all active channels
             for nCh in lCh:
-                # init data
-                self.lTrace[nCh] = np.zeros((nSeg * nPts))
                 # channel number depens on hardware version
                 ch = self.getHwCh(nCh)
                 # extra config for trig mode
@@ -232,19 +241,22 @@ class Driver(LabberDriver):
             self.dig.DAQstartMultiple(iChMask)
         # lT.append('Start %.1f ms' % (1000*(time.perf_counter()-t0)))
         #
-        # return if not measure
-        if not bMeasure:
+        # return if not measure, or no active channels
+        if not bMeasure or len(lCh) == 0:
             return
         # define number of cycles to read at a time
         nCycleTotal = nSeg * nAv
         nCall = int(np.ceil(nCycleTotal / nCyclePerCall))
         lScale = [(self.getRange(ch) / self.bitRange) for ch in range(self.nCh)]
+        timeOut = int(1000 + self.timeout_ms / nCall)
         # keep track of progress in percent
         old_percent = 0
 
         # proceed depending on segment or not segment
         if nSeg <= 1:
-            # non-segmented acquisiton
+            # non-segmented acquisiton, records are summed to one trace
+            self.initBuffers(lCh, nPts * min(nCyclePerCall, nCycleTotal),
+                             nPts, nCycleTotal)
             for n in range(nCall):
                 # number of cycles for this call, could be fewer for last call
                 nCycle = min(nCyclePerCall, nCycleTotal - (n * nCyclePerCall))
@@ -257,22 +269,11 @@ class Driver(LabberDriver):
                         self.reportStatus(
                             'Acquiring traces ({}%)'.format(new_percent))
 
-                # capture traces one by one
-                for nCh in lCh:
-                    # channel number depens on hardware version
-                    ch = self.getHwCh(nCh)
-                    data = self.DAQread(self.dig, ch, nPts * nCycle,
-                                        int(1000 + self.timeout_ms / nCall))
-                    # stop if no data
-                    if data.size == 0:
-                        return
-
-                    # average
-                    data = data.reshape((nCycle, nPts)).mean(0)
-                    # adjust scaling to account for summing averages
-                    scale = lScale[nCh] * (nCycle / nAv)
-                    # convert to voltage, add to total average
-                    self.lTrace[nCh] += data * scale
+                # capture traces of all channels at once
+                lSize = self.readChannels(lCh, nPts * nCycle, timeOut)
+                # stop if no data
+                if min(lSize) == 0:
+                    break
 
                 # break if stopped from outside
                 if self.isStopped():
@@ -289,9 +290,8 @@ class Driver(LabberDriver):
             else:
                 lCyclesSeg = [nCyclePerCall] * nCallSeg
                 lCyclesSeg[-1] = nCyclePerCall + extra_call
-            # pre-calculate scale, should include scaling for averaging
-            lScale = np.array(lScale, dtype=float) / nAv
-
+            # all data is stored in one long vector
+            self.initBuffers(lCh, nPts * max(lCyclesSeg), nSeg * nPts, nAv)
 
             for n in range(nAv):
                 # report progress, only report integer percent
@@ -303,34 +303,114 @@ class Driver(LabberDriver):
                             'Acquiring traces ({}%)'.format(new_percent))
 
                 count = 0
+                bNoData = False
                 # loop over number of calls per segment
                 for m, nCycle in enumerate(lCyclesSeg):
+                    # capture traces of all channels at once
+                    lSize = self.readChannels(
+                        lCh, nPts * nCycle, timeOut, index=count)
+                    # stop if no data
+                    if min(lSize) == 0:
+                        bNoData = True
+                        break
+                    count += nPts * nCycle
 
-                    # capture traces one by one
-                    for nCh in lCh:
-                        # channel number depens on hardware version
-                        ch = self.getHwCh(nCh)
-                        data = self.DAQread(self.dig, ch, nPts * nCycle,
-                                            int(1000 + self.timeout_ms / nCall))
-                        # stop if no data
-                        if data.size == 0:
-                            return
-                        # store all data in one long vector
-                        self.lTrace[nCh][count:(count + data.size)] += \
-                            data * lScale[nCh]
-
-                    count += data.size
-
-                # break if stopped from outside
-                if self.isStopped():
+                # break if no data or stopped from outside
+                if bNoData or self.isStopped():
                     break
 
                 # lT.append('N: %d, Tot %.1f ms' % (n, 1000 * (time.perf_counter() - t0)))
 
+        # convert summed sample codes to average voltage
+        for nCh in lCh:
+            self.lTrace[nCh] = self.lSum[nCh] * (lScale[nCh] / nAv)
+
         # # log timing info
         # self.log(': '.join(lT))
 
 
+    def initBuffers(self, lCh, nBuffer, nSum, nRecordSum):
+        """Make sure receive buffers and zeroed accumulators are available
+
+        Parameters
+        ----------
+        lCh : list of int
+            Active channels, starting at 0.
+        nBuffer : int
+            Number of points in largest read.
+        nSum : int
+            Number of points in accumulated trace.
+        nRecordSum : int
+            Number of records added to each point of the trace.
+        """
+        # sums of 16-bit codes fit in 32 bit for up to 2**16 records
+        if nRecordSum * 2**15 < 2**31:
+            sumType = np.int32
+        else:
+            sumType = np.int64
+        for nCh in lCh:
+            # buffers are only re-allocated if configuration changed
+            if self.lBuffer[nCh] is None or len(self.lBuffer[nCh]) < nBuffer:
+                self.lBuffer[nCh] = (keysightSD1.c_short * nBuffer)()
+            if (self.lSum[nCh] is None or self.lSum[nCh].size != nSum or
+                    self.lSum[nCh].dtype != sumType):
+                self.lSum[nCh] = np.zeros(nSum, dtype=sumType)
+            else:
+                self.lSum[nCh].fill(0)
+
+
+    def readChannels(self, lCh, nPoints, timeOut, index=None):
+        """Read data from all channels in worker threads, see `readChannel`
+
+        Reads from the module are done one at a time, while data already
+        read is added to the accumulators of other channels.
+
+        Returns
+        -------
+        list of int
+            Number of points read for each channel.
+        """
+        if len(lCh) == 1:
+            return [self.readChannel(lCh[0], nPoints, timeOut, index)]
+        futures = [self.pool.submit(self.readChannel, nCh, nPoints, timeOut,
+                                    index) for nCh in lCh]
+        return [future.result() for future in futures]
+
+
+    def readChannel(self, nCh, nPoints, timeOut, index=None):
+        """Read data to channel buffer and add it to the channel accumulator
+
+        Parameters
+        ----------
+        nCh : int
+            Channel, starting at 0.
+        nPoints : int
+            Number of points to read.
+        timeOut : int
+            Timeout in ms.
+        index : int, optional
+            If given, the data is added to the accumulator at this index,
+            otherwise all records are summed to the accumulator.
+
+        Returns
+        -------
+        int
+            Number of points read, zero if no data.
+        """
+        # channel number depens on hardware version
+        with self.lockDAQ:
+            data = self.DAQread(self.dig, self.getHwCh(nCh), nPoints,
+                                timeOut, self.lBuffer[nCh])
+        if data.size == 0:
+            return 0
+        vSum = self.lSum[nCh]
+        if index is None:
+            vSum += data.reshape((-1, vSum.size)).sum(0, dtype=vSum.dtype)
+        else:
+            vSum[index:(index + data.size)] += data
+        return data.size
+
+
     def getRange(self, ch):
         """Get channel range, as voltage.  Index start at 0"""
         rang = float(self.getCmdStringFromValue('Ch%d - Range' % (ch + 1)))
@@ -343,11 +423,12 @@ class Driver(LabberDriver):
         return rang
 
 
-    def DAQread(self, dig, nDAQ, nPoints, timeOut):
-        """Read data diretly to numpy array"""
+    def DAQread(self, dig, nDAQ, nPoints, timeOut, data=None):
+        """Read data diretly to numpy array, in given ctypes buffer if any"""
         if dig._SD_Object__handle > 0:
             if nPoints > 0:
-                data = (keysightSD1.c_short * nPoints)()
+                if data is None:
+                    data = (keysightSD1.c_short * nPoints)()
                 nPointsOut = dig._SD_Object__core_dll.SD_AIN_DAQread(dig._SD_Object__handle, nDAQ, data, nPoints, timeOut)
                 if nPointsOut > 0:
                     return np.frombuffer(data, dtype=np.int16, count=nPoints)
@@ -2,7 +2,7 @@
 import importlib
 import os
 import sys
-import copy
+import tempfile
 
 import numpy as np
 
@@ -10,7 +10,10 @@ from BaseDriver import LabberDriver
 from sequence_builtin import (
     CPMG, PulseTrain, Rabi, SpinLocking, ReadoutTraining)
 from sequence_rb import SingleQubit_RB, TwoQubit_RB
-from sequence import SequenceToWaveforms
+from sequence import (
+    CHANNEL_XY, CompilationPool, SequenceToWaveforms,
+    compile_multiple_sequences, compile_state_combinations)
+from waveform_cache import WaveformCache, get_config_key
 import logging
 log = logging.getLogger('LabberDriver')
 
@@ -24,6 +27,28 @@ SEQUENCES = {'Rabi': Rabi,
              'Readout training': ReadoutTraining,
              'Custom': type(None)}
 
+# quantities that do not affect the waveforms
+NON_WAVEFORM_QUANTITIES = ('Demodulation - ', 'Trace - ', 'Pulse list - ',
+                           'Compilation profile - ', 'Voltage, QB',
+                           'Single-shot, QB')
+# quantities that only affect how the waveforms are compiled
+COMPILER_QUANTITIES = ('Cache ', 'Incremental compilation',
+                       'Number of compilation processes',
+                       'Profile compilation')
+
+
+def _is_equal(a, b):
+    """Compare configuration values, which may contain numpy arrays."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return (a.keys() == b.keys() and
+                all(_is_equal(a[key], b[key]) for key in a))
+    if isinstance(a, np.ndarray) or isinstance(b, np.ndarray):
+        return np.array_equal(a, b)
+    try:
+        return bool(a == b)
+    except ValueError:
+        return False
+
 
 class Driver(LabberDriver):
     """This class implements a multi-qubit pulse generator."""
@@ -34,10 +59,20 @@ class Driver(LabberDriver):
         self.sequence = None
         self.sequence_to_waveforms = SequenceToWaveforms(1)
         self.waveforms = {}
+        # configuration used for last update, for tracking changes
+        self.config = None
+        self.waveforms_valid = False
+        self.cache = WaveformCache()
+        # processes for compiling multiple sequences, kept between calls
+        self.compilation_pool = CompilationPool()
         # always create a sequence at startup
         name = self.getValue('Sequence')
         self.sendValueToOther('Sequence', name)
 
+    def performClose(self, bError=False, options={}):
+        """Perform the close instrument connection operation."""
+        self.compilation_pool.close()
+
     def performSetValue(self, quant, value, sweepRate=0.0, options={}):
         """Perform the Set Value instrument operation."""
         # only do something here if changing the sequence type
@@ -61,6 +96,7 @@ class Driver(LabberDriver):
                 else:
                     # standard built-in sequence
                     self.sequence = new_type(1)
+                self.waveforms_valid = False
 
         elif (quant.name == 'Custom Python file' and
               self.getValue('Sequence') == 'Custom'):
@@ -73,6 +109,7 @@ class Driver(LabberDriver):
             # the custom sequence class has to be named 'CustomSequence'
             if not isinstance(self.sequence, mod.CustomSequence):
                 self.sequence = mod.CustomSequence(1)
+            self.waveforms_valid = False
         return value
 
     def performGetValue(self, quant, options={}):
@@ -82,14 +119,16 @@ class Driver(LabberDriver):
             return quant.getValue()
 
         # check type of quantity
-        if (quant.name.startswith('Voltage, QB') or
+        if quant.name == 'Compilation profile - Total time':
+            value = self.sequence_to_waveforms.timer.total()
+        elif quant.name == 'Compilation profile - Stages':
+            value = self.sequence_to_waveforms.timer.format()
+        elif (quant.name.startswith('Voltage, QB') or
                 quant.name.startswith('Single-shot, QB')):
             # perform demodulation, check if config is updated
             if self.isConfigUpdated():
                 # update sequence object with current driver configuation
-                config = self.instrCfg.getValuesDict()
-                self.sequence.set_parameters(config)
-                self.sequence_to_waveforms.set_parameters(config)
+                self.updateConfiguration()
             # get qubit index and waveforms
             n = int(quant.name.split(', QB')[1]) - 1
             demod_iq = self.getValue('Demodulation - IQ')
@@ -112,85 +151,35 @@ class Driver(LabberDriver):
 
         elif quant.isVector():
             # traces, check if waveform needs to be re-calculated
-            if self.isConfigUpdated():
+            if self.isConfigUpdated() or self.config is None:
                 # update sequence object with current driver configuation
-                config = self.instrCfg.getValuesDict()
-                self.sequence.set_parameters(config)
-                self.sequence_to_waveforms.set_parameters(config)
-
-                # check if calculating multiple sequences, for randomization
-                multi_rb = config.get('Output multiple sequences', False)
-                multi_training = config.get('Train all states at once', False)
-
-                if (multi_rb or multi_training):
-                    # create multiple randomizations, store in memory
-                    if multi_rb:
-                        multi_param = 'Randomize'
-                        align_multi_to_end = config.get(
-                            'Align RB waveforms to end', False)
-                        n_call = int(
-                            config.get('Number of multiple sequences', 1))
-                    elif multi_training:
-                        # readout training
-                        multi_param = 'Training, input state'
-                        align_multi_to_end = False
-                        # for readout, always start with first state
-                        config[multi_param] = -1
-                        training_type = config['Training type']
-                        if training_type == 'Specific qubit':
-                            n_call = 2
-                        elif training_type == 'All qubits at once':
-                            n_call = 2
-                        elif training_type == 'All combinations':
-                            n_call = 2**self.sequence.n_qubit
-
-                    calls = []
-                    for n in range(n_call):
-                        config[multi_param] += 1
-                        calls.append(
-                            copy.deepcopy(
-                                self.sequence_to_waveforms.get_waveforms(
-                                    self.sequence.get_sequence(config))))
-
-                    # after all calls are done, convert output to matrix form
-                    self.waveforms = dict()
-                    n_qubit = self.sequence.n_qubit
-                    # start with xy, z and gate waveforms, list of data
-                    for key in ['xy', 'z', 'gate']:
-                        # get size of longest waveform
-                        self.waveforms[key] = []
-                        for n in range(n_qubit):
-                            log.info('Generating {} waveform for qubit {}'.format(key, n))
-
-                            length = max([len(call[key][n]) for call in calls])
-                            # build matrix
-                            datatype = calls[0][key][n].dtype
-                            data = np.zeros((n_call, length), dtype=datatype)
-                            for m, call in enumerate(calls):
-                                if align_multi_to_end:
-                                    data[m][-len(call[key][n]):] = call[key][n]
-                                else:
-                                    data[m][:len(call[key][n])] = call[key][n]
-                            self.waveforms[key].append(data)
-
-                    # same for readout waveforms
-                    for key in ['readout_trig', 'readout_iq', 'readout_iq2']:
-                        length = max([len(call[key]) for call in calls])
-                        datatype = calls[0][key].dtype
-                        data = np.zeros((n_call, length), dtype=datatype)
-                        for m, call in enumerate(calls):
-                            if align_multi_to_end:
-                                data[m][-len(call[key]):] = call[key]
-                            else:
-                                data[m][:len(call[key])] = call[key]
-                        self.waveforms[key] = data
+                self.updateConfiguration()
 
-                else:
-                    # normal operation, calcluate waveforms
-                    # log.info('generating case 2')
-                    self.waveforms = self.sequence_to_waveforms.get_waveforms(
-                        self.sequence.get_sequence(config))
-                    # log.info('Z waveform max: {}'.format(np.max(self.waveforms['z'])))
+            if not self.waveforms_valid:
+                config = dict(self.config)
+                timer = self.sequence_to_waveforms.timer
+                timer.clear()
+                timer.start()
+                # re-use waveforms if configuration was compiled before
+                key = None
+                waveforms = None
+                if config.get('Cache compiled waveforms', False):
+                    key = get_config_key(
+                        config,
+                        ignore=NON_WAVEFORM_QUANTITIES + COMPILER_QUANTITIES)
+                    waveforms = self.cache.get(key)
+                    timer.mark('waveform cache')
+                if waveforms is None:
+                    waveforms = self.compileWaveforms(config)
+                    if key is not None:
+                        timer.start()
+                        self.cache.put(key, waveforms)
+                        timer.mark('waveform cache')
+                self.waveforms = waveforms
+                self.waveforms_valid = True
+                if timer.enabled:
+                    log.info('Compilation time: %.2f ms (%s)' % (
+                        1E3 * timer.total(), timer.format()))
             # get correct data from waveforms stored in memory
             value = self.getWaveformFromMemory(quant)
         else:
@@ -198,8 +187,145 @@ class Driver(LabberDriver):
             value = quant.getValue()
         return value
 
+    def compileWaveforms(self, config):
+        """Compile waveforms for the current sequence.
+
+        Parameters
+        ----------
+        config : dict
+            Driver configuration.
+
+        Returns
+        -------
+        waveforms : dict
+            Waveforms, as returned by `SequenceToWaveforms.get_waveforms`.
+
+        """
+        # check if calculating multiple sequences, for randomization
+        multi_rb = config.get('Output multiple sequences', False)
+        multi_training = config.get('Train all states at once', False)
+
+        if (multi_rb or multi_training):
+            # create multiple randomizations, store in memory
+            if multi_rb:
+                multi_param = 'Randomize'
+                align_multi_to_end = config.get(
+                    'Align RB waveforms to end', False)
+                n_call = int(
+                    config.get('Number of multiple sequences', 1))
+            elif multi_training:
+                # readout training
+                multi_param = 'Training, input state'
+                align_multi_to_end = False
+                # for readout, always start with first state
+                config[multi_param] = -1
+                training_type = config['Training type']
+                if training_type == 'Specific qubit':
+                    n_call = 2
+                elif training_type == 'All qubits at once':
+                    n_call = 2
+                elif training_type == 'All combinations':
+                    n_call = 2**self.sequence.n_qubit
+
+            # create configurations for all calls
+            configs = []
+            for n in range(n_call):
+                config[multi_param] += 1
+                configs.append(dict(config))
+            self.compilation_pool.set_processes(
+                config.get('Number of compilation processes', 1))
+            # compile waveforms and convert output to matrix form
+            if (not multi_rb and
+                    config['Training type'] == 'All combinations'):
+                # states only differ by pi-pulses, assemble from ground
+                # and excited state waveforms
+                waveforms = compile_state_combinations(
+                    self.sequence, self.sequence_to_waveforms, configs,
+                    list(range(n_call)), pool=self.compilation_pool)
+            else:
+                waveforms = compile_multiple_sequences(
+                    self.sequence, self.sequence_to_waveforms, configs,
+                    align_to_end=align_multi_to_end,
+                    pool=self.compilation_pool)
+
+        else:
+            # normal operation, calcluate waveforms
+            # log.info('generating case 2')
+            timer = self.sequence_to_waveforms.timer
+            timer.start()
+            sequence = self.sequence.get_sequence(config)
+            timer.mark('generate sequence')
+            waveforms = self.sequence_to_waveforms.get_waveforms(sequence)
+            # log.info('Z waveform max: {}'.format(np.max(self.waveforms['z'])))
+        return waveforms
+
+    def updateConfiguration(self):
+        """Update sequence objects with the current driver configuration.
+
+        Only quantities changed since the last update are passed on as
+        changed, and waveforms are only invalidated if a quantity that
+        affects them changed.
+
+        """
+        config = self.instrCfg.getValuesDict()
+        if (self.config is None or
+                not config.get('Incremental compilation', False)):
+            changed = None
+        else:
+            changed = set(
+                key for key, value in config.items()
+                if key not in self.config or
+                not _is_equal(value, self.config[key]))
+        self.config = dict(config)
+        self.sequence.set_parameters(config)
+        self.sequence_to_waveforms.set_parameters(config, changed=changed)
+        # cache of compiled waveforms
+        self.cache.max_size = 1E6 * config.get('Cache size', 256)
+        if config.get('Cache on disk', False):
+            path = config.get('Cache directory', '')
+            if path == '':
+                path = os.path.join(tempfile.gettempdir(),
+                                    'MultiQubit_PulseGenerator')
+            self.cache.directory = path
+        else:
+            self.cache.directory = None
+        if changed is None or any(
+                not key.startswith(NON_WAVEFORM_QUANTITIES)
+                for key in changed):
+            self.waveforms_valid = False
+
+    def getPulseListFromMemory(self, quant):
+        """Return pulse list data from already calculated waveforms."""
+        pulse_list = self.waveforms.get(
+            'pulse_list', np.zeros((0, 5), dtype=np.int64))
+        envelopes = self.waveforms.get('envelopes', [])
+        if quant.name == 'Pulse list - Pulses':
+            # rows of sequence, channel type, channel, start and envelope
+            return quant.getTraceDict(
+                np.asarray(pulse_list, dtype=float).flatten(), dt=1)
+        elif quant.name == 'Pulse list - Envelope lengths':
+            return quant.getTraceDict(
+                np.array([len(y) for y in envelopes], dtype=float), dt=1)
+        # envelope data, concatenated
+        if len(envelopes) == 0:
+            value = np.zeros(0, dtype=complex)
+        else:
+            value = np.concatenate(
+                [np.asarray(y, dtype=complex) for y in envelopes])
+        if self.getValue('Swap IQ') and len(pulse_list) > 0:
+            # swap I and Q of envelopes used by xy channels
+            xy = np.unique(pulse_list[pulse_list[:, 1] == CHANNEL_XY, 4])
+            starts = np.r_[0, np.cumsum([len(y) for y in envelopes])]
+            for k in xy:
+                y = value[starts[k]:starts[k + 1]]
+                y[:] = 1j * np.conj(y)
+        dt = 1 / self.sequence_to_waveforms.sample_rate
+        return quant.getTraceDict(value, dt=dt)
+
     def getWaveformFromMemory(self, quant):
         """Return data from already calculated waveforms."""
+        if quant.name.startswith('Pulse list - '):
+            return self.getPulseListFromMemory(quant)
         # check which data to return
         if quant.name.startswith('Trace - I'):
             n = int(quant.name[9:]) - 1
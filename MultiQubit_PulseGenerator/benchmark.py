@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""Benchmark compilation of the built-in sequences.
+
+The sequences are compiled with the default driver configuration from the
+.ini file, so no Labber instrument server is needed. Results can be saved
+and compared to a previous run to catch performance regressions.
+
+Examples
+--------
+Run all benchmarks and save the results::
+
+    python benchmark.py --save baseline.json
+
+Compare to saved results, with stage timing of each compilation::
+
+    python benchmark.py --compare baseline.json --profile
+
+"""
+import argparse
+import configparser
+import json
+import os
+import sys
+import time
+
+from sequence_builtin import CPMG, PulseTrain, Rabi
+from sequence_rb import SingleQubit_RB, TwoQubit_RB
+from sequence import SequenceToWaveforms
+
+DRIVER_PATH = os.path.dirname(os.path.abspath(__file__))
+
+SEQUENCES = {'Rabi': Rabi,
+             'CP/CPMG': CPMG,
+             'Pulse train': PulseTrain,
+             '1-QB Randomized Benchmarking': SingleQubit_RB,
+             '2-QB Randomized Benchmarking': TwoQubit_RB}
+
+# sequence, quantity setting the sequence length, and lengths to test
+LENGTHS = [('Rabi', None, [1]),
+           ('CP/CPMG', '# of pi pulses', [10, 100]),
+           ('Pulse train', '# of pulses', [10, 100, 1000]),
+           ('1-QB Randomized Benchmarking', 'Number of Cliffords',
+            [10, 100, 1000]),
+           ('2-QB Randomized Benchmarking', 'Number of Cliffords', [10, 50])]
+
+
+def load_default_config(path=None):
+    """Get driver configuration with default values from the .ini file.
+
+    Parameters
+    ----------
+    path : str, optional
+        Path to driver definition file. By default, the file of the
+        MultiQubit_PulseGenerator driver is used.
+
+    Returns
+    -------
+    dict
+        Configuration, in the same format as from the Labber driver.
+
+    """
+    if path is None:
+        path = os.path.join(DRIVER_PATH, 'MultiQubit_PulseGenerator.ini')
+    parser = configparser.RawConfigParser(strict=False)
+    parser.optionxform = str
+    parser.read(path)
+    config = dict()
+    for name in parser.sections():
+        if name == 'General settings':
+            continue
+        section = parser[name]
+        datatype = section.get('datatype', 'DOUBLE').upper()
+        value = section.get('def_value')
+        if datatype == 'DOUBLE':
+            config[name] = float(value) if value else 0.0
+        elif datatype == 'BOOLEAN':
+            config[name] = value in ('1', 'True', 'true')
+        elif datatype == 'COMBO':
+            config[name] = value if value else section.get('combo_def_1')
+        elif datatype in ('STRING', 'PATH'):
+            config[name] = value if value else ''
+    return config
+
+
+def get_cases(n_qubits):
+    """Get benchmark cases for the given numbers of qubits.
+
+    Returns
+    -------
+    list of tuple
+        List of (label, sequence name, configuration changes).
+
+    """
+    cases = []
+    for n_qubit in n_qubits:
+        for name, quantity, lengths in LENGTHS:
+            if name.startswith('2-QB') and n_qubit < 2:
+                continue
+            for length in lengths:
+                changes = {'Number of qubits': str(n_qubit)}
+                label = '%s, %d QB' % (name, n_qubit)
+                if quantity is not None:
+                    changes[quantity] = length
+                    label += ', %d' % length
+                if name.startswith('2-QB'):
+                    changes['Qubit 2 to Benchmark'] = '2'
+                cases.append((label, name, changes))
+        # process and state tomography around a pulse train
+        cases.append(('Tomography, %d QB' % n_qubit, 'Pulse train',
+                      {'Number of qubits': str(n_qubit),
+                       '# of pulses': 10,
+                       'Generate process tomography prepulse': True,
+                       'Generate state tomography postpulse': True}))
+    return cases
+
+
+def run_case(config, name, changes, repeat=3, profile=False):
+    """Compile a sequence and return the shortest compilation time.
+
+    Parameters
+    ----------
+    config : dict
+        Default configuration.
+    name : str
+        Name of built-in sequence.
+    changes : dict
+        Configuration values to change.
+    repeat : int
+        Number of timed compilations.
+    profile : bool
+        If True, also return time spent in each stage of the compilation.
+
+    Returns
+    -------
+    t : float
+        Shortest time of all compilations, in seconds.
+    stages : str
+        Time of each stage, added up for all compilations.
+
+    """
+    config = dict(config)
+    config.update(changes)
+    config['Sequence'] = name
+    # always measure complete compilations
+    config['Incremental compilation'] = False
+    config['Profile compilation'] = profile
+    n_qubit = int(config['Number of qubits'])
+    sequence = SEQUENCES[name](n_qubit)
+    sequence_to_waveforms = SequenceToWaveforms(n_qubit)
+    sequence.set_parameters(config)
+    sequence_to_waveforms.set_parameters(config)
+    # first call creates pulses and fills caches
+    sequence_to_waveforms.get_waveforms(sequence.get_sequence(config))
+    timer = sequence_to_waveforms.timer
+    timer.clear()
+    times = []
+    for n in range(repeat):
+        t0 = time.perf_counter()
+        timer.start()
+        qubit_sequence = sequence.get_sequence(config)
+        timer.mark('generate sequence')
+        sequence_to_waveforms.get_waveforms(qubit_sequence)
+        times.append(time.perf_counter() - t0)
+    return min(times), timer.format()
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark compilation of the built-in sequences.')
+    parser.add_argument('--qubits', type=int, nargs='+', default=[1, 2, 4],
+                        help='Numbers of qubits to test')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Number of compilations for each case')
+    parser.add_argument('--filter', default='',
+                        help='Only run cases with labels containing this')
+    parser.add_argument('--profile', action='store_true',
+                        help='Print time spent in each compilation stage')
+    parser.add_argument('--save', help='Save results to JSON file')
+    parser.add_argument('--compare',
+                        help='Compare results to saved JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='Relative slowdown reported as regression')
+    args = parser.parse_args(args)
+
+    config = load_default_config()
+    reference = dict()
+    if args.compare:
+        with open(args.compare) as f:
+            reference = json.load(f)
+
+    results = dict()
+    regressions = []
+    for label, name, changes in get_cases(args.qubits):
+        if args.filter not in label:
+            continue
+        t, stages = run_case(config, name, changes, repeat=args.repeat,
+                             profile=args.profile)
+        results[label] = t
+        line = '%-45s %9.2f ms' % (label, 1E3 * t)
+        if label in reference:
+            ratio = t / reference[label]
+            line += '  %+6.0f %%' % (100 * (ratio - 1))
+            if ratio > 1 + args.tolerance:
+                regressions.append(label)
+                line += '  REGRESSION'
+        print(line)
+        if args.profile:
+            print('    ' + stages)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if len(regressions) > 0:
+        print('%d case(s) slower than reference: %s' % (
+            len(regressions), ', '.join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -275,6 +275,347 @@ def saveData(file_path, data):
     print('--- File Save Success! ---')
     print(file_path)
 
+class CliffordGroup:
+    """Clifford group with elements represented by integer indices.
+
+    The indices are the same as used by `sequence_rb.add_twoQ_clifford`.
+    Unitaries of all elements are calculated once, and elements are
+    identified by hashing their unitary, with the global phase removed. This
+    makes composition, inversion and recovery look-ups O(1).
+
+    Parameters
+    ----------
+    generator : str {'CZ', 'iSWAP'}
+        Native two-qubit gate used for decomposing the Cliffords.
+
+    Attributes
+    ----------
+    size : int
+        Number of elements in the group.
+    unitaries : numpy array
+        Unitaries of all elements, shape (size, 4, 4).
+    inverse : numpy array
+        Index of the inverse of each element.
+    cost : numpy array
+        Number of two-qubit gates, single-qubit gates and I gates in the
+        decomposition of each element, shape (size, 3).
+
+    """
+
+    def __init__(self, generator='CZ'):
+        self.generator = generator
+        self.size = 11520
+        # All elements start with two single-qubit Cliffords, with indices
+        # index % 24 and (index // 24) % 24, followed by a sequence that only
+        # depends on index // 576. Calculate the 24 single-qubit Cliffords
+        # and the 20 different tails, and combine them.
+        single = np.zeros((24, 2, 2), dtype=complex)
+        n_single_i = np.zeros(24, dtype=int)
+        for index in range(24):
+            seq = []
+            sequence_rb.add_singleQ_clifford(index, seq)
+            # the second qubit idles, leaving kron(U, I)
+            single[index] = self.sequence_unitary(
+                seq, [gates.I] * len(seq))[::2, ::2]
+            n_single_i[index] = len([g for g in seq if g == gates.I])
+        n_tail = self.size // 576
+        tails = np.zeros((n_tail, 4, 4), dtype=complex)
+        tail_cost = np.zeros((n_tail, 3), dtype=int)
+        for n in range(n_tail):
+            seq_1, seq_2 = [], []
+            sequence_rb.add_twoQ_clifford(
+                576 * n, seq_1, seq_2, generator=generator)
+            tails[n] = self.sequence_unitary(seq_1, seq_2)
+            tail_cost[n] = _count_gates(seq_1, seq_2)
+
+        index = np.arange(self.size)
+        index_1 = index % 24
+        index_2 = (index // 24) % 24
+        index_tail = index // 576
+        # kron of the single-qubit Cliffords on qubit 1 and 2
+        first = np.einsum('nab,ncd->nacbd', single[index_1],
+                          single[index_2]).reshape((self.size, 4, 4))
+        self.unitaries = np.matmul(tails[index_tail], first)
+        # the tails include six I gates in place of the single-qubit gates
+        self.cost = tail_cost[index_tail]
+        self.cost[:, 2] += n_single_i[index_1] + n_single_i[index_2] - 6
+
+        # hash table from unitary to index
+        self._index = dict(zip(_unitary_keys(self.unitaries), index))
+        if len(self._index) != self.size:
+            raise ValueError('Clifford decomposition is not unique.')
+        self.inverse = np.array(
+            [self._index[key] for key in _unitary_keys(
+                np.conj(np.transpose(self.unitaries, (0, 2, 1))))])
+
+        # find the cheapest element taking each stabilizer state to |00>.
+        # The element R recovers the state psi if psi = R^dagger |00>.
+        self._cheapest_recovery = {}
+        best_cost = {}
+        states = np.conj(self.unitaries[:, 0, :])
+        for n, key in enumerate(_unitary_keys(states)):
+            # less 2QB gates > less 1QB gates > more I gates
+            cost = (self.cost[n, 0], self.cost[n, 1], -self.cost[n, 2])
+            if key not in best_cost or cost <= best_cost[key]:
+                best_cost[key] = cost
+                self._cheapest_recovery[key] = n
+
+    def get_index(self, unitary):
+        """Get the index of the element with the given unitary.
+
+        Parameters
+        ----------
+        unitary : numpy array
+            Unitary of the element, global phase is ignored.
+
+        Returns
+        -------
+        int
+            Index of the element.
+
+        """
+        return self._index[_unitary_key(unitary)]
+
+    def multiply(self, index_a, index_b):
+        """Get the index of the element `a` applied after element `b`."""
+        return self.get_index(
+            np.dot(self.unitaries[index_a], self.unitaries[index_b]))
+
+    def sequence_index(self, gate_seq_1, gate_seq_2):
+        """Get the index of the element implemented by a gate sequence."""
+        return self.get_index(self.sequence_unitary(gate_seq_1, gate_seq_2))
+
+    def get_recovery_index(self, index, find_cheapest=False):
+        """Get the index of the element recovering the ground state.
+
+        Parameters
+        ----------
+        index : int
+            Index of the element to recover from.
+        find_cheapest : bool
+            If False, return the inverse of the element. If True, return the
+            cheapest element that takes the state back to |00>.
+
+        Returns
+        -------
+        int
+            Index of the recovery element.
+
+        """
+        if not find_cheapest:
+            return int(self.inverse[index])
+        return self._cheapest_recovery[
+            _unitary_key(self.unitaries[index][:, 0])]
+
+    @staticmethod
+    def sequence_unitary(gate_seq_1, gate_seq_2):
+        """Calculate the unitary of a two-qubit gate sequence.
+
+        Parameters
+        ----------
+        gate_seq_1: list of class Gate (defined in "gates.py")
+            The gate sequence applied to Qubit "1"
+
+        gate_seq_2: list of class Gate (defined in "gates.py")
+            The gate sequence applied to Qubit "2"
+
+        Returns
+        -------
+        numpy array
+            The 4x4 unitary.
+
+        """
+        unitary = np.identity(4, dtype=complex)
+        for gate_1, gate_2 in zip(gate_seq_1, gate_seq_2):
+            if gate_1 == gates.CZ or gate_2 == gates.CZ:
+                step = dict_m2QBGate['CZ'].A
+            elif gate_1 == gates.iSWAP or gate_2 == gates.iSWAP:
+                step = dict_m2QBGate['iSWAP'].A
+            else:
+                step = np.kron(_gate_unitary(gate_1), _gate_unitary(gate_2))
+            unitary = np.dot(step, unitary)
+        return unitary
+
+
+# Clifford groups are expensive to create, keep one per generator
+_clifford_groups = {}
+
+
+def get_clifford_group(generator='CZ'):
+    """Get the two-qubit Clifford group for the given native gate.
+
+    Parameters
+    ----------
+    generator : str {'CZ', 'iSWAP'}
+        Native two-qubit gate.
+
+    Returns
+    -------
+    :obj:`CliffordGroup`
+        The Clifford group.
+
+    """
+    if generator not in _clifford_groups:
+        _clifford_groups[generator] = CliffordGroup(generator)
+    return _clifford_groups[generator]
+
+
+class SingleQubitCliffordGroup:
+    """Single-qubit Clifford group with a full composition table.
+
+    The indices are the same as used by `sequence_rb.add_singleQ_clifford`.
+    All products are tabulated, so tracking the total Clifford of a sequence
+    only requires integer look-ups.
+
+    Attributes
+    ----------
+    size : int
+        Number of elements in the group.
+    gate_sequences : list of list of :obj:`Gate`
+        Gates implementing each element, without padding.
+    unitaries : numpy array
+        Unitaries of all elements, shape (size, 2, 2).
+    table : numpy array
+        Composition table, `table[a, b]` is the index of element `a`
+        applied after element `b`.
+    inverse : numpy array
+        Index of the inverse of each element.
+    recovery_gates : list of :obj:`Gate`
+        Single gate taking the state prepared by each element from the
+        ground state back to the ground state.
+
+    """
+
+    def __init__(self):
+        self.size = 24
+        self.gate_sequences = []
+        for index in range(self.size):
+            seq = []
+            sequence_rb.add_singleQ_clifford(index, seq, pad_with_I=False)
+            self.gate_sequences.append(seq)
+        self.unitaries = np.array(
+            [self.sequence_unitary(seq) for seq in self.gate_sequences])
+        self._index = dict(zip(_unitary_keys(self.unitaries),
+                               range(self.size)))
+
+        products = np.matmul(self.unitaries[:, np.newaxis],
+                             self.unitaries[np.newaxis, :])
+        self.table = np.array(
+            [self._index[key] for key in _unitary_keys(
+                products.reshape((-1, 2, 2)))]).reshape((self.size,
+                                                         self.size))
+        self.inverse = np.argmax(self.table == 0, axis=1)
+
+        # elements leaving the ground state unchanged, up to a phase
+        ground = np.abs(np.abs(self.unitaries[:, 0, 0]) - 1) < 1E-6
+        # recovery gates, in order of preference
+        candidates = [gates.I, gates.Xp, gates.Y2p, gates.Y2m,
+                      gates.X2m, gates.X2p]
+        candidate_index = [self.sequence_index([gate])
+                           for gate in candidates]
+        self.recovery_gates = []
+        for index in range(self.size):
+            for gate, n in zip(candidates, candidate_index):
+                if ground[self.table[n, index]]:
+                    self.recovery_gates.append(gate)
+                    break
+
+    def get_index(self, unitary):
+        """Get the index of the element with the given unitary."""
+        return self._index[_unitary_key(unitary)]
+
+    def sequence_index(self, gate_seq):
+        """Get the index of the element implemented by a gate sequence."""
+        return self.get_index(self.sequence_unitary(gate_seq))
+
+    @staticmethod
+    def sequence_unitary(gate_seq):
+        """Calculate the 2x2 unitary of a single-qubit gate sequence."""
+        unitary = np.identity(2, dtype=complex)
+        for gate in gate_seq:
+            unitary = np.dot(_gate_unitary(gate), unitary)
+        return unitary
+
+
+_single_qubit_clifford_group = []
+
+
+def get_single_qubit_clifford_group():
+    """Get the single-qubit Clifford group.
+
+    Returns
+    -------
+    :obj:`SingleQubitCliffordGroup`
+        The Clifford group.
+
+    """
+    if len(_single_qubit_clifford_group) == 0:
+        _single_qubit_clifford_group.append(SingleQubitCliffordGroup())
+    return _single_qubit_clifford_group[0]
+
+
+def _unitary_keys(matrices):
+    """Get hashable keys for matrices or vectors, without global phase.
+
+    Parameters
+    ----------
+    matrices : numpy array
+        Array of matrices or vectors, with the first dimension as index.
+
+    Returns
+    -------
+    list of bytes
+        Keys of the matrices.
+
+    """
+    x = np.asarray(matrices, dtype=complex)
+    x = x.reshape((x.shape[0], -1))
+    # normalize the phase of the first non-zero element
+    first = x[np.arange(len(x)), np.argmax(np.abs(x) > 1E-6, axis=1)]
+    x = np.round(x * (np.abs(first) / first)[:, np.newaxis], 6) + 0.0
+    return [row.tobytes() for row in x]
+
+
+def _unitary_key(matrix):
+    """Get a hashable key for a matrix or vector, without global phase."""
+    return _unitary_keys(np.asarray(matrix)[np.newaxis])[0]
+
+
+def _gate_unitary(gate):
+    """Get the unitary of a single-qubit gate."""
+    unitary = _dict_id_unitary.get(id(gate))
+    if unitary is not None:
+        return unitary
+    if gate is None or isinstance(gate, gates.IdentityGate):
+        return dict_m1QBGate['I'].A
+    for name, matrix in dict_m1QBGate.items():
+        if gate == getattr(gates, name):
+            return matrix.A
+    raise ValueError('Unknown single-qubit gate: ' + str(gate))
+
+
+def _count_gates(gate_seq_1, gate_seq_2):
+    """Count 2QB gates, 1QB gates and I gates in a gate sequence."""
+    n_2qb, n_1qb, n_i = 0, 0, 0
+    for gate_1, gate_2 in zip(gate_seq_1, gate_seq_2):
+        if (gate_1 == gates.CZ or gate_2 == gates.CZ or
+                gate_1 == gates.iSWAP or gate_2 == gates.iSWAP):
+            n_2qb += 1
+        else:
+            n_1qb += 2
+        if gate_1 == gates.I:
+            n_i += 1
+        if gate_2 == gates.I:
+            n_i += 1
+    return (n_2qb, n_1qb, n_i)
+
+
+# look-up of unitaries for the standard gate objects
+_dict_id_unitary = {id(getattr(gates, name)): matrix.A
+                    for name, matrix in dict_m1QBGate.items()}
+_dict_id_unitary[id(gates.VZp)] = dict_m1QBGate['Zp'].A
+
+
 def loadData(file_path):
 
     """
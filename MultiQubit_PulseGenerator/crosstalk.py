@@ -1,16 +1,31 @@
 #!/usr/bin/env python3
 
 import numpy as np
-from scipy.linalg import inv
+from scipy.linalg import LinAlgError, inv
 
 
 class Crosstalk(object):
-    """This class is used to compensate crosstalk qubit Z control."""
+    """This class is used to compensate crosstalk qubit Z control.
+
+    The compensation matrix is reduced to the qubits in use and processed
+    once per configuration, so that compensation only costs a look-up.
+    Couplings below `threshold` are skipped.
+
+    """
 
     def __init__(self):
         # define variables
         self.matrix_path = ''
-        # TODO(dan): define variables for matrix, etc
+        self.compensation_matrix = np.zeros((0, 0))
+        self.Sequence = []
+        self.threshold = 0.0
+        # qubits with a matrix element, and matrix reduced to those qubits
+        self.qubits = []
+        self.phi0_vs_voltage = np.zeros((0, 0))
+        # cached derived quantities, see `_update`
+        self._key = None
+        self._inverse = None
+        self._couplings = {}
 
     def set_parameters(self, config={}):
         """Set base parameters using config from from Labber driver.
@@ -28,7 +43,6 @@ class Crosstalk(object):
         path = config.get('Cross-talk (CT) matrix')
         # only reload if file changed
         if path != self.matrix_path:
-            path = config.get('Cross-talk (CT) matrix')
             self.import_crosstalk_matrix(path)
 
         nQBs = int(config.get('Number of qubits'))
@@ -43,20 +57,52 @@ class Crosstalk(object):
                 for QB in range(0, nQBs):
                     element = config.get('CT-matrix element #%d' % (QB + 1))
                     if element == 'None':
+                        self.Sequence.append(None)
                         continue
                     else:
                         self.Sequence.append(int(element))
-                    if self.compensation_matrix.shape[0] < int(element):
-                        raise 'Element of Cross-talk matrix is too large for '\
-                            'actual matrix size'
-
-        mat_length = len(self.Sequence)
-        self.phi0_vs_voltage = np.matrix(np.zeros((mat_length, mat_length)))
+        self.threshold = float(config.get('Cross-talk threshold', 0.0))
+        self._update()
 
-        for index_r, element_r in enumerate(self.Sequence):
-            for index_c, element_c in enumerate(self.Sequence):
-                self.phi0_vs_voltage[index_r, index_c] = \
-                    self.compensation_matrix[element_r - 1, element_c - 1]
+    def _update(self):
+        """Reduce matrix to qubits in use, and cache inverse and couplings."""
+        key = (self.matrix_path, tuple(self.Sequence), self.threshold)
+        if key == self._key:
+            return
+        self._key = key
+        self.qubits = [n for n, element in enumerate(self.Sequence)
+                       if element is not None]
+        elements = np.array([self.Sequence[n] for n in self.qubits],
+                            dtype=int) - 1
+        if np.any(elements >= self.compensation_matrix.shape[0]):
+            raise ValueError('Element of Cross-talk matrix is too large for '
+                             'actual matrix size')
+        self.phi0_vs_voltage = np.array(
+            self.compensation_matrix)[np.ix_(elements, elements)]
+        # inverse is only needed for matrix compensation, see `_get_inverse`
+        self._inverse = None
+
+        # per-gate couplings, to first order in the off-diagonal elements
+        self._couplings = {}
+        for c, source in enumerate(self.qubits):
+            targets = []
+            for r, target in enumerate(self.qubits):
+                factor = float(self.phi0_vs_voltage[r, c])
+                if target != source:
+                    factor = -factor
+                if abs(factor) > self.threshold:
+                    targets.append((target, factor))
+            self._couplings[source] = targets
+
+    def _get_inverse(self):
+        """Get inverse of the reduced matrix, calculated on first use."""
+        if self._inverse is None:
+            try:
+                self._inverse = inv(self.phi0_vs_voltage)
+            except LinAlgError:
+                raise ValueError('Cross-talk matrix is singular and cannot '
+                                 'be inverted, use the per-gate method')
+        return self._inverse
 
     def import_crosstalk_matrix(self, path):
         """Import crosstalk matrix data.
@@ -69,12 +115,30 @@ class Crosstalk(object):
         """
         # store new path
         self.matrix_path = path
-        self.compensation_matrix = np.matrix(np.loadtxt(path))
-        # TODO(dan): load crosstalk data
+        self.compensation_matrix = np.atleast_2d(np.loadtxt(path))
+        self._key = None
+
+    def get_couplings(self, qubit):
+        """Get Z lines affected by a pulse on a qubit, with scale factors.
+
+        Parameters
+        ----------
+        qubit : int
+            Qubit carrying the Z pulse, zero-indexed.
+
+        Returns
+        -------
+        couplings : list of tuple
+            List of (qubit, scaling factor), including the qubit itself.
+
+        """
+        return self._couplings.get(qubit, [(qubit, 1.0)])
 
     def compensate(self, waveforms):
         """Compensate crosstalk on Z-control waveforms.
 
+        The waveforms are updated in place.
+
         Parameters
         ----------
         waveforms : list on 1D numpy arrays
@@ -86,26 +150,13 @@ class Crosstalk(object):
             Waveforms with crosstalk compensation
 
         """
-        mat_voltage_vs_phi0 = inv(self.phi0_vs_voltage)
-
-        wavform_length = len(waveforms[0])
-        wavform_num = len(self.Sequence)
-        wav_array = np.array(np.zeros((wavform_num, wavform_length)))
-        wav_toCorrect = []
-        for index, waveform in enumerate(waveforms):
-            if index + 1 in self.Sequence:
-                wav_array[index] = waveform
-                wav_toCorrect.append(index)
-
-        # new_array = np.dot(mat_voltage_vs_phi0, wav_array)
-
+        if len(self.qubits) == 0:
+            return waveforms
+        wav_array = np.array([waveforms[n] for n in self.qubits])
         # dot product between the matrix and the waveforms at each timestep
-        new_array = np.einsum('ij,jk->ik', mat_voltage_vs_phi0, wav_array)
-
-        for Corr_index, index in zip(wav_toCorrect,
-                                     range(0, len(self.Sequence))):
-            waveforms[Corr_index] = new_array[index]
-
+        new_array = np.dot(self._get_inverse(), wav_array)
+        for index, n in enumerate(self.qubits):
+            waveforms[n][:] = new_array[index]
         return waveforms
 
 
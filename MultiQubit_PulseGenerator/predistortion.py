@@ -10,9 +10,12 @@
 # one mixer at a time. A challenge will be finding a good way to add the
 # transfer functions to a common file in a convenient way.
 
+import os
+
 import numpy as np
-from numpy.fft import fft, fftfreq, fftshift, ifft, ifftshift
+from numpy.fft import fft, fftshift, ifft, ifftshift
 from scipy.interpolate import interp1d
+from scipy.signal import lfilter
 
 
 class Predistortion(object):
@@ -21,9 +24,13 @@ class Predistortion(object):
     def __init__(self, waveform_number=0):
         # define variables
         self.transfer_path = ''
+        self.transfer_mtime = None
         # keep track of which Labber waveform this predistortion refers to
         self.waveform_number = waveform_number
-        # TODO(dan): define variables for predistortion algorithm
+        # inverse response on the frequency grid of the transfer function,
+        # and sampled on the rfft grids of the waveforms
+        self._inverse_response = None
+        self._inverse_cache = {}
 
     def set_parameters(self, config={}):
         """Set base parameters using config from from Labber driver.
@@ -37,7 +44,8 @@ class Predistortion(object):
         # Labber configuration contains multiple predistortions, get right one
         path = config.get('Transfer function #%d' % (self.waveform_number + 1))
         # only reload tranfser function if file changed
-        if path != self.transfer_path:
+        if (path != self.transfer_path or
+                _get_mtime(path) != self.transfer_mtime):
             self.import_transfer_function(path)
 
         self.dt = 1 / config.get('Sample rate')
@@ -53,6 +61,9 @@ class Predistortion(object):
         """
         # store new path
         self.transfer_path = path
+        self.transfer_mtime = _get_mtime(path)
+        self._inverse_response = None
+        self._inverse_cache = {}
 
         # return directly if not in use, look for both '' and '.'
         if self.transfer_path.strip() in ('', '.'):
@@ -63,25 +74,16 @@ class Predistortion(object):
             y_channel=0)
         self.vResponse_freqs, self.vFilteredResponse_FFT_Q = f.getTraceXY(
             y_channel=1)
-        # TODO(dan): load transfer function data
-
-    def predistort(self, waveform):
-        """Predistort input waveform.
 
-        Parameters
-        ----------
-        waveform : complex numpy array
-            Waveform data to be pre-distorted
+    def _calculate_inverse_response(self):
+        """Invert the 2x2 I/Q response on the transfer function grid.
 
         Returns
         -------
-        waveform : complex numpy array
-            Pre-distorted waveform
+        inverse : complex numpy array
+            Inverse response matrices, shape (2, 2, n_freq).
 
         """
-        # find timespan of waveform
-        self.tvals = np.arange(0, self.dt * len(waveform), self.dt)
-
         response_I = ifft(ifftshift(self.vFilteredResponse_FFT_I))
         response_FFT_I_r = fftshift(fft(complex(1, 0) * response_I.real))
         response_FFT_I_i = fftshift(fft(complex(1, 0) * response_I.imag))
@@ -100,34 +102,75 @@ class Predistortion(object):
         Zb = -response_FFT_Q_r / determinant
         Zc = -response_FFT_I_i / determinant
         Zd = response_FFT_I_r / determinant
+        return np.array([[Za, Zb], [Zc, Zd]])
+
+    def _get_inverse_response(self, n_pts):
+        """Get the inverse response sampled on the rfft grid of a waveform.
 
-        Inverse_A = interp1d(self.vResponse_freqs, Za)
-        Inverse_B = interp1d(self.vResponse_freqs, Zb)
-        Inverse_C = interp1d(self.vResponse_freqs, Zc)
-        Inverse_D = interp1d(self.vResponse_freqs, Zd)
+        The result is cached, keyed on the transfer function file and its
+        modification time, the sample rate and the waveform length.
 
-        # applies the interpolated inverse function to the AWG signal
+        Parameters
+        ----------
+        n_pts : int
+            Number of points in the waveform.
+
+        Returns
+        -------
+        inverse : complex numpy array
+            Inverse response matrices, shape (2, 2, n_pts // 2 + 1).
+
+        """
+        key = (self.transfer_path, self.transfer_mtime, self.dt, n_pts)
+        inverse = self._inverse_cache.get(key)
+        if inverse is not None:
+            return inverse
+        if self._inverse_response is None:
+            self._inverse_response = self._calculate_inverse_response()
+        freqs = np.fft.rfftfreq(n_pts, self.dt)
+        if n_pts % 2 == 0:
+            # the grid of the transfer function ends below the positive
+            # Nyquist frequency, use the (conjugate) negative frequency
+            freqs[-1] = -freqs[-1]
+        inverse = interp1d(self.vResponse_freqs, self._inverse_response)(freqs)
+        if n_pts % 2 == 0:
+            inverse[..., -1] = np.conj(inverse[..., -1])
+        # sweeps rarely change the waveform length, only keep a few grids
+        if len(self._inverse_cache) >= 16:
+            self._inverse_cache.clear()
+        self._inverse_cache[key] = inverse
+        return inverse
+
+    def predistort(self, waveform):
+        """Predistort input waveform.
 
-        fft_vals, fft_signal_r = self.apply_FFT(
-            self.tvals, complex(1, 0) * waveform.real)
-        fft_vals, fft_signal_i = self.apply_FFT(
-            self.tvals, complex(1, 0) * waveform.imag)
+        Parameters
+        ----------
+        waveform : complex numpy array
+            Waveform data to be pre-distorted
 
-        fft_signal = (fft_signal_r * Inverse_A(fft_vals) + fft_signal_i *
-                      Inverse_B(fft_vals) + 1j *
-                      (fft_signal_r * Inverse_C(fft_vals) +
-                       fft_signal_i * Inverse_D(fft_vals)))
-        corr_signal = ifft(ifftshift(fft_signal))
+        Returns
+        -------
+        waveform : complex numpy array
+            Pre-distorted waveform
 
-        vI = np.array(corr_signal.real, dtype='float64')
-        vQ = np.array(corr_signal.imag, dtype='float64')
+        """
+        n_pts = len(waveform)
+        inverse = self._get_inverse_response(n_pts)
+        # I and Q are real, the spectra are Hermitian
+        fft_signal = np.fft.rfft(np.array([waveform.real, waveform.imag]))
+        # applies the inverse function to the AWG signal
+        corr_signal = np.fft.irfft(
+            np.einsum('ijk,jk->ik', inverse, fft_signal), n_pts)
+        return corr_signal[0] + 1j * corr_signal[1]
 
-        return vI + 1j * vQ
 
-    def apply_FFT(self, tvals, signal):
-        fft_signal = fftshift(fft(signal))
-        fft_vals = fftshift(fftfreq(len(signal), tvals[1] - tvals[0]))
-        return fft_vals, fft_signal
+def _get_mtime(path):
+    """Get modification time of file, or None if not available."""
+    try:
+        return os.path.getmtime(path)
+    except (OSError, TypeError):
+        return None
 
 
 class ExponentialPredistortion:
@@ -158,6 +201,9 @@ class ExponentialPredistortion:
         Time constant for the fourth pole.
     dt : float
         Sample spacing for the waveform.
+    method : str {'FFT', 'IIR'}
+        Filter the zero-padded waveform in the frequency domain, or apply
+        the inverse response as a recursive filter.
 
     """
 
@@ -172,6 +218,11 @@ class ExponentialPredistortion:
         self.tau4 = 0
         self.dt = 1
         self.n = int(waveform_number)
+        self.method = 'FFT'
+        # IIR filter sections and state, for filtering consecutive blocks
+        self._sections = None
+        self._sections_key = None
+        self._zi = None
 
     def set_parameters(self, config={}):
         """Set base parameters using config from from Labber driver.
@@ -192,6 +243,7 @@ class ExponentialPredistortion:
         self.tau3 = config.get('Predistort Z{} - tau3'.format(m))
         self.A4 = config.get('Predistort Z{} - A4'.format(m))
         self.tau4 = config.get('Predistort Z{} - tau4'.format(m))
+        self.method = config.get('Predistort Z{} - Method'.format(m), 'FFT')
 
         self.dt = 1 / config.get('Sample rate')
 
@@ -209,6 +261,9 @@ class ExponentialPredistortion:
             Pre-distorted waveform
 
         """
+        if self.method == 'IIR':
+            self.reset()
+            return self.predistort_block(waveform)
         # pad with zeros at end to make sure response has time to go to zero
         pad_time = 6 * max([self.tau1, self.tau2, self.tau3, self.tau4])
         padded = np.zeros(len(waveform) + round(pad_time / self.dt))
@@ -232,6 +287,96 @@ class ExponentialPredistortion:
         yc = np.fft.irfft(Yc, norm='ortho')
         return yc[:len(waveform)]
 
+    def predistort_block(self, waveform):
+        """Predistort waveform with the recursive filter, keeping the state.
+
+        Consecutive calls filter consecutive blocks of a continuous waveform.
+        Call `reset` to start from a waveform at rest.
+
+        Parameters
+        ----------
+        waveform : numpy array
+            Waveform data to be pre-distorted
+
+        Returns
+        -------
+        waveform : numpy array
+            Pre-distorted waveform
+
+        """
+        sections = self.get_iir_sections()
+        if sections is None:
+            return np.array(waveform, dtype=float)
+        (direct, b, a) = sections
+        if self._zi is None:
+            self._zi = np.zeros((len(a), 1), dtype=a.dtype)
+        y = direct * np.asarray(waveform, dtype=float)
+        for n in range(len(a)):
+            y_n, self._zi[n] = lfilter(b[n], a[n], waveform, zi=self._zi[n])
+            y = y + y_n.real
+        return y
+
+    def reset(self):
+        """Reset state of the recursive filter to a waveform at rest."""
+        self._zi = None
+
+    def get_iir_sections(self):
+        """Get first-order sections of the recursive inverse filter.
+
+        The response 1 + sum(A s tau / (s tau + 1)) is inverted in the
+        s-domain and expanded in partial fractions, d + sum(r / (s - q)).
+        Each term is discretized exactly for linearly interpolated samples
+        (triangle hold), so that time constants are not warped.  The sections
+        are applied in parallel.
+
+        Returns
+        -------
+        sections : tuple
+            Direct term, and numerator and denominator of each section, or
+            None if there is no correction.
+
+        """
+        poles = [(A, tau) for (A, tau) in ((self.A1, self.tau1),
+                                           (self.A2, self.tau2),
+                                           (self.A3, self.tau3),
+                                           (self.A4, self.tau4))
+                 if A != 0 and tau > 0]
+        key = (tuple(poles), self.dt)
+        if key == self._sections_key:
+            return self._sections
+        self._sections_key = key
+        self._zi = None
+        if len(poles) == 0:
+            self._sections = None
+            return None
+        # response as ratio of polynomials in s, H = num / den
+        den = np.array([1.0])
+        for (A, tau) in poles:
+            den = np.polymul(den, [tau, 1.0])
+        num = den.copy()
+        for k, (A, tau) in enumerate(poles):
+            term = np.array([A * tau, 0.0])
+            for j, (A_j, tau_j) in enumerate(poles):
+                if j != k:
+                    term = np.polymul(term, [tau_j, 1.0])
+            num = np.polyadd(num, term)
+        # the inverse den / num has poles at the zeros of the response
+        q = np.roots(num)
+        if np.any(q.real >= 0):
+            raise ValueError(
+                'Z predistortion {} is unstable, check amplitudes and time '
+                'constants.'.format(self.n + 1))
+        r = np.polyval(den, q) / np.polyval(np.polyder(num), q)
+        if np.all(q.imag == 0):
+            (q, r) = (q.real, r.real)
+        # triangle-hold discretization of r / (s - q)
+        a = np.exp(q * self.dt)
+        c = r * (a - 1) / (q**2 * self.dt)
+        b = np.stack((c - r / q, r * a / q - c), axis=1)
+        a = np.stack((np.ones_like(a), -a), axis=1)
+        self._sections = (den[0] / num[0], b, a)
+        return self._sections
+
 
 if __name__ == '__main__':
     pass
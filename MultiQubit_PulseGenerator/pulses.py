@@ -2,6 +2,8 @@
 import numpy as np
 import logging
 import copy
+from collections import OrderedDict
+from functools import lru_cache
 log = logging.getLogger('LabberDriver')
 
 # TODO Private methods and variables
@@ -39,6 +41,9 @@ class Pulse:
 
     """
 
+    # attributes calculated from other parameters, not part of the cache key
+    _derived_attributes = ()
+
     def __init__(self, complex):
 
         # set variables
@@ -55,6 +60,26 @@ class Pulse:
         self.iq_skew = 0.0
         self.iq_ratio = 1.0
 
+    def get_cache_key(self):
+        """Get a hashable key representing all parameters of the pulse.
+
+        Two pulses with the same key generate identical waveforms.
+
+        Returns
+        -------
+        tuple
+            Key built from the pulse type and its attributes.
+
+        """
+        key = [type(self).__name__]
+        for name, value in self.__dict__.items():
+            if name in self._derived_attributes:
+                continue
+            if not isinstance(value, (float, int, str, type(None))):
+                value = _to_hashable(value)
+            key.append((name, value))
+        return tuple(key)
+
     def total_duration(self):
         """Get the total duration for the pulse.
 
@@ -140,6 +165,109 @@ class Pulse:
         return y
 
 
+class EnvelopeCache:
+    """Cache of sampled pulse waveforms used for waveform synthesis.
+
+    Pulses are sampled in time relative to the pulse center, so that a
+    waveform only depends on the pulse parameters, the number of samples and
+    the offset between the pulse center and the first sample.
+    Identical gates in a sequence can then be placed with a slice add, without
+    re-evaluating the pulse shape.
+
+    Parameters
+    ----------
+    max_size : int
+        Maximum number of waveforms to keep in the cache.
+
+    """
+
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self._waveforms = OrderedDict()
+
+    def clear(self):
+        """Remove all waveforms from the cache."""
+        self._waveforms.clear()
+
+    def __len__(self):
+        return len(self._waveforms)
+
+    @staticmethod
+    def is_cacheable(pulse, ignore_drag_modulation=False):
+        """Check if the pulse waveform is independent of absolute time.
+
+        Waveforms with SSB modulation depend on the absolute pulse position
+        and are therefore not cached.
+
+        """
+        return (not pulse.complex) or ignore_drag_modulation
+
+    def get_waveform(self, pulse, t0, i0, n_pts, sample_rate,
+                     ignore_drag_modulation=False):
+        """Get pulse waveform for a range of sample indices.
+
+        Parameters
+        ----------
+        pulse : :obj:`Pulse`
+            Pulse to sample.
+        t0 : float
+            Pulse position, referenced to center of pulse.
+        i0 : int
+            Index of the first sample.
+        n_pts : int
+            Number of samples.
+        sample_rate : float
+            Sample rate of the waveform.
+        ignore_drag_modulation : bool
+            If True, drag and modulation is disabled.
+
+        Returns
+        -------
+        waveform : numpy array
+            Read-only array with pulse waveform.
+
+        """
+        if not self.is_cacheable(pulse, ignore_drag_modulation):
+            t = (i0 + np.arange(n_pts)) / sample_rate
+            return pulse.calculate_waveform(
+                t0, t, ignore_drag_modulation=ignore_drag_modulation)
+
+        # time of first sample relative to pulse center, in units of 1 fs
+        offset = int(round((i0 / sample_rate - t0) * 1E15))
+        key = (pulse.get_cache_key(), n_pts, offset, sample_rate,
+               ignore_drag_modulation)
+        waveform = self._waveforms.get(key)
+        if waveform is not None:
+            self._waveforms.move_to_end(key)
+            return waveform
+
+        # sample in time relative to the pulse center, so that the waveform,
+        # including the samples at the pulse edges, only depends on the key
+        t = offset * 1E-15 + np.arange(n_pts) / sample_rate
+        waveform = np.array(pulse.calculate_waveform(
+            0.0, t, ignore_drag_modulation=ignore_drag_modulation))
+        waveform.flags.writeable = False
+        self._waveforms[key] = waveform
+        if len(self._waveforms) > self.max_size:
+            self._waveforms.popitem(last=False)
+        return waveform
+
+
+def _to_hashable(value):
+    """Convert pulse attributes to a hashable representation."""
+    if isinstance(value, Pulse):
+        return value.get_cache_key()
+    if isinstance(value, np.ndarray):
+        return (value.dtype.str, value.shape, value.tobytes())
+    if isinstance(value, dict):
+        return tuple(sorted((k, _to_hashable(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_to_hashable(x) for x in value)
+    if hasattr(value, '__dict__'):
+        return (type(value).__name__, _to_hashable(vars(value)))
+    return value
+
+
 class Gaussian(Pulse):
     def __init__(self, complex):
         super().__init__(complex)
@@ -241,6 +369,8 @@ class Cosine(Pulse):
 
 
 class CZ(Pulse):
+    _derived_attributes = ('theta_i', 'theta_f', 'theta_tau', 't_tau')
+
     def __init__(self, *args, **kwargs):
         super().__init__(False)
         # For CZ pulses
@@ -252,6 +382,9 @@ class CZ(Pulse):
         self.qubit = None
         self.negative_amplitude = False
 
+        self.theta_i = None
+        self.theta_f = None
+        self.theta_tau = None
         self.t_tau = None
 
     def total_duration(self):
@@ -263,24 +396,21 @@ class CZ(Pulse):
 
         # Plateau is added as an extra extension of theta_f.
         theta_t = np.ones(len(t)) * self.theta_i
-        for i in range(len(t)):
-            if 0 < (t[i] - t0 + self.plateau / 2) < self.plateau:
-                theta_t[i] = self.theta_f
-            elif (0 < (t[i] - t0 + self.width / 2 + self.plateau / 2) <
-                  (self.width + self.plateau) / 2):
-                theta_t[i] = np.interp(
-                    t[i] - t0 + self.width / 2 + self.plateau / 2, self.t_tau,
-                    self.theta_tau)
-
-            elif (0 < (t[i] - t0 + self.width / 2 + self.plateau / 2) <
-                  (self.width + self.plateau)):
-                theta_t[i] = np.interp(
-                    t[i] - t0 + self.width / 2 - self.plateau / 2, self.t_tau,
-                    self.theta_tau)
-        # Clip theta_t to remove numerical outliers:
-        theta_t = np.clip(theta_t, self.theta_i, None)
+        # time relative to start of plateau and start of pulse
+        t_plateau = t - t0 + self.plateau / 2
+        t_pulse = t - t0 + self.width / 2 + self.plateau / 2
+        in_plateau = (0 < t_plateau) & (t_plateau < self.plateau)
+        in_rise = (~in_plateau & (0 < t_pulse) &
+                   (t_pulse < (self.width + self.plateau) / 2))
+        in_fall = (~in_plateau & ~in_rise & (0 < t_pulse) &
+                   (t_pulse < (self.width + self.plateau)))
+        theta_t[in_plateau] = self.theta_f
+        theta_t[in_rise] = np.interp(
+            t_pulse[in_rise], self.t_tau, self.theta_tau)
+        theta_t[in_fall] = np.interp(
+            t_pulse[in_fall] - self.plateau, self.t_tau, self.theta_tau)
 
-        # clip theta_f to remove numerical outliers
+        # Clip theta_t to remove numerical outliers:
         theta_t = np.clip(theta_t, self.theta_i, None)
         df = 2*self.Coupling * (1 / np.tan(theta_t) - 1 / np.tan(self.theta_i))
 
@@ -298,51 +428,82 @@ class CZ(Pulse):
 
     def calculate_cz_waveform(self):
         """Calculate waveform for c-phase and store in object"""
-        # notation and calculations are based on
-        # "Fast adiabatic qubit gates using only sigma_z control"
-        # PRA 90, 022307 (2014)
-        # Initial and final angles on the |11>-|02> bloch sphere
-        self.theta_i = np.arctan(2*self.Coupling / self.Offset)
-        self.theta_f = np.arctan(2*self.Coupling / self.amplitude)
-        # log.log(msg="calc", level=30)
-
-        # Renormalize fourier coefficients to initial and final angles
-        # Consistent with both Martinis & Geller and DiCarlo 1903.02492
-        Lcoeff = self.Lcoeff
-        Lcoeff[0] = (((self.theta_f - self.theta_i) / 2)
-                     - np.sum(self.Lcoeff[range(2, self.F_Terms, 2)]))
-
-        # defining helper variabels
-        n = np.arange(1, self.F_Terms + 1, 1)
-        n_points = 1000  # Number of points in the numerical integration
-
-        # Calculate pulse width in tau variable - See paper for details
-        tau = np.linspace(0, 1, n_points)
-        self.theta_tau = np.zeros(n_points)
-        # This corresponds to the sum in Eq. (15) in Martinis & Geller
-        for i in range(n_points):
-            self.theta_tau[i] = (
-                np.sum(Lcoeff * (1 - np.cos(2 * np.pi * n * tau[i]))) +
-                self.theta_i)
-        # Now calculate t_tau according to Eq. (20)
-        t_tau = np.trapz(np.sin(self.theta_tau), x=tau)
-        # log.info('t tau: ' + str(t_tau))
-        # t_tau = np.sum(np.sin(self.theta_tau))*(tau[1] - tau[0])
-        # Find the width in units of tau:
-        Width_tau = self.width / t_tau
-
-        # Calculating time as functions of tau
-        # we normalize to width_tau (calculated above)
-        tau = np.linspace(0, Width_tau, n_points)
-        self.t_tau = np.zeros(n_points)
-        self.t_tau2 = np.zeros(n_points)
-        for i in range(n_points):
-            if i > 0:
-                self.t_tau[i] = np.trapz(
-                    np.sin(self.theta_tau[0:i+1]), x=tau[0:i+1])
-                # self.t_tau[i] = np.sum(np.sin(self.theta_tau[0:i+1]))*(tau[1]-tau[0])
+        # the calculation only depends on a few parameters, re-use results
+        (self.theta_i, self.theta_f, self.Lcoeff[0], self.theta_tau,
+         self.t_tau) = _calculate_cz_shape(
+            self.Coupling, self.Offset, self.amplitude,
+            tuple(self.Lcoeff[1:]), self.F_Terms, self.width)
+
+
+@lru_cache(maxsize=64)
+def _calculate_cz_shape(coupling, offset, amplitude, l_coeff, f_terms, width):
+    """Calculate theta(tau) and t(tau) for a c-phase pulse.
+
+    Parameters
+    ----------
+    coupling : float
+        Coupling between the |11> and |02> states.
+    offset : float
+        Initial detuning between the |11> and |02> states.
+    amplitude : float
+        Final detuning between the |11> and |02> states.
+    l_coeff : tuple of float
+        Fourier coefficients, except the first one.
+    f_terms : int
+        Number of Fourier terms.
+    width : float
+        Pulse width.
+
+    Returns
+    -------
+    tuple
+        (theta_i, theta_f, first Fourier coefficient, theta_tau, t_tau)
+
+    """
+    # notation and calculations are based on
+    # "Fast adiabatic qubit gates using only sigma_z control"
+    # PRA 90, 022307 (2014)
+    # Initial and final angles on the |11>-|02> bloch sphere
+    theta_i = np.arctan(2*coupling / offset)
+    theta_f = np.arctan(2*coupling / amplitude)
+
+    # Renormalize fourier coefficients to initial and final angles
+    # Consistent with both Martinis & Geller and DiCarlo 1903.02492
+    Lcoeff = np.array((0.0, ) + l_coeff)
+    Lcoeff[0] = (((theta_f - theta_i) / 2)
+                 - np.sum(Lcoeff[range(2, f_terms, 2)]))
+
+    # defining helper variabels
+    n = np.arange(1, f_terms + 1, 1)
+    n_points = 1000  # Number of points in the numerical integration
+
+    # Calculate pulse width in tau variable - See paper for details
+    tau = np.linspace(0, 1, n_points)
+    # This corresponds to the sum in Eq. (15) in Martinis & Geller
+    theta_tau = (
+        np.dot(1 - np.cos(2 * np.pi * np.outer(tau, n)), Lcoeff[:f_terms]) +
+        theta_i)
+    # Now calculate t_tau according to Eq. (20)
+    t_tau = np.trapz(np.sin(theta_tau), x=tau)
+    # Find the width in units of tau:
+    Width_tau = width / t_tau
+
+    # Calculating time as functions of tau
+    # we normalize to width_tau (calculated above)
+    tau = np.linspace(0, Width_tau, n_points)
+    # cumulative trapezoidal integral of sin(theta) over tau
+    y = np.sin(theta_tau)
+    t_tau = np.zeros(n_points)
+    t_tau[1:] = np.cumsum(0.5 * (y[1:] + y[:-1]) * np.diff(tau))
+
+    theta_tau.flags.writeable = False
+    t_tau.flags.writeable = False
+    return (theta_i, theta_f, Lcoeff[0], theta_tau, t_tau)
+
 
 class NetZero(CZ):
+    _derived_attributes = CZ._derived_attributes + ('slepian', )
+
     def __init__(self, *args, **kwargs):
         super().__init__()
         self.slepian = None
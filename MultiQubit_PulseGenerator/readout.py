@@ -29,6 +29,10 @@ class Demodulation(object):
         self.freq_offset = 0.0
         self.use_phase_ref = False
 
+        # cached reference matrices and last demodulation result
+        self._references = {}
+        self._last_result = None
+
         # self.n_records = 1
 
     def set_parameters(self, config={}):
@@ -60,6 +64,9 @@ class Demodulation(object):
     def demodulate(self, n, signal, ref=None):
         """Calculate complex signal from data and reference.
 
+        All qubits are demodulated in one pass, the result is kept and
+        re-used by calls for other qubits with the same input data.
+
         Parameters
         ----------
         n : int
@@ -77,57 +84,14 @@ class Demodulation(object):
             Complex array matching number of segments in input
 
         """
-        # get parameters
-        frequency = self.frequencies[n] - self.freq_offset
-        n_segment = int(self.n_records)
-        # get input data from dict, with keys {'y': value, 't0': t0, 'dt': dt}
-        if signal is None:
-            return np.zeros(n_segment, dtype=complex)
-        vY = signal['y']
-        dt = signal['dt']
-        # get shape of input data
-        shape = signal.get('shape', vY.shape)
-        # override segment parameter if input data has more than one dimension
-        if len(shape) > 1:
-            n_segment = shape[0]
-        # avoid exceptions if no time step is given
-        if dt == 0:
-            dt = 1.0
-        # get indices for data trimming
-        n0 = int(round(self.demod_skip / dt))
-        n_total = vY.size
-        length = 1 + int(round(self.demod_length / dt))
-        length = min(length, int(n_total / n_segment) - n0)
-        if length <= 1:
-            return np.zeros(n_segment, dtype=complex)
-
-        # define data to use, put in 2d array of segments
-        vData = np.reshape(vY, (n_segment, int(n_total / n_segment)))
-        # calculate cos/sin vectors, allow segmenting
-        vTime = dt * (n0 + np.arange(length, dtype=float))
-        vCos = np.cos(2 * np.pi * vTime * frequency)
-        vSin = np.sin(2 * np.pi * vTime * frequency)
-        # calc I/Q
-        dI = 2 * np.trapz(vCos * vData[:, n0:n0 + length]) / float(length - 1)
-        dQ = 2 * np.trapz(vSin * vData[:, n0:n0 + length]) / float(length - 1)
-        values = dI + 1j * dQ
-        if self.use_phase_ref and ref is not None:
-            # skip reference if trace length doesn't match
-            if len(ref['y']) != len(vY):
-                return values
-            vRef = np.reshape(ref['y'], (n_segment, int(n_total / n_segment)))
-            Iref = (2 * np.trapz(vCos * vRef[:, n0:n0 + length]) /
-                    float(length - 1))
-            Qref = (2 * np.trapz(vSin * vRef[:, n0:n0 + length]) /
-                    float(length - 1))
-            # subtract the reference angle
-            dAngleRef = np.arctan2(Qref, Iref)
-            values /= (np.cos(dAngleRef) + 1j * np.sin(dAngleRef))
-        return values
+        return self.demodulate_all(signal, ref)[n]
 
     def demodulate_iq(self, n, signal_i, signal_q, ref=None):
         """Calculate complex signal from complex data and reference.
 
+        All qubits are demodulated in one pass, the result is kept and
+        re-used by calls for other qubits with the same input data.
+
         Parameters
         ----------
         n : int
@@ -148,57 +112,210 @@ class Demodulation(object):
             Complex array matching number of segments in input
 
         """
-        # get parameters
-        frequency = self.frequencies[n] - self.freq_offset
-        n_segment = int(self.n_records)
-        # get input data from dict, with keys {'y': value, 't0': t0, 'dt': dt}
+        return self.demodulate_iq_all(signal_i, signal_q, ref)[n]
+
+    def demodulate_all(self, signal, ref=None):
+        """Calculate complex signal for all qubits from data and reference.
+
+        Parameters
+        ----------
+        signal : dict
+            Dictionary with signal data
+
+        ref : dict
+            Dictionary with reference data
+
+        Returns
+        -------
+        values : complex numpy array
+            Complex array with shape (n_qubit, number of segments)
+
+        """
+        if signal is None:
+            return np.zeros((self.n_qubit, int(self.n_records)),
+                            dtype=complex)
+        return self._demodulate_batch(
+            signal, signal['y'], ref, iq=False)
+
+    def demodulate_iq_all(self, signal_i, signal_q, ref=None):
+        """Calculate complex signal for all qubits from complex data.
+
+        Parameters
+        ----------
+        signal_i : dict
+            Dictionary with in-phase signal data
+
+        signal_q : dict
+            Dictionary with qudrature signal data
+
+        ref : dict
+            Dictionary with reference data
+
+        Returns
+        -------
+        values : complex numpy array
+            Complex array with shape (n_qubit, number of segments)
+
+        """
         if signal_i is None or signal_q is None:
-            return np.zeros(n_segment, dtype=complex)
-        vI = signal_i['y']
-        vQ = signal_q['y']
-        if vI.shape != vQ.shape:
+            return np.zeros((self.n_qubit, int(self.n_records)),
+                            dtype=complex)
+        if signal_i['y'].shape != signal_q['y'].shape:
             raise ValueError('I and Q must have the same shape.')
+        return self._demodulate_batch(
+            signal_i, (signal_i['y'], signal_q['y']), ref, iq=True)
 
+    def _demodulate_batch(self, signal, data, ref, iq):
+        """Demodulate all qubits, re-using the last result if possible.
+
+        Parameters
+        ----------
+        signal : dict
+            Dictionary with signal data, used for shape and time step
+
+        data : numpy array or tuple of numpy array
+            Signal data, or the in-phase and quadrature data if `iq` is True
+
+        ref : dict
+            Dictionary with reference data
+
+        iq : bool
+            If True, demodulate complex I/Q data
+
+        Returns
+        -------
+        values : complex numpy array
+            Complex array with shape (n_qubit, number of segments)
+
+        """
+        arrays = data if iq else (data,)
+        vRef = None
+        if self.use_phase_ref and ref is not None:
+            vRef = ref['y']
+        # parameters that the result depends on
+        key = (iq, tuple(self.frequencies - self.freq_offset),
+               self.demod_skip, self.demod_length, int(self.n_records),
+               signal['dt'], tuple(signal.get('shape', arrays[0].shape)))
+        if self._last_result is not None:
+            (last_key, last_arrays, last_ref, values) = self._last_result
+            if (key == last_key and
+                    _equal_arrays(arrays + (vRef,), last_arrays + (last_ref,))):
+                return values
+
+        values = self._demodulate_data(signal, data, vRef, iq)
+        # keep copies, the caller may re-use the input buffers
+        self._last_result = (
+            key, tuple(np.array(x) for x in arrays),
+            None if vRef is None else np.array(vRef), values)
+        return values
+
+    def _demodulate_data(self, signal, data, vRef, iq):
+        """Demodulate all qubits with one matrix product."""
+        n_segment = int(self.n_records)
+        vY = data[0] if iq else data
+        dt = signal['dt']
+        # get shape of input data
+        shape = signal.get('shape', vY.shape)
         # override segment parameter if input data has more than one dimension
-        shape = signal_i.get('shape', vI.shape)
         if len(shape) > 1:
             n_segment = shape[0]
-        dt = signal_i['dt']
         # avoid exceptions if no time step is given
         if dt == 0:
             dt = 1.0
         # get indices for data trimming
         n0 = int(round(self.demod_skip / dt))
-        n_total = vI.size
+        n_total = vY.size
         length = 1 + int(round(self.demod_length / dt))
         length = min(length, int(n_total / n_segment) - n0)
         if length <= 1:
-            return np.zeros(n_segment, dtype=complex)
+            return np.zeros((self.n_qubit, n_segment), dtype=complex)
 
         # define data to use, put in 2d array of segments
-        vData = np.reshape(vI + 1j * vQ, (n_segment, int(n_total / n_segment)))
-        # calculate cos/sin vectors, allow segmenting
-        vTime = dt * (n0 + np.arange(length, dtype=float))
-        vS = np.exp(2j * np.pi * vTime * frequency)
-
-        # calc I/Q
-        dI = np.trapz((vS * vData[:, n0:n0 + length]).real) / float(length - 1)
-        dQ = -np.trapz((vS * vData[:, n0:n0 + length]).imag) / float(length - 1)
-        values = dI + 1j * dQ
-        if self.use_phase_ref and ref is not None:
+        if iq:
+            vData = np.reshape(data[0] + 1j * data[1],
+                               (n_segment, int(n_total / n_segment)))
+        else:
+            vData = np.reshape(vY, (n_segment, int(n_total / n_segment)))
+        mRef = self._get_reference_matrix(dt, n0, length, iq)
+        values = self._project(vData[:, n0:n0 + length], mRef, iq)
+        if vRef is not None:
             # skip reference if trace length doesn't match
-            if len(ref['y']) != len(vI):
+            if len(vRef) != len(vY):
                 return values
-            vRef = np.reshape(ref['y'], (n_segment, int(n_total / n_segment)))
-            Iref = (np.trapz((vS * vRef[:, n0:n0 + length]).real)
-                    / float(length - 1))
-            Qref = (-np.trapz((vS * vRef[:, n0:n0 + length]).imag)
-                    / float(length - 1))
+            vRef = np.reshape(vRef, (n_segment, int(n_total / n_segment)))
+            values_ref = self._project(vRef[:, n0:n0 + length], mRef, iq)
             # subtract the reference angle
-            dAngleRef = np.arctan2(Qref, Iref)
+            dAngleRef = np.arctan2(values_ref.imag, values_ref.real)
             values /= (np.cos(dAngleRef) + 1j * np.sin(dAngleRef))
         return values
 
+    def _project(self, vData, mRef, iq):
+        """Project segments onto the reference matrix, shape (qubit, seg)."""
+        if iq:
+            return np.conj(np.dot(vData, mRef)).T
+        # real data, reference matrix has cos and sin in separate columns
+        vIQ = np.dot(vData, mRef)
+        return vIQ[:, :self.n_qubit].T + 1j * vIQ[:, self.n_qubit:].T
+
+    def _get_reference_matrix(self, dt, n0, length, iq):
+        """Get the demodulation reference matrix for all qubits.
+
+        The matrix includes the weights of the trapezoidal integration and
+        the normalization, and is cached for the current parameters.
+
+        Parameters
+        ----------
+        dt : float
+            Time step of the data
+
+        n0 : int
+            Number of samples to skip at the start of each segment
+
+        length : int
+            Number of samples to integrate over
+
+        iq : bool
+            If True, create reference for complex I/Q data
+
+        Returns
+        -------
+        numpy array
+            Complex matrix with shape (length, n_qubit) if `iq` is True, else
+            real matrix with shape (length, 2 * n_qubit) with cos and sin.
+
+        """
+        frequencies = self.frequencies - self.freq_offset
+        key = (tuple(frequencies), dt, n0, length, iq)
+        mRef = self._references.get(key)
+        if mRef is not None:
+            return mRef
+        # trapezoidal weights and normalization
+        weights = np.ones(length) / float(length - 1)
+        weights[0] /= 2
+        weights[-1] /= 2
+        vTime = dt * (n0 + np.arange(length, dtype=float))
+        phase = 2 * np.pi * np.outer(vTime, frequencies)
+        if iq:
+            mRef = weights[:, np.newaxis] * np.exp(1j * phase)
+        else:
+            mRef = 2 * weights[:, np.newaxis] * np.hstack(
+                (np.cos(phase), np.sin(phase)))
+        # only keep a few references, parameters rarely change
+        if len(self._references) >= 8:
+            self._references.clear()
+        self._references[key] = mRef
+        return mRef
+
+
+def _equal_arrays(arrays_a, arrays_b):
+    """Check if two sequences of arrays (or None) have equal content."""
+    for a, b in zip(arrays_a, arrays_b):
+        if a is None or b is None:
+            if a is not b:
+                return False
+        elif a.shape != b.shape or not np.array_equal(a, b):
+            return False
+    return True
 
 if __name__ == '__main__':
     pass
@@ -1,7 +1,12 @@
 #!/usr/bin/env python3
+import hashlib
 import logging
+import pickle
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import numpy as np
 import copy
+from scipy.signal import oaconvolve
 
 import crosstalk
 import gates
@@ -14,7 +19,6 @@ import tomography
 # Allow logging to Labber's instrument log
 log = logging.getLogger('LabberDriver')
 
-# TODO Reduce calc of CZ by finding all unique TwoQubitGates in seq and calc.
 # TODO Make I(width=None) have the width of the longest gate in the step
 # TODO Add checks so that not both t0 and dt are given
 # TODO Two composite gates should be able to be parallell
@@ -40,6 +44,24 @@ class GateOnQubit:
         return self.__str__()
 
 
+# gate kinds in the schedule of a sequence
+KIND_OTHER = 0
+KIND_XY = 1
+KIND_Z = 2
+KIND_TWO_QUBIT = 3
+KIND_READOUT = 4
+KIND_VIRTUAL_Z = 5
+KIND_IDENTITY = 6
+
+# output channel types in pulse lists
+CHANNEL_XY = 0
+CHANNEL_Z = 1
+CHANNEL_READOUT = 2
+
+# filters longer than this are applied with overlap-add FFT convolution
+FFT_FILTER_SIZE = 200
+
+
 class Step:
     """Represent one step in a sequence.
 
@@ -145,6 +167,79 @@ class Step:
         return str(self.gates)
 
 
+def _create_step(qubit, gate, t0=None, dt=None, align='center'):
+    """Create a step with the given gate(s), see `Sequence.add_gate`."""
+    step = Step(t0=t0, dt=dt, align=align)
+    if isinstance(gate, list):
+        if not isinstance(qubit, list):
+            raise ValueError(
+                """Provide qubit indices as a list when adding more than
+                one gate.""")
+        if len(gate) != len(qubit):
+            raise ValueError(
+                "Length of gate list must equal length of qubit list.")
+
+        for q, g in zip(qubit, gate):
+            step.add_gate(q, g)
+    else:
+        if gate.number_of_qubits() > 1:
+            if not isinstance(qubit, list):
+                raise ValueError(
+                    "Provide qubit list for gates with more than one qubit"
+                )
+        else:
+            if not isinstance(qubit, int):
+                raise ValueError(
+                    "For single gates, give qubit as int (not list).")
+        step.add_gate(qubit, gate)
+    return step
+
+
+class _Schedule:
+    """Structure-of-arrays representation of the gates in a sequence.
+
+    Parameters
+    ----------
+    n_step : int
+        Number of steps.
+    n_gate : int
+        Total number of gates in all steps.
+
+    Attributes
+    ----------
+    gates : list of :obj:`GateOnQubit`
+        All gates, in sequence order.
+    step : numpy array of int
+        Index of the step containing each gate.
+    kind : numpy array of int
+        Kind of each gate, one of the KIND_* constants.
+    qubit : numpy array of int
+        Qubit of single-qubit gates, -1 for multi-qubit gates.
+    duration : numpy array of float
+        Duration of each gate.
+    theta : numpy array of float
+        Rotation angle of virtual Z gates, zero for other gates.
+    dt : numpy array of float
+        Spacing to previous step, NaN if not given.
+    t0 : numpy array of float
+        Absolute step position, NaN if not given.
+    max_duration : numpy array of float
+        Duration of the longest gate in each step.
+
+    """
+
+    def __init__(self, n_step, n_gate):
+        self.gates = [None] * n_gate
+        self.step = np.empty(n_gate, dtype=int)
+        self.kind = np.empty(n_gate, dtype=int)
+        self.qubit = np.empty(n_gate, dtype=int)
+        self.duration = np.empty(n_gate)
+        self.theta = np.zeros(n_gate)
+        self.dt = np.empty(n_step)
+        self.t0 = np.empty(n_step)
+        self.max_duration = np.zeros(n_step)
+
+
 class Sequence:
     """A multi qubit seqence.
 
@@ -329,31 +424,7 @@ class Sequence:
             Where in the sequence to insert the new gate.
 
         """
-        step = Step(t0=t0, dt=dt, align=align)
-        if isinstance(gate, list):
-            if not isinstance(qubit, list):
-                raise ValueError(
-                    """Provide qubit indices as a list when adding more than
-                    one gate.""")
-            if len(gate) != len(qubit):
-                raise ValueError(
-                    "Length of gate list must equal length of qubit list.")
-
-            for q, g in zip(qubit, gate):
-                step.add_gate(q, g)
-        else:
-            if gate.number_of_qubits() > 1:
-                if not isinstance(qubit, list):
-                    raise ValueError(
-                        "Provide qubit list for gates with more than one qubit"
-                    )
-            else:
-                if not isinstance(qubit, int):
-                    raise ValueError(
-                        "For single gates, give qubit as int (not list).")
-            step.add_gate(qubit, gate)
-            # log.info('adding gate {} to {}. 2qb gate: {}'.format(gate, qubit, isinstance(gate, gates.TwoQubitGate)))
-
+        step = _create_step(qubit, gate, t0=t0, dt=dt, align=align)
         if index is None:
             self.sequence_list.append(step)
             # log.info('adding step to sequence list')
@@ -446,6 +517,84 @@ class Sequence:
         self._state_tomography.set_parameters(config)
 
 
+class _ConfigRecorder:
+    """Configuration wrapper keeping track of the quantities that are read.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration as defined by Labber driver configuration window
+
+    """
+
+    def __init__(self, config):
+        self._config = config
+        self.keys = set()
+
+    def get(self, key, default=None):
+        self.keys.add(key)
+        return self._config.get(key, default)
+
+    def __getitem__(self, key):
+        self.keys.add(key)
+        return self._config[key]
+
+    def __contains__(self, key):
+        return key in self._config
+
+
+class StageTimer:
+    """Measure time spent in the stages of waveform compilation.
+
+    Times of stages with the same name are added up until the timer is
+    cleared, so that multiple compilations can be profiled together.
+
+    Parameters
+    ----------
+    enabled : bool
+        If False, calls to `mark` are ignored (the default is False).
+
+    """
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.times = dict()
+        self._t = time.perf_counter()
+
+    def clear(self):
+        """Remove all measured times."""
+        self.times = dict()
+
+    def start(self):
+        """Start timing the next stage."""
+        self._t = time.perf_counter()
+
+    def mark(self, stage):
+        """Add time since start or previous mark to a stage.
+
+        Parameters
+        ----------
+        stage : str
+            Name of stage that just finished.
+
+        """
+        if not self.enabled:
+            return
+        t = time.perf_counter()
+        self.times[stage] = self.times.get(stage, 0.0) + t - self._t
+        self._t = t
+
+    def total(self):
+        """Get total time of all stages, in seconds."""
+        return sum(self.times.values())
+
+    def format(self):
+        """Get measured times as a string, with the slowest stage first."""
+        stages = sorted(self.times.items(), key=lambda x: -x[1])
+        return ', '.join('%s: %.2f ms' % (stage, 1E3 * t)
+                         for stage, t in stages)
+
+
 class SequenceToWaveforms:
     """Compile a multi qubit sequence into waveforms.
 
@@ -519,8 +668,31 @@ class SequenceToWaveforms:
         self.pulses_2qb = [None for n in range(self.n_qubit - 1)]
         self.pulses_readout = [None for n in range(self.n_qubit)]
 
+        # cache of sampled pulses, shared between compilations
+        self._envelopes = pulses.EnvelopeCache()
+
+        # incremental compilation, quantities used by each pulse, counter
+        # for other settings, output channels to update, and previous output
+        self.incremental_compilation = False
+        self._pulse_quantities = {}
+        self._settings_version = 0
+        self._changed_xy = set(range(self.n_qubit))
+        self._changed_z = set(range(self.n_qubit))
+        self._changed_readout = True
+        self._previous_output = None
+
+        # pulse list output, placements for each output channel and
+        # envelopes referenced by the placements
+        self.generate_pulse_list = False
+        self._pulse_list = {}
+        self._pulse_envelopes = {}
+
+        # time spent in each stage of the compilation
+        self.timer = StageTimer()
+
         # cross-talk
         self.compensate_crosstalk = False
+        self.crosstalk_method = 'Per gate'
         self._crosstalk = crosstalk.Crosstalk()
 
         # predistortion
@@ -556,6 +728,7 @@ class SequenceToWaveforms:
         # filters
         self.use_gate_filter = False
         self.use_z_filter = False
+        self._filter_windows = {}
 
         # readout trig settings
         self.readout_trig_generate = False
@@ -580,6 +753,8 @@ class SequenceToWaveforms:
             Description of returned object.
 
         """
+        timer = self.timer
+        timer.start()
         self.sequence = sequence
         self.sequence_list = sequence.sequence_list
         # log.info('Start of get_waveforms. Len sequence list: {}'.format(len(self.sequence_list)))
@@ -587,15 +762,19 @@ class SequenceToWaveforms:
 
         if not self.simultaneous_pulses:
             self._seperate_gates()
+            timer.mark('separate gates')
         # log.info('Point 2: Sequence_list[6].gates = {}'.format(self.sequence_list[6].gates))
 
         self._explode_composite_gates()
+        timer.mark('explode composite gates')
         # log.info('Point 3: Sequence_list[6].gates = {}'.format(self.sequence_list[6].gates))
 
         self._add_pulses_and_durations()
+        timer.mark('add pulses')
         # log.info('Point 4: Sequence_list[6].gates = {}'.format(self.sequence_list[6].gates))
 
         self._add_timings()
+        timer.mark('add timings')
         # log.info('Point 5: Sequence_list[6].gates = {}'.format(self.sequence_list[6].gates))
 
         self._init_waveforms()
@@ -607,40 +786,61 @@ class SequenceToWaveforms:
                                 self.sequence_list[-1].t_end)
             for step in self.sequence_list:
                 step.time_shift(shift)
+        timer.mark('init waveforms')
 
         self._perform_virtual_z()
+        timer.mark('virtual z')
+        # pulse lists need pulses with drag and modulation applied
+        self._all_drag_f_equal = (self._check_drag_and_frequency() and
+                                  not self.generate_pulse_list)
+        self._find_changed_channels()
+        if self.generate_pulse_list:
+            self._clear_pulse_list()
+        timer.mark('find changed channels')
         self._generate_waveforms()
 
         # collapse all xy pulses to one waveform if no local XY control
-        if not self.local_xy:
+        if not self.local_xy and len(self._changed_xy) > 0:
             # sum all waveforms to first one
             self._wave_xy[0] = np.sum(self._wave_xy[:self.n_qubit], 0)
             # clear other waveforms
             for n in range(1, self.n_qubit):
                 self._wave_xy[n][:] = 0.0
+        timer.mark('generate waveforms')
 
         if self.use_z_offset:
             self._add_global_Z_offset()
+            timer.mark('z offset')
         if self.use_z_during_readout:
             self._add_z_during_readout()
+            timer.mark('z during readout')
         # log.info('before predistortion, _wave_z max is {}'.format(np.max(self._wave_z)))
-        # if self.compensate_crosstalk:
-        #     self._perform_crosstalk_compensation()
+        if (self.compensate_crosstalk and
+                self.crosstalk_method == 'Matrix inverse' and
+                len(self._changed_z) > 0):
+            self._perform_crosstalk_compensation()
+            timer.mark('crosstalk compensation')
         if self.perform_predistortion:
             self._predistort_xy_waveforms()
+            timer.mark('predistortion xy')
         if self.perform_predistortion_z:
             self._predistort_z_waveforms()
-        if self.readout_trig_generate:
+            timer.mark('predistortion z')
+        if self.readout_trig_generate and self._changed_readout:
             self._add_readout_trig()
+            timer.mark('readout trig')
         if self.generate_gate_switch:
             self._add_microwave_gate()
+            timer.mark('gate switch')
         self._filter_output_waveforms()
         self._zero_last_z_point()
+        timer.mark('filters')
 
         # Apply offsets
-        self.readout_iq += self.readout_i_offset + 1j*self.readout_q_offset
-        if self.number_readout_waveforms == 'Two':
-            self.readout_iq2 += self.readout_i_offset2 + 1j*self.readout_q_offset2
+        if self._changed_readout:
+            self.readout_iq += self.readout_i_offset + 1j*self.readout_q_offset
+            if self.number_readout_waveforms == 'Two':
+                self.readout_iq2 += self.readout_i_offset2 + 1j*self.readout_q_offset2
 
         # create and return dictionary with waveforms
         waveforms = dict()
@@ -650,6 +850,19 @@ class SequenceToWaveforms:
         waveforms['readout_trig'] = self.readout_trig
         waveforms['readout_iq'] = self.readout_iq
         waveforms['readout_iq2'] = self.readout_iq2
+        if self.generate_pulse_list:
+            (waveforms['pulse_list'],
+             waveforms['envelopes']) = self._get_pulse_list()
+            timer.mark('pulse list')
+        # keep output, to re-use unchanged channels in next compilation
+        if self.incremental_compilation:
+            self._previous_output = dict(
+                signatures=self._channel_signatures,
+                xy=list(self._wave_xy), z=list(self._wave_z),
+                gate=list(self._wave_gate), readout_trig=self.readout_trig,
+                readout_iq=self.readout_iq, readout_iq2=self.readout_iq2)
+        else:
+            self._previous_output = None
 
         # log.info('returning z waveforms in get_waveforms. Max is {}'.format(np.max(waveforms['z'])))
         return waveforms
@@ -675,35 +888,64 @@ class SequenceToWaveforms:
         self.sequence_list = new_sequences
 
     def _add_timings(self):
-        t_start = 0
-        for step in self.sequence_list:
-            if step.dt is None and step.t0 is None:
-                # Use global pulse spacing
-                step.dt = self.dt
-            # Find longest gate in sequence
-            max_duration = np.max([x.duration for x in step.gates])
-            if step.t0 is None:
-                step.t_start = self._round(t_start + step.dt)
-                step.t0 = self._round(step.t_start + max_duration / 2)
+        """Calculate start and end times of all steps.
+
+        Steps are placed after the previous step, unless they have an
+        absolute position. Times are accumulated as integer multiples of the
+        rounding accuracy, so the result matches rounding after each step.
+
+        """
+        schedule = self._schedule
+        acc = 1E-12
+        relative = np.isnan(schedule.t0)
+        dt = np.round(np.nan_to_num(schedule.dt) / acc).astype(np.int64)
+        duration = np.round(schedule.max_duration / acc).astype(np.int64)
+        half_duration = np.round(
+            schedule.max_duration / 2 / acc).astype(np.int64)
+        # absolute steps set their own start time
+        t_abs = np.round(
+            (np.nan_to_num(schedule.t0) - schedule.max_duration / 2) /
+            acc).astype(np.int64)
+        # relative steps advance the position by spacing and duration, but
+        # steps with zero duration do not, to avoid double spacing
+        advance = np.where(relative & (duration > 0), dt + duration, 0)
+        position = np.cumsum(advance)
+        # position after absolute steps, used as offset for following steps
+        after_abs = t_abs + duration - np.where(duration == 0, dt, 0)
+        n_step = len(relative)
+        last_abs = np.maximum.accumulate(
+            np.where(relative, -1, np.arange(n_step)))
+        offset = np.where(
+            last_abs >= 0, (after_abs - position)[np.maximum(last_abs, 0)], 0)
+        position += offset
+        t_start = np.where(relative, np.r_[0, position[:-1]] + dt, t_abs)
+        t_end = t_start + duration
+        t_center = t_start + half_duration
+
+        # make sure that sequence starts on first delay
+        time_diff = self._round(self.first_delay - t_start[0] * acc)
+        t_start = t_start * acc
+        t_end = t_end * acc
+        t_center = t_center * acc
+        for n, step in enumerate(self.sequence_list):
+            step.t_start = t_start[n] + time_diff
+            step.t_end = t_end[n] + time_diff
+            if relative[n]:
+                step.t0 = t_center[n] + time_diff
             else:
-                step.t_start = self._round(step.t0 - max_duration / 2)
-            step.t_end = self._round(step.t_start + max_duration)
-            t_start = step.t_end  # Next step starts where this one ends
-            # Avoid double spacing for steps with 0 duration
-            if max_duration == 0:
-                t_start = t_start - step.dt
-
-        # Make sure that the sequence is sorted chronologically.
-        # self.sequence_list.sort(key=lambda x: x.t_start) # TODO Fix this
-
-        # Make sure that sequnce starts on first delay
-        time_diff = self._round(self.first_delay -
-                                self.sequence_list[0].t_start)
-        for step in self.sequence_list:
-            step.time_shift(time_diff)
+                step.t0 += time_diff
 
     def _add_pulses_and_durations(self):
-        for step in self.sequence_list:
+        """Add pulses to gates, and collect gates in a schedule."""
+        n_gate = sum(len(step.gates) for step in self.sequence_list)
+        schedule = _Schedule(len(self.sequence_list), n_gate)
+        i = 0
+        for n, step in enumerate(self.sequence_list):
+            if step.dt is None and step.t0 is None:
+                # Use global pulse spacing
+                step.dt = self.dt
+            schedule.dt[n] = np.nan if step.dt is None else step.dt
+            schedule.t0[n] = np.nan if step.t0 is None else step.t0
             for gate in step.gates:
                 if gate.pulse is None:
                     gate.pulse = self._get_pulse_for_gate(gate)
@@ -711,6 +953,33 @@ class SequenceToWaveforms:
                     gate.duration = 0
                 else:
                     gate.duration = gate.pulse.total_duration()
+                gate_obj = gate.gate
+                if isinstance(gate_obj, gates.VirtualZGate):
+                    kind = KIND_VIRTUAL_Z
+                    schedule.theta[i] = gate_obj.theta
+                elif isinstance(gate_obj, gates.SingleQubitXYRotation):
+                    kind = KIND_XY
+                elif isinstance(gate_obj, gates.SingleQubitZRotation):
+                    kind = KIND_Z
+                elif isinstance(gate_obj, gates.TwoQubitGate):
+                    kind = KIND_TWO_QUBIT
+                elif isinstance(gate_obj, gates.ReadoutGate):
+                    kind = KIND_READOUT
+                elif isinstance(gate_obj, gates.IdentityGate):
+                    kind = KIND_IDENTITY
+                else:
+                    kind = KIND_OTHER
+                schedule.gates[i] = gate
+                schedule.step[i] = n
+                schedule.kind[i] = kind
+                schedule.qubit[i] = (
+                    gate.qubit if isinstance(gate.qubit, int) else -1)
+                schedule.duration[i] = gate.duration
+                i += 1
+        if n_gate > 0:
+            np.maximum.at(schedule.max_duration, schedule.step,
+                          schedule.duration)
+        self._schedule = schedule
 
     def _get_pulse_for_gate(self, gate):
         qubit = gate.qubit
@@ -741,100 +1010,102 @@ class SequenceToWaveforms:
         # go through and predistort all xy waveforms
         n_wave = self.n_qubit if self.local_xy else 1
         for n in range(n_wave):
+            if n not in self._changed_xy:
+                continue
             self._wave_xy[n] = self._predistortions[n].predistort(
                 self._wave_xy[n])
 
     def _predistort_z_waveforms(self):
         # go through and predistort all waveforms
-        for n in range(self.n_qubit):
+        for n in sorted(self._changed_z):
             self._wave_z[n] = self._predistortions_z[n].predistort(
                 self._wave_z[n])
 
     def _perform_crosstalk_compensation(self):
         """Compensate for Z-control crosstalk."""
-        self._wave_z = self._crosstalk.compensate(self._wave_z)
+        self._crosstalk.compensate(self._wave_z)
 
     def _explode_composite_gates(self):
-        # Loop through the sequence until all CompositeGates are removed
-        # Note that there could be nested CompositeGates
-        n = 0
-        while n < len(self.sequence_list):
-            step = self.sequence_list[n]
-            i = 0
-            while i < len(step.gates):
-                gate = step.gates[i]
-                if isinstance(gate.gate, gates.CompositeGate):
-                    # # log.info('In exploded composite, handling composite gate {} at step {}'.format(gate, n))
-                    for m, g in enumerate(gate.gate.sequence):
-                        new_gate = [x.gate for x in g.gates]
-                        # Single gates shouldn't be lists
-                        if len(new_gate) == 1:
-                            new_gate = new_gate[0]
-
-                        # Translate gate qubit number to device qubit number
-                        new_qubit = [x.qubit for x in g.gates]
-                        for j, q in enumerate(new_qubit):
-                            if isinstance(q, int):
-                                if isinstance(gate.qubit, int):
-                                    new_qubit[j] = gate.qubit
-                                    continue
-                                new_qubit[j] = gate.qubit[q]
-                            else:
-                                new_qubit[j] = []
-                                for k in q:
-                                    new_qubit[j].append(gate.qubit[k])
-
-                        # Single qubit shouldn't be lists
-                        if len(new_qubit) == 1:
-                            new_qubit = new_qubit[0]
-                        # # log.info('In explode composite; modifying {} by adding gate {} at index {}'.format(gate, new_gate, n+m))
-                        self.sequence.add_gate(
-                            new_qubit, new_gate, index=n + m)
-
-                    del step.gates[i]
-                    # # log.info('In composite gates, removing step {}', i)
+        """Replace composite gates by the steps they contain.
 
-                    continue
-                i = i + 1
-            n = n + 1
+        The steps of a composite gate are placed directly after the step
+        containing it, and nested composite gates are expanded in the same
+        pass. Steps left without gates are removed.
 
-        # Remove any empty steps where the composite gates were
-        i = 0
-        while i < len(self.sequence_list):
-            step = self.sequence_list[i]
-            if len(step.gates) == 0:
-                del self.sequence_list[i]
-                # log.info('In composite gates, removing step {}', i)
-                continue
-            i = i + 1
+        """
+        sequence_list = []
+        for step in self.sequence_list:
+            self._expand_step(step, sequence_list)
+        if self.sequence.sequence_list is self.sequence_list:
+            self.sequence.sequence_list = sequence_list
+        self.sequence_list = sequence_list
+
+    def _expand_step(self, step, sequence_list):
+        """Add step to list, followed by steps of its composite gates."""
+        composite = [gate for gate in step.gates
+                     if isinstance(gate.gate, gates.CompositeGate)]
+        if len(composite) == 0:
+            sequence_list.append(step)
+            return
+        step.gates = [gate for gate in step.gates
+                      if not isinstance(gate.gate, gates.CompositeGate)]
+        if len(step.gates) > 0:
+            sequence_list.append(step)
+        # steps of each composite gate are placed directly after the step,
+        # so the steps of the last composite gate come first
+        for gate in reversed(composite):
+            for g in gate.gate.sequence:
+                new_gate = [x.gate for x in g.gates]
+                # Single gates shouldn't be lists
+                if len(new_gate) == 1:
+                    new_gate = new_gate[0]
+
+                # Translate gate qubit number to device qubit number
+                new_qubit = [x.qubit for x in g.gates]
+                for j, q in enumerate(new_qubit):
+                    if isinstance(q, int):
+                        if isinstance(gate.qubit, int):
+                            new_qubit[j] = gate.qubit
+                            continue
+                        new_qubit[j] = gate.qubit[q]
+                    else:
+                        new_qubit[j] = []
+                        for k in q:
+                            new_qubit[j].append(gate.qubit[k])
 
-        # for i, step in enumerate(self.sequence_list):
-            # log.info('At end of explode, step {} is {}'.format(i, step.gates))
+                # Single qubit shouldn't be lists
+                if len(new_qubit) == 1:
+                    new_qubit = new_qubit[0]
+                self._expand_step(_create_step(new_qubit, new_gate),
+                                  sequence_list)
 
     def _perform_virtual_z(self):
         """Shifts the phase of pulses subsequent to virtual z gates."""
+        schedule = self._schedule
         for qubit in range(self.n_qubit):
-            phase = 0
-            for step in self.sequence_list:
-                for gate in step.gates:
-                    gate_obj = None
-                    if qubit == gate.qubit:  # TODO Allow for 2 qb
-                        gate_obj = gate.gate
-                    if isinstance(gate_obj, gates.VirtualZGate):
-                        phase += gate_obj.theta
-                        continue
-                    if (isinstance(gate_obj, gates.SingleQubitXYRotation)
-                            and phase != 0):
-                        gate.gate = copy.copy(gate_obj)
-                        gate.gate.phi += phase
-                        # Need to recomput the pulse
-                        gate.pulse = self._get_pulse_for_gate(gate)
+            on_qubit = schedule.qubit == qubit
+            theta = np.where(
+                on_qubit & (schedule.kind == KIND_VIRTUAL_Z),
+                schedule.theta, 0.0)
+            if not np.any(theta):
+                continue
+            # accumulated phase at each gate
+            phase = np.cumsum(theta)
+            for i in np.nonzero(on_qubit & (schedule.kind == KIND_XY) &
+                                (phase != 0))[0]:
+                gate = schedule.gates[i]
+                gate.gate = copy.copy(gate.gate)
+                gate.gate.phi += phase[i]
+                # Need to recomput the pulse
+                gate.pulse = self._get_pulse_for_gate(gate)
 
     def _add_microwave_gate(self):
         """Create waveform for gating microwave switch."""
         n_wave = self.n_qubit if self.local_xy else 1
         # go through all waveforms
         for n, wave in enumerate(self._wave_xy[:n_wave]):
+            if n not in self._changed_xy:
+                continue
             if self.uniform_gate:
                 # the uniform gate is all ones
                 gate = np.ones_like(wave)
@@ -899,7 +1170,7 @@ class SequenceToWaveforms:
         z_offset[-1]=0.
 
         # append offset to Z waveforms
-        for n in range(self.n_qubit):
+        for n in sorted(self._changed_z):
             self._wave_z[n]+=(z_offset*self.z_offset_amplitude[n])
 
     def _add_z_during_readout(self):
@@ -933,7 +1204,7 @@ class SequenceToWaveforms:
         z_during_readout_length=len(z_during_readout)
 
         # add to Z waveforms during readout (at their ends)
-        for n in range(self.n_qubit):
+        for n in sorted(self._changed_z):
             self._wave_z[n][-z_during_readout_length:]+=(z_during_readout*self.z_readout_amplitude[n])
 
     def _filter_output_waveforms(self):
@@ -947,6 +1218,8 @@ class SequenceToWaveforms:
             # apply filter to all output waveforms
             n_wave = self.n_qubit if self.local_xy else 1
             for n in range(n_wave):
+                if n not in self._changed_xy:
+                    continue
                 self._wave_gate[n] = self._apply_window_filter(
                     self._wave_gate[n], window)
                 # make sure gate starts/ends in 0
@@ -959,12 +1232,21 @@ class SequenceToWaveforms:
             window = self._get_filter_window(
                 self.z_filter_size, self.z_filter, self.z_filter_kaiser_beta)
             # apply filter to all output waveforms
-            for n in range(self.n_qubit):
+            for n in sorted(self._changed_z):
                 self._wave_z[n] = self._apply_window_filter(
                     self._wave_z[n], window)
 
     def _get_filter_window(self, size=11, window='Kaiser', kaiser_beta=14.0):
         """Get filter for waveform convolution"""
+        # windows are defined in samples, re-use if settings are unchanged
+        key = (window, size, kaiser_beta)
+        if key not in self._filter_windows:
+            self._filter_windows[key] = self._create_filter_window(
+                size, window, kaiser_beta)
+        return self._filter_windows[key]
+
+    def _create_filter_window(self, size, window, kaiser_beta):
+        """Create normalized filter window"""
         if window == 'Rectangular':
             w = np.ones(size)
         elif window == 'Bartlett':
@@ -983,7 +1265,9 @@ class SequenceToWaveforms:
             w = np.kaiser(size, kaiser_beta)
         else:
             raise('Unknown filter windows function %s.' % str(window))
-        return w/w.sum()
+        w = w/w.sum()
+        w.flags.writeable = False
+        return w
 
     def _apply_window_filter(self, x, window):
         """Apply window filter to input waveform
@@ -1004,15 +1288,18 @@ class SequenceToWaveforms:
         # buffer waveform to avoid wrapping effects at boundaries
         n = len(window)
         s = np.r_[2*x[0] - x[n-1::-1], x, 2*x[-1] - x[-1:-n:-1]]
-        # apply convolution
-        y = np.convolve(s, window, mode='same')
+        # apply convolution, use FFT for long filters
+        if n > FFT_FILTER_SIZE:
+            y = oaconvolve(s, window, mode='same')
+        else:
+            y = np.convolve(s, window, mode='same')
         return y[n:-n+1]
 
     def _zero_last_z_point(self):
         """Make sure last point in z waveforms is always zero, since this is 
            the value output by the AWG between sequences.
         """
-        for n in range(self.n_qubit):
+        for n in sorted(self._changed_z):
             self._wave_z[n][-1]=0
 
     def _round(self, t, acc=1E-12):
@@ -1114,9 +1401,15 @@ class SequenceToWaveforms:
         self.readout_iq = np.zeros(self.n_pts_readout, dtype=np.complex)
         self.readout_iq2 = np.zeros(self.n_pts_readout, dtype=np.complex)
 
-    def _generate_waveforms(self):
-        """Generate the waveforms corresponding to the sequence."""
-        # check if drag and modulations frequencies are equal for all pulses
+    def _check_drag_and_frequency(self):
+        """Check if drag and modulation frequencies are equal for all pulses.
+
+        Returns
+        -------
+        bool
+            True if drag and modulation can be applied to whole waveforms.
+
+        """
         all_drag_f_equal = True
         freqs = [self.pulses_1qb_xy[n].frequency for n in range(self.n_qubit)]
         drags = [self.pulses_1qb_xy[n].use_drag for n in range(self.n_qubit)]
@@ -1137,6 +1430,114 @@ class SequenceToWaveforms:
             # break for loop at first difference
             if not all_drag_f_equal:
                 break
+        return all_drag_f_equal
+
+    def _get_channel_signatures(self):
+        """Get the pulses and timing of the gates added to each channel.
+
+        Returns
+        -------
+        dict
+            Lists of gate signatures for the 'xy' and 'z' channels of each
+            qubit, and for the 'readout' waveforms.
+
+        """
+        xy = [[] for n in range(self.n_qubit)]
+        z = [[] for n in range(self.n_qubit)]
+        readout = []
+        # xy modulation is applied afterwards using the qubit pulses
+        for n in range(self.n_qubit):
+            xy[n].append(self.pulses_1qb_xy[n].get_cache_key())
+        crosstalk = (self.compensate_crosstalk and
+                     self.crosstalk_method == 'Per gate')
+        # pulse objects are often shared between gates
+        pulse_keys = {}
+        for step in self.sequence_list:
+            for gate in step.gates:
+                qubit = gate.qubit
+                if isinstance(qubit, list):
+                    qubit = qubit[0]
+                gate_obj = gate.gate
+                if (gate.pulse is None or isinstance(
+                        gate_obj, (gates.IdentityGate, gates.VirtualZGate))):
+                    continue
+                pulse_key = pulse_keys.get(id(gate.pulse))
+                if pulse_key is None:
+                    pulse_key = gate.pulse.get_cache_key()
+                    pulse_keys[id(gate.pulse)] = pulse_key
+                signature = (pulse_key, gate.duration,
+                             step.t_start, step.t_end, step.align)
+                if isinstance(gate_obj, (gates.SingleQubitZRotation,
+                                         gates.TwoQubitGate)):
+                    if crosstalk:
+                        for q, scaling_factor in \
+                                self._crosstalk.get_couplings(qubit):
+                            z[q].append(signature + (qubit, scaling_factor))
+                    else:
+                        z[qubit].append(signature)
+                elif isinstance(gate_obj, gates.SingleQubitXYRotation):
+                    xy[qubit].append(signature)
+                elif isinstance(gate_obj, gates.ReadoutGate):
+                    readout.append(signature)
+        return dict(xy=xy, z=z, readout=readout)
+
+    def _find_changed_channels(self):
+        """Find output channels that changed since the previous compilation.
+
+        Unchanged channels are restored from the previous output, and are
+        skipped during waveform synthesis.
+
+        """
+        settings = (self._settings_version, self.n_pts, self.n_pts_readout,
+                    tuple(self.wave_xy_delays), tuple(self.wave_z_delays),
+                    self._all_drag_f_equal)
+        if self.use_z_during_readout:
+            settings += (max([p.total_duration()
+                              for p in self.pulses_readout]), )
+        all_qubits = set(range(self.n_qubit))
+        previous = self._previous_output
+        if (not self.incremental_compilation or previous is None or
+                previous['signatures'][0] != settings):
+            self._changed_xy = all_qubits
+            self._changed_z = all_qubits
+            self._changed_readout = True
+            if self.incremental_compilation:
+                self._channel_signatures = (
+                    settings, self._get_channel_signatures())
+            return
+
+        signatures = self._get_channel_signatures()
+        self._channel_signatures = (settings, signatures)
+        old = previous['signatures'][1]
+        self._changed_xy = set(
+            n for n in all_qubits if signatures['xy'][n] != old['xy'][n])
+        self._changed_z = set(
+            n for n in all_qubits if signatures['z'][n] != old['z'][n])
+        self._changed_readout = signatures['readout'] != old['readout']
+        # waveforms that are combined have to be updated together
+        if not self.local_xy and len(self._changed_xy) > 0:
+            self._changed_xy = all_qubits
+        if (self.compensate_crosstalk and
+                self.crosstalk_method == 'Matrix inverse' and
+                len(self._changed_z) > 0):
+            self._changed_z = all_qubits
+
+        # restore unchanged channels from previous output
+        for n in all_qubits - self._changed_xy:
+            self._wave_xy[n] = previous['xy'][n]
+            self._wave_gate[n] = previous['gate'][n]
+        for n in all_qubits - self._changed_z:
+            self._wave_z[n] = previous['z'][n]
+        if not self._changed_readout:
+            self.readout_trig = previous['readout_trig']
+            self.readout_iq = previous['readout_iq']
+            self.readout_iq2 = previous['readout_iq2']
+
+    def _generate_waveforms(self):
+        """Generate the waveforms corresponding to the sequence."""
+        all_drag_f_equal = self._all_drag_f_equal
+        freqs = [self.pulses_1qb_xy[n].frequency for n in range(self.n_qubit)]
+        drags = [self.pulses_1qb_xy[n].use_drag for n in range(self.n_qubit)]
 
         for step in self.sequence_list:
             for gate in step.gates:
@@ -1149,28 +1550,33 @@ class SequenceToWaveforms:
                 if isinstance(gate_obj,
                               (gates.IdentityGate, gates.VirtualZGate)):
                     continue
-                elif isinstance(gate_obj, gates.SingleQubitZRotation):
-                    waveform = self._wave_z[qubit]
-                    delay = self.wave_z_delays[qubit]
-                    if self.compensate_crosstalk:
-                        crosstalk = self._crosstalk.compensation_matrix[:,
-                                                                        qubit]
-                elif isinstance(gate_obj, gates.TwoQubitGate):
-                    # log.info('adding 2qb gate waveforms')
+                elif isinstance(gate_obj, (gates.SingleQubitZRotation,
+                                           gates.TwoQubitGate)):
+                    if (self.compensate_crosstalk and
+                            self.crosstalk_method == 'Per gate'):
+                        self._add_z_gate_with_crosstalk(gate, step, qubit)
+                        continue
+                    if qubit not in self._changed_z:
+                        continue
                     waveform = self._wave_z[qubit]
                     delay = self.wave_z_delays[qubit]
-                    if self.compensate_crosstalk:
-                        crosstalk = self._crosstalk.compensation_matrix[:,
-                                                                        qubit]
+                    channel = (CHANNEL_Z, qubit)
                 elif isinstance(gate_obj, gates.SingleQubitXYRotation):
+                    if qubit not in self._changed_xy:
+                        continue
                     waveform = self._wave_xy[qubit]
                     delay = self.wave_xy_delays[qubit]
+                    # xy waveforms are combined if no local XY control
+                    channel = (CHANNEL_XY, qubit if self.local_xy else 0)
                 elif isinstance(gate_obj, gates.ReadoutGate):
+                    if not self._changed_readout:
+                        continue
                     if gate.pulse.readout_target == 0:
                         waveform = self.readout_iq
                     else:
                         waveform = self.readout_iq2
                     delay = 0
+                    channel = (CHANNEL_READOUT, gate.pulse.readout_target)
                 else:
                     raise ValueError(
                         "Don't know which waveform to add {} to.".format(
@@ -1186,75 +1592,19 @@ class SequenceToWaveforms:
                     start = self._round(step.t_start + delay)
                     end = self._round(step.t_end + delay)
 
-                if (self.compensate_crosstalk and
-                    isinstance(gate_obj,
-                               (gates.SingleQubitZRotation,
-                                gates.TwoQubitGate))):
-                    for q in range(self.n_qubit):
-                        waveform = self._wave_z[q]
-                        delay = self.wave_z_delays[q]
-                        start = self._round(step.t_start + delay)
-                        end = self._round(step.t_end + delay)
-                        indices = np.arange(
-                            max(np.floor(start * self.sample_rate), 0),
-                            min(
-                                np.ceil(end * self.sample_rate),
-                                len(waveform)),
-                            dtype=int)
-
-                        # return directly if no indices
-                        if len(indices) == 0:
-                            continue
-
-                        # calculate time values for the pulse indices
-                        t = indices / self.sample_rate
-                        max_duration = end - start
-                        middle = end - max_duration / 2
-                        if step.align == 'center':
-                            t0 = middle
-                        elif step.align == 'left':
-                            t0 = middle - (max_duration - gate.duration) / 2
-                        elif step.align == 'right':
-                            t0 = middle + (max_duration - gate.duration) / 2
-
-                        scaling_factor = float(crosstalk[q, 0])
-                        if q != qubit:
-                            scaling_factor = -scaling_factor
-                        waveform[indices] += (
-                            scaling_factor
-                            * gate.pulse.calculate_waveform(t0, t))
-                else:
-                    # calculate the pulse waveform for the selected indices
-                    indices = np.arange(
-                        max(np.floor(start * self.sample_rate), 0),
-                        min(np.ceil(end * self.sample_rate), len(waveform)),
-                        dtype=int)
-
-                    # return directly if no indices
-                    if len(indices) == 0:
-                        continue
-
-                    # calculate time values for the pulse indices
-                    t = indices / self.sample_rate
-                    max_duration = end - start
-                    middle = end - max_duration / 2
-                    if step.align == 'center':
-                        t0 = middle
-                    elif step.align == 'left':
-                        t0 = middle - (max_duration - gate.duration) / 2
-                    elif step.align == 'right':
-                        t0 = middle + (max_duration - gate.duration) / 2
-                    waveform[indices] += gate.pulse.calculate_waveform(
-                        t0, t, ignore_drag_modulation=(
-                            all_drag_f_equal and isinstance(
-                                gate_obj, gates.SingleQubitXYRotation)
-                        )
-                    )
+                self._add_gate_to_waveform(
+                    waveform, gate, step, start, end,
+                    ignore_drag_modulation=(
+                        all_drag_f_equal and isinstance(
+                            gate_obj, gates.SingleQubitXYRotation)),
+                    channel=channel)
 
         # if all frequencies and drag were the same, apply afterwards
         if all_drag_f_equal:
             dt = self.t[1] - self.t[0]
             for n, wave in enumerate(self._wave_xy):
+                if n not in self._changed_xy:
+                    continue
                 # apply drag
                 if drags[n]:
                     beta = self.pulses_1qb_xy[n].drag_coefficient / dt
@@ -1280,13 +1630,483 @@ class SequenceToWaveforms:
                         wave[:] = p.iq_ratio * data_i + 1j * data_q
 
 
-    def set_parameters(self, config={}):
+    def _add_z_gate_with_crosstalk(self, gate, step, qubit):
+        """Add a Z pulse to all Z lines coupled to the qubit.
+
+        The pulse is evaluated once on the grid of the qubit's own line, and
+        added to the other lines with a shifted slice if their delays differ
+        by a whole number of samples. Other lines are sampled separately.
+
+        Parameters
+        ----------
+        gate : :obj:`GateOnQubit`
+            The gate to add.
+        step : :obj:`Step`
+            The step containing the gate.
+        qubit : int
+            Qubit carrying the Z pulse.
+
+        """
+        delay = self.wave_z_delays[qubit]
+        start = self._round(step.t_start + delay)
+        end = self._round(step.t_end + delay)
+        # sample pulse without clipping to waveform, to allow shifting
+        i0 = int(np.floor(start * self.sample_rate))
+        i1 = int(np.ceil(end * self.sample_rate))
+        if i1 <= i0:
+            return
+        y = None
+        for q, scaling_factor in self._crosstalk.get_couplings(qubit):
+            if q not in self._changed_z:
+                continue
+            waveform = self._wave_z[q]
+            shift = (self.wave_z_delays[q] - delay) * self.sample_rate
+            n_shift = int(round(shift))
+            if abs(shift - n_shift) > 1E-6:
+                # fractional delay, sample pulse on grid of this line
+                self._add_gate_to_waveform(
+                    waveform, gate, step,
+                    self._round(step.t_start + self.wave_z_delays[q]),
+                    self._round(step.t_end + self.wave_z_delays[q]),
+                    scaling_factor=scaling_factor, channel=(CHANNEL_Z, q))
+                continue
+            j0 = max(i0 + n_shift, 0)
+            j1 = min(i1 + n_shift, len(waveform))
+            if j1 <= j0:
+                continue
+            if y is None:
+                y = self._get_gate_waveform(gate, step, start, end, i0, i1)
+            y_shift = scaling_factor * y[j0 - i0 - n_shift:j1 - i0 - n_shift]
+            waveform[j0:j1] += y_shift
+            if self.generate_pulse_list:
+                self._add_to_pulse_list((CHANNEL_Z, q), j0, y_shift)
+
+    def _get_gate_waveform(self, gate, step, start, end, i0, i1,
+                           ignore_drag_modulation=False):
+        """Sample the pulse of a gate for a range of sample indices.
+
+        Parameters
+        ----------
+        gate : :obj:`GateOnQubit`
+            The gate to sample.
+        step : :obj:`Step`
+            The step containing the gate.
+        start : float
+            Start time of the step, including delays.
+        end : float
+            End time of the step, including delays.
+        i0 : int
+            Index of the first sample.
+        i1 : int
+            Index after the last sample.
+        ignore_drag_modulation : bool
+            If True, drag and modulation is disabled.
+
+        Returns
+        -------
+        waveform : numpy array
+            Read-only array with pulse waveform.
+
+        """
+        # find pulse position
+        max_duration = end - start
+        middle = end - max_duration / 2
+        if step.align == 'center':
+            t0 = middle
+        elif step.align == 'left':
+            t0 = middle - (max_duration - gate.duration) / 2
+        elif step.align == 'right':
+            t0 = middle + (max_duration - gate.duration) / 2
+
+        return self._envelopes.get_waveform(
+            gate.pulse, t0, i0, i1 - i0, self.sample_rate,
+            ignore_drag_modulation=ignore_drag_modulation)
+
+    def _add_gate_to_waveform(self, waveform, gate, step, start, end,
+                              ignore_drag_modulation=False,
+                              scaling_factor=1.0, channel=None):
+        """Add the pulse of a gate to a waveform.
+
+        The pulse is sampled through the envelope cache, so that repeated
+        gates are added with a slice operation instead of being recalculated.
+
+        Parameters
+        ----------
+        waveform : numpy array
+            Waveform to add the pulse to.
+        gate : :obj:`GateOnQubit`
+            The gate to add.
+        step : :obj:`Step`
+            The step containing the gate.
+        start : float
+            Start time of the step, including delays.
+        end : float
+            End time of the step, including delays.
+        ignore_drag_modulation : bool
+            If True, drag and modulation is disabled.
+        scaling_factor : float
+            Factor to multiply the pulse with.
+        channel : tuple, optional
+            Output channel type and index, used for the pulse list.
+
+        """
+        # get the range of indices in use
+        i0 = int(max(np.floor(start * self.sample_rate), 0))
+        i1 = int(min(np.ceil(end * self.sample_rate), len(waveform)))
+        # return directly if no indices
+        if i1 <= i0:
+            return
+
+        y = self._get_gate_waveform(
+            gate, step, start, end, i0, i1,
+            ignore_drag_modulation=ignore_drag_modulation)
+        if scaling_factor != 1.0:
+            y = scaling_factor * y
+        waveform[i0:i1] += y
+        if self.generate_pulse_list and channel is not None:
+            self._add_to_pulse_list(channel, i0, y)
+
+    def _clear_pulse_list(self):
+        """Clear pulse list placements of channels that will be updated."""
+        if self._previous_output is None:
+            self._pulse_list = {}
+        for n in self._changed_xy:
+            self._pulse_list[(CHANNEL_XY, n)] = []
+        for n in self._changed_z:
+            self._pulse_list[(CHANNEL_Z, n)] = []
+        if self._changed_readout:
+            self._pulse_list[(CHANNEL_READOUT, 0)] = []
+            self._pulse_list[(CHANNEL_READOUT, 1)] = []
+
+    def _add_to_pulse_list(self, channel, i0, y):
+        """Add placement of a sampled pulse to the pulse list.
+
+        Parameters
+        ----------
+        channel : tuple
+            Output channel type and index.
+        i0 : int
+            Index of the first sample.
+        y : numpy array
+            Sampled pulse, identical pulses share the same envelope.
+
+        """
+        y = np.asarray(y)
+        key = (channel[0], y.dtype.str,
+               hashlib.sha1(np.ascontiguousarray(y).tobytes()).digest())
+        if key not in self._pulse_envelopes:
+            self._pulse_envelopes[key] = y
+        self._pulse_list.setdefault(channel, []).append((i0, key))
+
+    def _is_pulse_list_exact(self, channel):
+        """Check if the output of a channel equals the sum of its pulses.
+
+        Post-processing acting on the whole waveform, like predistortion,
+        filters and offsets, makes the placed pulses differ from the output.
+
+        """
+        kind, n = channel
+        if kind == CHANNEL_XY:
+            return not self.perform_predistortion
+        if kind == CHANNEL_Z:
+            if (self.use_z_offset or self.use_z_during_readout or
+                    self.perform_predistortion_z or
+                    (self.use_z_filter and self.z_filter_size > 1) or
+                    (self.compensate_crosstalk and
+                     self.crosstalk_method == 'Matrix inverse')):
+                return False
+            # the last point of z waveforms is set to zero
+            return all(i0 + len(self._pulse_envelopes[key]) <
+                       len(self._wave_z[n])
+                       for i0, key in self._pulse_list.get(channel, []))
+        if n == 0:
+            return (self.readout_i_offset == 0 and
+                    self.readout_q_offset == 0)
+        return (self.readout_i_offset2 == 0 and
+                self.readout_q_offset2 == 0)
+
+    def _get_pulse_list(self):
+        """Get output waveforms as a list of pulses and unique envelopes.
+
+        Channels where the output is not a plain sum of the gate pulses are
+        represented by one placement of the full waveform.
+
+        Returns
+        -------
+        pulse_list : numpy array
+            Integer array of shape (n_pulse, 5), with columns for sequence
+            index, channel type, channel index, first sample and envelope
+            index. Overlapping pulses on the same channel add up.
+        envelopes : list of numpy array
+            Unique envelopes, referenced by the pulse list.
+
+        """
+        n_xy = self.n_qubit if self.local_xy else 1
+        channels = ([(CHANNEL_XY, n) for n in range(n_xy)] +
+                    [(CHANNEL_Z, n) for n in range(self.n_qubit)] +
+                    [(CHANNEL_READOUT, 0)])
+        if self.number_readout_waveforms == 'Two':
+            channels.append((CHANNEL_READOUT, 1))
+        outputs = {CHANNEL_XY: self._wave_xy, CHANNEL_Z: self._wave_z,
+                   CHANNEL_READOUT: [self.readout_iq, self.readout_iq2]}
+
+        # only keep envelopes in use
+        self._pulse_envelopes = {
+            key: self._pulse_envelopes[key]
+            for placements in self._pulse_list.values()
+            for i0, key in placements}
+        pulse_list = []
+        envelopes = []
+        indices = {}
+        for channel in channels:
+            if self._is_pulse_list_exact(channel):
+                placements = [
+                    (i0, key, self._pulse_envelopes[key])
+                    for i0, key in self._pulse_list.get(channel, [])]
+            else:
+                y = outputs[channel[0]][channel[1]]
+                placements = [(0, channel, y)] if np.any(y != 0) else []
+            for i0, key, y in placements:
+                if key not in indices:
+                    indices[key] = len(envelopes)
+                    envelopes.append(y)
+                pulse_list.append((0, channel[0], channel[1], i0,
+                                   indices[key]))
+        pulse_list = np.array(pulse_list, dtype=np.int64).reshape((-1, 5))
+        return pulse_list, envelopes
+
+    def _update_pulse(self, key, current, create, config, changed, n):
+        """Create pulse from configuration, unless its settings are unchanged.
+
+        Parameters
+        ----------
+        key : tuple
+            Key identifying the pulse.
+        current : object
+            Current pulse, returned if none of its settings changed.
+        create : callable
+            Function creating the pulse from the configuration and index.
+        config : dict
+            Configuration as defined by Labber driver configuration window
+        changed : set of str
+            Names of quantities changed since the last call, or None.
+        n : int
+            Index of the pulse.
+
+        Returns
+        -------
+        pulse : object
+            New or current pulse.
+
+        """
+        keys = self._pulse_quantities.get(key)
+        if (changed is not None and keys is not None and current is not None
+                and changed.isdisjoint(keys)):
+            return current
+        recorder = _ConfigRecorder(config)
+        pulse = create(recorder, n)
+        self._pulse_quantities[key] = recorder.keys
+        return pulse
+
+    def _create_qubit(self, config, n):
+        """Create qubit spectrum from configuration."""
+        m = n + 1  # pulses are indexed from 1 in Labber
+        return qubits.Transmon(
+            config.get('f01 max #{}'.format(m)),
+            config.get('f01 min #{}'.format(m)),
+            config.get('Ec #{}'.format(m)),
+            config.get('Vperiod #{}'.format(m)),
+            config.get('Voffset #{}'.format(m)),
+            config.get('V0 #{}'.format(m)),
+        )
+
+    def _create_pulse_1qb_xy(self, config, n):
+        """Create single-qubit XY pulse from configuration."""
+        m = n + 1  # pulses are indexed from 1 in Labber
+        pulse = (getattr(pulses, config.get('Pulse type'))(complex=True))
+        # global parameters
+        pulse.truncation_range = config.get('Truncation range')
+        pulse.start_at_zero = config.get('Start at zero')
+        pulse.use_drag = config.get('Use DRAG')
+        # pulse shape
+        if config.get('Uniform pulse shape'):
+            pulse.width = config.get('Width')
+            pulse.plateau = config.get('Plateau')
+        else:
+            pulse.width = config.get('Width #%d' % m)
+            pulse.plateau = config.get('Plateau #%d' % m)
+
+        if config.get('Uniform amplitude'):
+            pulse.amplitude = config.get('Amplitude')
+        else:
+            pulse.amplitude = config.get('Amplitude #%d' % m)
+
+        # pulse-specific parameters
+        pulse.frequency = config.get('Frequency #%d' % m)
+        pulse.drag_coefficient = config.get('DRAG scaling #%d' % m)
+        pulse.drag_detuning = config.get('DRAG frequency detuning #%d' % m)
+        return pulse
+
+    def _create_pulse_1qb_z(self, config, n):
+        """Create single-qubit Z pulse from configuration."""
+        m = n + 1  # pulses are indexed from 1 in Labber
+        # global parameters
+        pulse = (getattr(pulses,
+                         config.get('Pulse type, Z'))(complex=False))
+        pulse.truncation_range = config.get('Truncation range, Z')
+        pulse.start_at_zero = config.get('Start at zero, Z')
+        # pulse shape
+        if config.get('Uniform pulse shape, Z'):
+            pulse.width = config.get('Width, Z')
+            pulse.plateau = config.get('Plateau, Z')
+        else:
+            pulse.width = config.get('Width #%d, Z' % m)
+            pulse.plateau = config.get('Plateau #%d, Z' % m)
+
+        if config.get('Uniform amplitude, Z'):
+            pulse.amplitude = config.get('Amplitude, Z')
+        else:
+            pulse.amplitude = config.get('Amplitude #%d, Z' % m)
+        return pulse
+
+    def _create_pulse_2qb(self, config, n):
+        """Create two-qubit pulse from configuration."""
+        d = dict(
+            Zero=0,
+            One=1,
+            Two=2,
+            Three=3,
+            Four=4,
+            Five=5,
+            Six=6,
+            Seven=7,
+            Eight=8,
+            Nine=9)
+        # pulses are indexed from 1 in Labber
+        s = ' #%d%d' % (n + 1, n + 2)
+        # global parameters
+        pulse = (getattr(pulses,
+                         config.get('Pulse type, 2QB'))(complex=False))
+
+        if config.get('Pulse type, 2QB') in ['CZ', 'NetZero']:
+            pulse.F_Terms = d[config.get('Fourier terms, 2QB')]
+            if config.get('Uniform 2QB pulses'):
+                pulse.width = config.get('Width, 2QB')
+                pulse.plateau = config.get('Plateau, 2QB')
+            else:
+                pulse.width = config.get('Width, 2QB' + s)
+                pulse.plateau = config.get('Plateau, 2QB')
+
+            # spectra
+            if config.get('Assume linear dependence' + s, True):
+                pulse.qubit = None
+            else:
+                pulse.qubit = self._create_qubit(config, n)
+
+            # Get Fourier values
+            if d[config.get('Fourier terms, 2QB')] == 4:
+                pulse.Lcoeff = np.array([
+                    config.get('L1, 2QB' + s),
+                    config.get('L2, 2QB' + s),
+                    config.get('L3, 2QB' + s),
+                    config.get('L4, 2QB' + s)
+                ])
+            elif d[config.get('Fourier terms, 2QB')] == 3:
+                pulse.Lcoeff = np.array([
+                    config.get('L1, 2QB' + s),
+                    config.get('L2, 2QB' + s),
+                    config.get('L3, 2QB' + s)
+                ])
+            elif d[config.get('Fourier terms, 2QB')] == 2:
+                pulse.Lcoeff = np.array(
+                    [config.get('L1, 2QB' + s),
+                     config.get('L2, 2QB' + s)])
+            elif d[config.get('Fourier terms, 2QB')] == 1:
+                pulse.Lcoeff = np.array([config.get('L1, 2QB' + s)])
+
+            pulse.Coupling = config.get('Coupling, 2QB' + s)
+            pulse.Offset = config.get('f11-f20 initial, 2QB' + s)
+            pulse.amplitude = config.get('f11-f20 final, 2QB' + s)
+            pulse.dfdV = config.get('df/dV, 2QB' + s)
+            pulse.negative_amplitude = config.get('Negative amplitude' + s)
+
+            pulse.calculate_cz_waveform()
+
+        else:
+            pulse.truncation_range = config.get('Truncation range, 2QB')
+            pulse.start_at_zero = config.get('Start at zero, 2QB')
+            # pulse shape
+            if config.get('Uniform 2QB pulses'):
+                pulse.width = config.get('Width, 2QB')
+                pulse.plateau = config.get('Plateau, 2QB')
+            else:
+                pulse.width = config.get('Width, 2QB' + s)
+                pulse.plateau = config.get('Plateau, 2QB' + s)
+            # pulse-specific parameters
+            pulse.amplitude = config.get('Amplitude, 2QB' + s)
+        return pulse
+
+    def _create_pulse_readout(self, config, n):
+        """Create readout pulse from configuration."""
+        phases = 2 * np.pi * np.array([
+            0.8847060, 0.2043214, 0.9426104, 0.6947334, 0.8752361, 0.2246747,
+            0.6503154, 0.7305004, 0.1309068
+        ])
+        # pulses are indexed from 1 in Labber
+        m = n + 1
+        pulse = (getattr(pulses,
+                         config.get('Readout pulse type'))(complex=True))
+        # find target waveform
+        if config.get('Number of readout waveforms') == 'One':
+            readout_target = 0
+        else:
+            if config.get('Readout target #%d' % m, 'One') == 'One':
+                readout_target = 0
+            else:
+                readout_target = 1
+        pulse.readout_target = readout_target
+        pulse.truncation_range = config.get('Readout truncation range')
+        pulse.start_at_zero = config.get('Readout start at zero')
+        if pulse.readout_target == 0:
+            pulse.iq_skew = config.get('Readout IQ skew') * np.pi / 180
+            pulse.iq_ratio = config.get('Readout I/Q ratio')
+        else:
+            pulse.iq_skew = config.get('Readout IQ skew 2') * np.pi / 180
+            pulse.iq_ratio = config.get('Readout I/Q ratio 2')
+
+        if config.get('Distribute readout phases'):
+            pulse.phase = phases[n]
+        else:
+            pulse.phase = 0
+
+        if config.get('Uniform readout pulse shape'):
+            pulse.width = config.get('Readout width')
+            pulse.plateau = config.get('Readout duration')
+        else:
+            pulse.width = config.get('Readout width #%d' % m)
+            pulse.plateau = config.get('Readout duration #%d' % m)
+
+        if config.get('Uniform readout amplitude') is True:
+            pulse.amplitude = config.get('Readout amplitude')
+        else:
+            pulse.amplitude = config.get('Readout amplitude #%d' % (n + 1))
+
+        pulse.frequency = config.get('Readout frequency #%d' % m)
+        self.pulses_readout[n] = pulse
+
+        return pulse
+
+    def set_parameters(self, config={}, changed=None):
         """Set base parameters using config from from Labber driver.
 
         Parameters
         ----------
         config : dict
             Configuration as defined by Labber driver configuration window
+        changed : set of str, optional
+            Names of quantities changed since the last call. If given, pulses
+            that do not depend on any of them are kept. By default, all
+            pulses are re-created.
 
         """
         # sequence parameters
@@ -1294,6 +2114,12 @@ class SequenceToWaveforms:
         # If the number of qubits changed, re-init to update pulses etc
         if self.n_qubit != int(config.get('Number of qubits')):
             self.__init__(int(config.get('Number of qubits')))
+            changed = None
+        # keep track of quantities used outside of pulses
+        all_config = config
+        config = _ConfigRecorder(all_config)
+        self.incremental_compilation = config.get(
+            'Incremental compilation', False)
 
         self.dt = config.get('Pulse spacing')
         self.local_xy = config.get('Local XY control')
@@ -1307,71 +2133,22 @@ class SequenceToWaveforms:
         self.trim_to_sequence = config.get('Trim waveform to sequence')
         self.trim_start = config.get('Trim both start and end')
         self.align_to_end = config.get('Align pulses to end of waveform')
+        self.generate_pulse_list = config.get('Generate pulse list', False)
+        self.timer.enabled = all_config.get('Profile compilation', False)
 
-        # qubit spectra
+        # qubit spectra and pulses, only re-created if their settings changed
         for n in range(self.n_qubit):
-            m = n + 1  # pulses are indexed from 1 in Labber
-            qubit = qubits.Transmon(
-                config.get('f01 max #{}'.format(m)),
-                config.get('f01 min #{}'.format(m)),
-                config.get('Ec #{}'.format(m)),
-                config.get('Vperiod #{}'.format(m)),
-                config.get('Voffset #{}'.format(m)),
-                config.get('V0 #{}'.format(m)),
-            )
-            self.qubits[n] = qubit
-
-        # single-qubit pulses XY
-        for n, pulse in enumerate(self.pulses_1qb_xy):
-            m = n + 1  # pulses are indexed from 1 in Labber
-            pulse = (getattr(pulses, config.get('Pulse type'))(complex=True))
-            # global parameters
-            pulse.truncation_range = config.get('Truncation range')
-            pulse.start_at_zero = config.get('Start at zero')
-            pulse.use_drag = config.get('Use DRAG')
-            # pulse shape
-            if config.get('Uniform pulse shape'):
-                pulse.width = config.get('Width')
-                pulse.plateau = config.get('Plateau')
-            else:
-                pulse.width = config.get('Width #%d' % m)
-                pulse.plateau = config.get('Plateau #%d' % m)
-
-            if config.get('Uniform amplitude'):
-                pulse.amplitude = config.get('Amplitude')
-            else:
-                pulse.amplitude = config.get('Amplitude #%d' % m)
-
-            # pulse-specific parameters
-            pulse.frequency = config.get('Frequency #%d' % m)
-            pulse.drag_coefficient = config.get('DRAG scaling #%d' % m)
-            pulse.drag_detuning = config.get('DRAG frequency detuning #%d' % m)
-
-            self.pulses_1qb_xy[n] = pulse
-
-        # single-qubit pulses Z
-        for n, pulse in enumerate(self.pulses_1qb_z):
-            # pulses are indexed from 1 in Labber
-            m = n + 1
-            # global parameters
-            pulse = (getattr(pulses,
-                             config.get('Pulse type, Z'))(complex=False))
-            pulse.truncation_range = config.get('Truncation range, Z')
-            pulse.start_at_zero = config.get('Start at zero, Z')
-            # pulse shape
-            if config.get('Uniform pulse shape, Z'):
-                pulse.width = config.get('Width, Z')
-                pulse.plateau = config.get('Plateau, Z')
-            else:
-                pulse.width = config.get('Width #%d, Z' % m)
-                pulse.plateau = config.get('Plateau #%d, Z' % m)
-
-            if config.get('Uniform amplitude, Z'):
-                pulse.amplitude = config.get('Amplitude, Z')
-            else:
-                pulse.amplitude = config.get('Amplitude #%d, Z' % m)
-
-            self.pulses_1qb_z[n] = pulse
+            self.qubits[n] = self._update_pulse(
+                ('qubit', n), self.qubits[n], self._create_qubit,
+                all_config, changed, n)
+        for n in range(len(self.pulses_1qb_xy)):
+            self.pulses_1qb_xy[n] = self._update_pulse(
+                ('xy', n), self.pulses_1qb_xy[n], self._create_pulse_1qb_xy,
+                all_config, changed, n)
+        for n in range(len(self.pulses_1qb_z)):
+            self.pulses_1qb_z[n] = self._update_pulse(
+                ('z', n), self.pulses_1qb_z[n], self._create_pulse_1qb_z,
+                all_config, changed, n)
 
         #z offset
         self.use_z_offset=config.get('Use global Z offset')
@@ -1387,86 +2164,14 @@ class SequenceToWaveforms:
         for n in range(len(self.pulses_1qb_z)): self.z_readout_amplitude[n]=config.get('Amplitude #{:d}, Z during readout'.format(n+1))
 
         # two-qubit pulses
-        d = dict(
-            Zero=0,
-            One=1,
-            Two=2,
-            Three=3,
-            Four=4,
-            Five=5,
-            Six=6,
-            Seven=7,
-            Eight=8,
-            Nine=9)
-            
-        for n, pulse in enumerate(self.pulses_2qb):
-            # pulses are indexed from 1 in Labber
-            s = ' #%d%d' % (n + 1, n + 2)
-            # global parameters
-            pulse = (getattr(pulses,
-                             config.get('Pulse type, 2QB'))(complex=False))
-
-            if config.get('Pulse type, 2QB') in ['CZ', 'NetZero']:
-                pulse.F_Terms = d[config.get('Fourier terms, 2QB')]
-                if config.get('Uniform 2QB pulses'):
-                    pulse.width = config.get('Width, 2QB')
-                    pulse.plateau = config.get('Plateau, 2QB')
-                else:
-                    pulse.width = config.get('Width, 2QB' + s)
-                    pulse.plateau = config.get('Plateau, 2QB')
-
-                # spectra
-                if config.get('Assume linear dependence' + s, True):
-                    pulse.qubit = None
-                else:
-                    pulse.qubit = self.qubits[n]
-
-                # Get Fourier values
-                if d[config.get('Fourier terms, 2QB')] == 4:
-                    pulse.Lcoeff = np.array([
-                        config.get('L1, 2QB' + s),
-                        config.get('L2, 2QB' + s),
-                        config.get('L3, 2QB' + s),
-                        config.get('L4, 2QB' + s)
-                    ])
-                elif d[config.get('Fourier terms, 2QB')] == 3:
-                    pulse.Lcoeff = np.array([
-                        config.get('L1, 2QB' + s),
-                        config.get('L2, 2QB' + s),
-                        config.get('L3, 2QB' + s)
-                    ])
-                elif d[config.get('Fourier terms, 2QB')] == 2:
-                    pulse.Lcoeff = np.array(
-                        [config.get('L1, 2QB' + s),
-                         config.get('L2, 2QB' + s)])
-                elif d[config.get('Fourier terms, 2QB')] == 1:
-                    pulse.Lcoeff = np.array([config.get('L1, 2QB' + s)])
-
-                pulse.Coupling = config.get('Coupling, 2QB' + s)
-                pulse.Offset = config.get('f11-f20 initial, 2QB' + s)
-                pulse.amplitude = config.get('f11-f20 final, 2QB' + s)
-                pulse.dfdV = config.get('df/dV, 2QB' + s)
-                pulse.negative_amplitude = config.get('Negative amplitude' + s)
-
-                pulse.calculate_cz_waveform()
-
-            else:
-                pulse.truncation_range = config.get('Truncation range, 2QB')
-                pulse.start_at_zero = config.get('Start at zero, 2QB')
-                # pulse shape
-                if config.get('Uniform 2QB pulses'):
-                    pulse.width = config.get('Width, 2QB')
-                    pulse.plateau = config.get('Plateau, 2QB')
-                else:
-                    pulse.width = config.get('Width, 2QB' + s)
-                    pulse.plateau = config.get('Plateau, 2QB' + s)
-                # pulse-specific parameters
-                pulse.amplitude = config.get('Amplitude, 2QB' + s)
-
-            gates.CZ.new_angles(
-                config.get('QB1 Phi 2QB #12'), config.get('QB2 Phi 2QB #12'))
-
-            self.pulses_2qb[n] = pulse
+        for n in range(len(self.pulses_2qb)):
+            self.pulses_2qb[n] = self._update_pulse(
+                ('2qb', n), self.pulses_2qb[n], self._create_pulse_2qb,
+                all_config, changed, n)
+        if len(self.pulses_2qb) > 0:
+            # gate angles only change the sequence, not the pulses
+            gates.CZ.new_angles(all_config.get('QB1 Phi 2QB #12'),
+                                all_config.get('QB2 Phi 2QB #12'))
 
         # predistortion
         self.perform_predistortion = config.get('Predistort waveforms', False)
@@ -1481,6 +2186,7 @@ class SequenceToWaveforms:
 
         # crosstalk
         self.compensate_crosstalk = config.get('Compensate cross-talk', False)
+        self.crosstalk_method = config.get('Cross-talk method', 'Per gate')
         self._crosstalk.set_parameters(config)
 
         # gate switch waveform
@@ -1514,57 +2220,16 @@ class SequenceToWaveforms:
         self.readout_trig_amplitude = config.get('Readout trig amplitude')
         self.readout_trig_duration = config.get('Readout trig duration')
         self.readout_predistort = config.get('Predistort readout waveform')
-        self.readout.set_parameters(config)
+        # demodulation settings do not affect the waveforms
+        self.readout.set_parameters(all_config)
 
         self.readout_delay=config.get('Readout delay')
 
         # get readout pulse parameters
-        phases = 2 * np.pi * np.array([
-            0.8847060, 0.2043214, 0.9426104, 0.6947334, 0.8752361, 0.2246747,
-            0.6503154, 0.7305004, 0.1309068
-        ])
-        for n, pulse in enumerate(self.pulses_readout):
-            # pulses are indexed from 1 in Labber
-            m = n + 1
-            pulse = (getattr(pulses,
-                             config.get('Readout pulse type'))(complex=True))
-            # find target waveform
-            if self.number_readout_waveforms == 'One':
-                readout_target = 0
-            else:
-                if config.get('Readout target #%d' % m, 'One') == 'One':
-                    readout_target = 0
-                else:
-                    readout_target = 1
-            pulse.readout_target = readout_target
-            pulse.truncation_range = config.get('Readout truncation range')
-            pulse.start_at_zero = config.get('Readout start at zero')
-            if pulse.readout_target == 0:
-                pulse.iq_skew = config.get('Readout IQ skew') * np.pi / 180
-                pulse.iq_ratio = config.get('Readout I/Q ratio')
-            else:
-                pulse.iq_skew = config.get('Readout IQ skew 2') * np.pi / 180
-                pulse.iq_ratio = config.get('Readout I/Q ratio 2')
-
-            if config.get('Distribute readout phases'):
-                pulse.phase = phases[n]
-            else:
-                pulse.phase = 0
-
-            if config.get('Uniform readout pulse shape'):
-                pulse.width = config.get('Readout width')
-                pulse.plateau = config.get('Readout duration')
-            else:
-                pulse.width = config.get('Readout width #%d' % m)
-                pulse.plateau = config.get('Readout duration #%d' % m)
-
-            if config.get('Uniform readout amplitude') is True:
-                pulse.amplitude = config.get('Readout amplitude')
-            else:
-                pulse.amplitude = config.get('Readout amplitude #%d' % (n + 1))
-
-            pulse.frequency = config.get('Readout frequency #%d' % m)
-            self.pulses_readout[n] = pulse
+        for n in range(len(self.pulses_readout)):
+            self.pulses_readout[n] = self._update_pulse(
+                ('readout', n), self.pulses_readout[n],
+                self._create_pulse_readout, all_config, changed, n)
 
         # Delays
         self.wave_xy_delays = np.zeros(self.n_qubit)
@@ -1574,6 +2239,391 @@ class SequenceToWaveforms:
             self.wave_xy_delays[n] = config.get('Qubit %d XY Delay' % m)
             self.wave_z_delays[n] = config.get('Qubit %d Z Delay' % m)
 
+        # changes to settings used outside of pulses affect all channels
+        if changed is None or not changed.isdisjoint(config.keys):
+            self._settings_version += 1
+
+
+# state of worker processes used for parallel compilation. Sequence objects
+# are replaced when the state key changes, sampled pulses are kept.
+_worker_state = {'key': None, 'envelopes': pulses.EnvelopeCache()}
+
+
+def _get_worker_state(sequence, sequence_to_waveforms):
+    """Get pickled sequence objects for worker processes, and a key.
+
+    Caches and output of the last compilation are not included.
+
+    """
+    sequence_to_waveforms = copy.copy(sequence_to_waveforms)
+    sequence_to_waveforms._envelopes = None
+    sequence_to_waveforms._previous_output = None
+    sequence_to_waveforms._pulse_list = {}
+    sequence_to_waveforms._pulse_envelopes = {}
+    sequence_to_waveforms.sequence = None
+    sequence_to_waveforms.sequence_list = []
+    n_qubit = sequence_to_waveforms.n_qubit
+    sequence_to_waveforms._wave_xy = [
+        np.zeros(0, dtype=np.complex) for n in range(n_qubit)]
+    sequence_to_waveforms._wave_z = [np.zeros(0) for n in range(n_qubit)]
+    sequence_to_waveforms._wave_gate = [np.zeros(0) for n in range(n_qubit)]
+    sequence_to_waveforms.readout_trig = np.array([], dtype=float)
+    sequence_to_waveforms.readout_iq = np.array([], dtype=np.complex)
+    sequence_to_waveforms.readout_iq2 = np.array([], dtype=np.complex)
+    state = pickle.dumps((sequence, sequence_to_waveforms),
+                         protocol=pickle.HIGHEST_PROTOCOL)
+    return hashlib.sha1(state).hexdigest(), state
+
+
+def _compile_in_worker(key, state, config):
+    """Compile one sequence in a worker process."""
+    if _worker_state['key'] != key:
+        (sequence, sequence_to_waveforms) = pickle.loads(state)
+        sequence_to_waveforms._envelopes = _worker_state['envelopes']
+        _worker_state['sequence'] = sequence
+        _worker_state['sequence_to_waveforms'] = sequence_to_waveforms
+        _worker_state['key'] = key
+    sequence = _worker_state['sequence']
+    sequence_to_waveforms = _worker_state['sequence_to_waveforms']
+    return sequence_to_waveforms.get_waveforms(
+        sequence.get_sequence(config))
+
+
+class CompilationPool:
+    """Persistent pool of processes for compiling multiple sequences.
+
+    The processes are started on first use and kept between calls. Each
+    process keeps its copy of the sequence objects until they change.
+
+    Parameters
+    ----------
+    n_process : int
+        Number of processes (the default is 1, for serial compilation).
+
+    """
+
+    def __init__(self, n_process=1):
+        self.n_process = n_process
+        self._executor = None
+
+    def set_processes(self, n_process):
+        """Set number of processes, the pool is restarted if it changed."""
+        n_process = max(int(n_process), 1)
+        if n_process != self.n_process:
+            self.close()
+            self.n_process = n_process
+
+    def close(self):
+        """Shut down the worker processes."""
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def compile(self, sequence, sequence_to_waveforms, configs):
+        """Compile sequences in the worker processes.
+
+        Parameters
+        ----------
+        sequence : :obj:`Sequence`
+            The sequence to compile.
+        sequence_to_waveforms : :obj:`SequenceToWaveforms`
+            Object used for compiling the sequence.
+        configs : list of dict
+            Configurations, one for each sequence.
+
+        Yields
+        ------
+        index : int
+            Index of the configuration.
+        waveforms : dict
+            Waveforms, as returned by `SequenceToWaveforms.get_waveforms`.
+
+        """
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.n_process)
+        # objects are pickled once, workers only load them if changed
+        (key, state) = _get_worker_state(sequence, sequence_to_waveforms)
+        futures = {
+            self._executor.submit(_compile_in_worker, key, state, config): m
+            for m, config in enumerate(configs)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+class _OutputMatrix:
+    """Matrix with one row per sequence, filled as sequences are compiled.
+
+    The matrix is widened if a sequence is longer than the ones before.
+
+    """
+
+    def __init__(self, n_row, align_to_end=False):
+        self.n_row = n_row
+        self.align_to_end = align_to_end
+        self.matrix = None
+
+    def set_row(self, m, x):
+        """Copy data of one sequence to row m."""
+        if self.matrix is None:
+            self.matrix = np.zeros((self.n_row, len(x)), dtype=x.dtype)
+        elif len(x) > self.matrix.shape[1]:
+            n_pad = len(x) - self.matrix.shape[1]
+            if self.align_to_end:
+                pad = ((0, 0), (n_pad, 0))
+            else:
+                pad = ((0, 0), (0, n_pad))
+            self.matrix = np.pad(self.matrix, pad, mode='constant')
+        length = self.matrix.shape[1]
+        if self.align_to_end:
+            self.matrix[m, length - len(x):] = x
+        else:
+            self.matrix[m, :len(x)] = x
+
+
+def _get_channel_lengths(waveforms):
+    """Get length of each output channel, keyed on channel type and index."""
+    lengths = {}
+    for n, x in enumerate(waveforms['xy']):
+        lengths[(CHANNEL_XY, n)] = len(x)
+    for n, x in enumerate(waveforms['z']):
+        lengths[(CHANNEL_Z, n)] = len(x)
+    lengths[(CHANNEL_READOUT, 0)] = len(waveforms['readout_iq'])
+    lengths[(CHANNEL_READOUT, 1)] = len(waveforms['readout_iq2'])
+    return lengths
+
+
+def _combine_pulse_lists(calls, widths=None):
+    """Combine pulse lists of multiple compiled sequences.
+
+    Parameters
+    ----------
+    calls : list of dict
+        Pulse list and envelopes of each sequence, as returned by
+        `SequenceToWaveforms.get_waveforms`, and the length of each channel
+        as returned by `_get_channel_lengths`.
+    widths : dict
+        If given, pulses are shifted as for waveforms aligned to the end of
+        rows with these lengths, keyed on channel.
+
+    Returns
+    -------
+    pulse_list : numpy array
+        Pulse list with the sequence index in the first column.
+    envelopes : list of numpy array
+        Unique envelopes of all sequences.
+
+    """
+    pulse_lists = []
+    envelopes = []
+    indices = {}
+    for m, call in enumerate(calls):
+        pulse_list = np.array(call['pulse_list'])
+        pulse_list[:, 0] = m
+        # map envelopes to indices shared by all sequences, each envelope is
+        # only used by one type of channel
+        kinds = np.zeros(len(call['envelopes']), dtype=np.int64)
+        kinds[pulse_list[:, 4]] = pulse_list[:, 1]
+        mapping = np.zeros(len(call['envelopes']), dtype=np.int64)
+        for k, y in enumerate(call['envelopes']):
+            key = (kinds[k], y.dtype.str, len(y),
+                   hashlib.sha1(np.ascontiguousarray(y).tobytes()).digest())
+            if key not in indices:
+                indices[key] = len(envelopes)
+                envelopes.append(y)
+            mapping[k] = indices[key]
+        pulse_list[:, 4] = mapping[pulse_list[:, 4]]
+        if widths is not None:
+            for row in pulse_list:
+                channel = (row[1], row[2])
+                row[3] += widths[channel] - call['lengths'][channel]
+        pulse_lists.append(pulse_list)
+    return np.concatenate(pulse_lists), envelopes
+
+
+def compile_multiple_sequences(sequence, sequence_to_waveforms, configs,
+                               align_to_end=False, pool=None):
+    """Compile multiple sequences into waveform matrices.
+
+    Each configuration is compiled separately and written into one row of
+    the output matrices, as soon as it is compiled.
+
+    Parameters
+    ----------
+    sequence : :obj:`Sequence`
+        The sequence to compile.
+    sequence_to_waveforms : :obj:`SequenceToWaveforms`
+        Object used for compiling the sequence.
+    configs : list of dict
+        Configurations, one for each row in the output.
+    align_to_end : bool
+        If True, waveforms of different length are aligned to the end of the
+        rows (the default is False).
+    pool : :obj:`CompilationPool`
+        If given with more than one process, the sequences are compiled in
+        parallel in the pool (the default is None, for serial compilation).
+
+    Returns
+    -------
+    dict
+        Waveforms in the same format as `SequenceToWaveforms.get_waveforms`,
+        but with 2D arrays of shape (len(configs), length). Pulse lists of
+        all sequences are combined, with envelopes shared between sequences.
+
+    """
+    n_call = len(configs)
+    timer = sequence_to_waveforms.timer
+    matrices = {}
+    pulse_calls = [None] * n_call
+
+    def _add_output(m, waveforms):
+        # copy output of one sequence to the rows of the output matrices
+        if len(matrices) == 0:
+            for key in ['xy', 'z', 'gate']:
+                matrices[key] = [_OutputMatrix(n_call, align_to_end)
+                                 for x in waveforms[key]]
+            for key in ['readout_trig', 'readout_iq', 'readout_iq2']:
+                matrices[key] = _OutputMatrix(n_call, align_to_end)
+        for key in ['xy', 'z', 'gate']:
+            for matrix, x in zip(matrices[key], waveforms[key]):
+                matrix.set_row(m, x)
+        for key in ['readout_trig', 'readout_iq', 'readout_iq2']:
+            matrices[key].set_row(m, waveforms[key])
+        if 'pulse_list' in waveforms:
+            pulse_calls[m] = dict(pulse_list=waveforms['pulse_list'],
+                                  envelopes=waveforms['envelopes'],
+                                  lengths=_get_channel_lengths(waveforms))
+
+    compiled = False
+    if pool is not None and pool.n_process > 1 and n_call > 1:
+        timer.start()
+        try:
+            for m, waveforms in pool.compile(
+                    sequence, sequence_to_waveforms, configs):
+                _add_output(m, waveforms)
+            compiled = True
+            timer.mark('parallel compilation')
+        except Exception as e:
+            log.warning(
+                'Parallel compilation failed, compiling serially: ' + str(e))
+            pool.close()
+            matrices.clear()
+            pulse_calls = [None] * n_call
+    if not compiled:
+        for m, config in enumerate(configs):
+            timer.start()
+            qubit_sequence = sequence.get_sequence(config)
+            timer.mark('generate sequence')
+            _add_output(m, sequence_to_waveforms.get_waveforms(qubit_sequence))
+            timer.mark('combine sequences')
+
+    timer.start()
+    output = dict()
+    if pulse_calls[0] is not None:
+        widths = None
+        if align_to_end:
+            channels = {(CHANNEL_XY, n): x
+                        for n, x in enumerate(matrices['xy'])}
+            channels.update({(CHANNEL_Z, n): x
+                             for n, x in enumerate(matrices['z'])})
+            channels[(CHANNEL_READOUT, 0)] = matrices['readout_iq']
+            channels[(CHANNEL_READOUT, 1)] = matrices['readout_iq2']
+            widths = {channel: x.matrix.shape[1]
+                      for channel, x in channels.items()}
+        output['pulse_list'], output['envelopes'] = _combine_pulse_lists(
+            pulse_calls, widths)
+    for key in ['xy', 'z', 'gate']:
+        output[key] = [x.matrix for x in matrices[key]]
+    for key in ['readout_trig', 'readout_iq', 'readout_iq2']:
+        output[key] = matrices[key].matrix
+    timer.mark('combine sequences')
+    return output
+
+
+def compile_state_combinations(sequence, sequence_to_waveforms, configs,
+                               states, pool=None):
+    """Compile sequences that prepare combinations of qubit states.
+
+    The sequences must only differ by which qubits get a pi-pulse, with the
+    same timing for all states. Only the sequences with all qubits in the
+    ground state and all qubits excited are compiled, and the output of each
+    state is assembled channel by channel from those two. If the channels
+    can not be assembled, for example without local XY control, all
+    sequences are compiled separately.
+
+    Parameters
+    ----------
+    sequence : :obj:`Sequence`
+        The sequence to compile.
+    sequence_to_waveforms : :obj:`SequenceToWaveforms`
+        Object used for compiling the sequence.
+    configs : list of dict
+        Configurations, one for each row in the output.
+    states : list of int
+        Prepared state for each configuration, with bit n set if qubit n is
+        excited.
+    pool : :obj:`CompilationPool`
+        Process pool to use if compiling sequences separately.
+
+    Returns
+    -------
+    dict
+        Waveforms in the same format as `compile_multiple_sequences`.
+
+    """
+    n_qubit = sequence_to_waveforms.n_qubit
+    excited = 2**n_qubit - 1
+    output = None
+    if (sequence_to_waveforms.local_xy and
+            not sequence_to_waveforms.generate_pulse_list and
+            0 in states and excited in states):
+        timer = sequence_to_waveforms.timer
+        calls = []
+        for state in (0, excited):
+            config = configs[states.index(state)]
+            timer.start()
+            qubit_sequence = sequence.get_sequence(config)
+            timer.mark('generate sequence')
+            waveforms = sequence_to_waveforms.get_waveforms(qubit_sequence)
+            calls.append({key: (list(value) if isinstance(value, list)
+                                else value)
+                          for key, value in waveforms.items()})
+        output = _combine_state_waveforms(calls[0], calls[1], states)
+        timer.mark('combine sequences')
+    if output is None:
+        output = compile_multiple_sequences(
+            sequence, sequence_to_waveforms, configs, pool=pool)
+    return output
+
+
+def _combine_state_waveforms(ground, excited, states):
+    """Assemble waveforms of qubit states from ground and excited output.
+
+    Returns None if the ground and excited outputs have a different timing,
+    or if a waveform not belonging to a qubit depends on the state.
+
+    """
+    # waveforms not belonging to a qubit must be the same for all states
+    keys = ['readout_trig', 'readout_iq', 'readout_iq2']
+    if not all(np.array_equal(ground[key], excited[key]) for key in keys):
+        return None
+    for key in ['xy', 'z', 'gate']:
+        if [len(x) for x in ground[key]] != [len(x) for x in excited[key]]:
+            return None
+
+    states = np.asarray(states, dtype=np.int64)
+    output = dict()
+    for key in ['xy', 'z', 'gate']:
+        output[key] = []
+        for n, (y0, y1) in enumerate(zip(ground[key], excited[key])):
+            is_excited = ((states >> n) & 1).astype(bool)
+            output[key].append(
+                np.where(is_excited[:, np.newaxis], y1[np.newaxis, :],
+                         y0[np.newaxis, :]))
+    for key in keys:
+        output[key] = np.repeat(
+            np.asarray(ground[key])[np.newaxis, :], len(states), axis=0)
+    return output
+
 
 if __name__ == '__main__':
     pass
@@ -163,14 +163,16 @@ class ReadoutTraining(Sequence):
             # get bitstring for current state
             bitstring = np.base_repr(state, n_state, self.n_qubit)
             bitstring = bitstring[::-1][:self.n_qubit]
-            qubit_list = []
+            # qubits in ground state get an identity gate of the same width,
+            # so that the timing is the same for all states
             gate_list = []
             for n in range(self.n_qubit):
                 if int(bitstring[n]):
-                    qubit_list.append(n)
                     gate_list.append(gates.Xp)
+                else:
+                    gate_list.append(gates.I)
 
-            self.add_gate(qubit_list, gate_list)
+            self.add_gate(list(range(self.n_qubit)), gate_list)
 
 
 if __name__ == '__main__':
@@ -408,7 +408,6 @@ class SingleQubit_RB(Sequence):
         write_seq = config.get('Write sequence as txt file', False)
 
         log.info('Assign seed %d' %(randomize))
-        rnd.seed(randomize)
         if interleave is True:
             interleaved_gate = config['Interleaved 1-QB Gate']
         else:
@@ -428,27 +427,34 @@ class SingleQubit_RB(Sequence):
             self.prev_sequence = sequence
             self.prev_n_qubit = self.n_qubit
 
+            # Clifford group, with a table for tracking the total Clifford
+            group = cliffords.get_single_qubit_clifford_group()
+            interleaved_seq = []
+            if interleave is True:
+                self.prev_interleaved_gate = interleaved_gate
+                # To step over "Reference Randomized Benchmarking" 05/15/2019
+                if interleaved_gate != 'Ref':
+                    interleaved_seq.append(getattr(gates, interleaved_gate))
+            # table for a random Clifford followed by the interleaved gate
+            step_table = group.table[group.sequence_index(interleaved_seq)][
+                group.table].tolist()
+
+            # draw the random Cliffords for all qubits at once
+            rnd_cliffords = np.random.RandomState(int(randomize)).randint(
+                0, 24, size=(self.n_qubit, N_cliffords))
+
             multi_gate_seq = []
             for n in range(self.n_qubit):
                 # Generate 1QB RB sequence
                 single_gate_seq = []
+                clifford_index = 0
+                for rndnum in rnd_cliffords[n].tolist():
+                    single_gate_seq.extend(group.gate_sequences[rndnum])
+                    single_gate_seq.extend(interleaved_seq)
+                    clifford_index = step_table[rndnum][clifford_index]
 
-                for i in range(N_cliffords):
-                    rndnum = rnd.randint(0, 23)
-                    log.info('Random number %d' %(rndnum))
-                    add_singleQ_clifford(rndnum, single_gate_seq,
-                                         pad_with_I=False)
-                    # If interleave gate,
-                    if interleave is True:
-                        self.prev_interleaved_gate = interleaved_gate
-
-                        # To step over "Reference Randomized Benchmarking" 05/15/2019
-                        if interleaved_gate == 'Ref':
-                            pass
-                        else:
-                            single_gate_seq.append(getattr(gates, interleaved_gate))
-
-                recovery_gate = self.get_recovery_gate(single_gate_seq)
+                recovery_gate = self.get_recovery_gate(
+                    single_gate_seq, clifford_index=clifford_index)
 
                 # print 1QB-RB sequence
                 if write_seq == True:
@@ -528,7 +534,7 @@ class SingleQubit_RB(Sequence):
                     np.matrix([[-1j, 0], [0, 1j]]), singleQ_gate)
         return singleQ_gate
 
-    def get_recovery_gate(self, gate_seq):
+    def get_recovery_gate(self, gate_seq, clifford_index=None):
         """
         Get the recovery (the inverse) gate
 
@@ -537,43 +543,25 @@ class SingleQubit_RB(Sequence):
         gate_seq: list of class Gate
             The gate sequence applied to a qubit
 
+        clifford_index: int
+            Index of the Clifford implemented by the gate sequence, as
+            defined by `add_singleQ_clifford`. If None, it is calculated from
+            the gate sequence (optional)
+
         Returns
         -------
         recovery_gate: Gate
             The recovery gate
         """
-
-        qubit_state = np.matrix('1; 0')
-        # initial state: ground state, following the QC community's convention
-        qubit_state = np.matmul(self.evaluate_sequence(gate_seq), qubit_state)
-        # find recovery gate which makes qubit_state return to initial state
-        if (np.abs(np.linalg.norm(qubit_state.item((0, 0))) - 1) < 0.1):
-            # ground state -> I
-            recovery_gate = gates.I
-        elif (np.abs(np.linalg.norm(qubit_state.item((1, 0))) - 1) < 0.1):
-            # excited state -> X Pi
-            recovery_gate = gates.Xp
-        elif (np.linalg.norm(qubit_state.item((1, 0)) /
-                             qubit_state.item((0, 0)) + 1) < 0.1):
-            # X State  -> Y +Pi/2
-            recovery_gate = gates.Y2p
-        elif (np.linalg.norm(qubit_state.item((1, 0)) /
-                             qubit_state.item((0, 0)) - 1) < 0.1):
-            # -X State -> Y -Pi/2
-            recovery_gate = gates.Y2m
-        elif (np.linalg.norm(qubit_state.item((1, 0)) /
-                             qubit_state.item((0, 0)) + 1j) < 0.1):
-            # Y State -> X -Pi/2
-            recovery_gate = gates.X2m
-        elif (np.linalg.norm(qubit_state.item((1, 0)) /
-                             qubit_state.item((0, 0)) - 1j) < 0.1):
-            # -Y State -> X +Pi/2
-            recovery_gate = gates.X2p
-        else:
-            raise InstrumentDriver.Error(
-                'Error in calculating recovery gates. qubit state:' +
-                str(qubit_state))
-        return recovery_gate
+        group = cliffords.get_single_qubit_clifford_group()
+        if clifford_index is None:
+            try:
+                clifford_index = group.sequence_index(gate_seq)
+            except KeyError:
+                raise ValueError('Error in calculating recovery gates. '
+                                 'The gate sequence is not a Clifford.')
+        # recovery gate which makes qubit state return to initial state
+        return group.recovery_gates[clifford_index]
 
 
 class TwoQubit_RB(Sequence):
@@ -642,42 +630,51 @@ class TwoQubit_RB(Sequence):
 
             multi_gate_seq = []
 
+            # Clifford group, used for tracking the total Clifford as an index
+            group = cliffords.get_clifford_group(generator)
+
+            # gates of the interleaved 2QB gate
+            interleavedSeq1 = []
+            interleavedSeq2 = []
+            if interleave is True:
+                self.prev_interleaved_gate = interleaved_gate
+                if interleaved_gate == 'CZ':
+                    interleavedSeq1.append(gates.I)
+                    interleavedSeq2.append(gates.CZ)
+                elif interleaved_gate == 'CZEcho':
+                    # CZEcho is a composite gate, so get each gate
+                    gate = gates.CZEcho
+                    for g in gate.sequence:
+                        interleavedSeq1.append(g[1])
+                        interleavedSeq2.append(g[0])
+                elif interleaved_gate == 'iSWAP':
+                    gate = gates.iSWAP
+                    for g in gate.sequence:
+                        interleavedSeq1.append(g[1])
+                        interleavedSeq2.append(g[0])
+                elif interleaved_gate == 'I':
+                    # TBA: adjust the duration of I gates?
+                    I_2QB = gates.IdentityGate(width =config.get('Width, 2QB'))
+                    interleavedSeq1.append(I_2QB)
+                    interleavedSeq2.append(I_2QB)
+            interleaved_index = group.sequence_index(
+                interleavedSeq1, interleavedSeq2)
+
             # Generate 2QB RB sequence
             cliffordSeq1 = []
             cliffordSeq2 = []
+            clifford_index = 0
+            log.info('Seed number: %d'%(randomize))
             for j in range(N_cliffords):
-                log.info('Seed number: %d'%(randomize))
                 rndnum = rnd.randint(0, 11519)
-                # rndnum = rnd.randint(0, 576) #Only applying single qubit gates
                 add_twoQ_clifford(rndnum, cliffordSeq1, cliffordSeq2, generator = generator)
+                clifford_index = group.multiply(rndnum, clifford_index)
                 # If interleave gate,
                 if interleave is True:
-                    self.prev_interleaved_gate = interleaved_gate
-                    if interleaved_gate == 'CZ':
-                        cliffordSeq1.append(gates.I)
-                        cliffordSeq2.append(gates.CZ)
-                    elif interleaved_gate == 'CZEcho':
-                        # CZEcho is a composite gate, so get each gate
-                        gate = gates.CZEcho
-                        for g in gate.sequence:
-                            cliffordSeq1.append(g[1])
-                            cliffordSeq2.append(g[0])
-                    elif interleaved_gate == 'iSWAP':
-                        gate = gates.iSWAP
-                        for g in gate.sequence:
-                            cliffordSeq1.append(g[1])
-                            cliffordSeq2.append(g[0])
-                    elif interleaved_gate == 'I':
-                        # TBA: adjust the duration of I gates?
-                        # log.info('Qubits to benchmark: ' + str(qubits_to_benchmark))
-                        # gate = gates.I(width = self.pulses_2qb[qubit]).value
-                        I_2QB = gates.IdentityGate(width =config.get('Width, 2QB'))
-
-                        cliffordSeq1.append(I_2QB)
-                        cliffordSeq2.append(I_2QB)
-                        # cliffordSeq1.append(gates.I)
-                        # cliffordSeq2.append(gates.I)
-
+                    cliffordSeq1.extend(interleavedSeq1)
+                    cliffordSeq2.extend(interleavedSeq2)
+                    clifford_index = group.multiply(
+                        interleaved_index, clifford_index)
 
             # remove redundant Identity gates for cliffordSeq1
             index_identity_clifford = [] # find where Identity gates are
@@ -689,7 +686,8 @@ class TwoQubit_RB(Sequence):
 
             # get recovery gate seq
             (recoverySeq1, recoverySeq2) = self.get_recovery_gate(
-                cliffordSeq1, cliffordSeq2, config, generator = generator)
+                cliffordSeq1, cliffordSeq2, config, generator = generator,
+                clifford_index = clifford_index)
 
             # Remove redundant identity gates in recovery gate seq
             index_identity_recovery = [] # find where Identity gates are
@@ -732,11 +730,14 @@ class TwoQubit_RB(Sequence):
                          print("CliffordIndex: %d, Gate: ["%(i) + cliffords.Gate_to_strGate(cliffordSeq1[i]) + ", " + cliffords.Gate_to_strGate(cliffordSeq2[i]) +']', file=text_file)
                     for i in range(len(recoverySeq1)):
                          print("RecoveryIndex: %d, Gate: ["%(i) + cliffords.Gate_to_strGate(recoverySeq1[i]) + ", " + cliffords.Gate_to_strGate(recoverySeq2[i]) +']', file=text_file)
-            psi = np.matmul(self.evaluate_sequence(gateSeq1, gateSeq2), psi_gnd)
+            # evaluate the gates actually produced, to also catch errors in
+            # the tracked Clifford index
+            matrix_total = group.sequence_unitary(gateSeq1, gateSeq2)
+            psi = np.matmul(matrix_total, psi_gnd)
 
             np.set_printoptions(precision=2)
             log.info('The matrix of the overall gate sequence:')
-            log.info(self.evaluate_sequence(gateSeq1, gateSeq2))
+            log.info(matrix_total)
 
             log.info('--- TESTING THE RECOVERY GATE ---')
             log.info('The probability amplitude of the final state vector: ' + str(np.matrix(psi).flatten()))
@@ -853,7 +854,8 @@ class TwoQubit_RB(Sequence):
         # log.info('two qubit gate: ' + str(twoQ_gate))
         return twoQ_gate
 
-    def get_recovery_gate(self, gate_seq_1, gate_seq_2, config, generator = 'CZ'):
+    def get_recovery_gate(self, gate_seq_1, gate_seq_2, config, generator = 'CZ',
+                          clifford_index = None):
         """
         Get the recovery (the inverse) gate
 
@@ -871,36 +873,25 @@ class TwoQubit_RB(Sequence):
         generator: string
             Type of Native 2QB gate (optional)
 
+        clifford_index: int
+            Index of the Clifford implemented by the gate sequence, as
+            defined by `add_twoQ_clifford`. If None, it is calculated from
+            the gate sequence (optional)
+
         Returns
         -------
         (recovery_seq_1, recovery_seq_2): tuple of the lists
             The recovery gate
         """
-
-
-        qubit_state = np.matrix(
-            '1; 0; 0; 0')  # initial state: ground state |00>
-
-        qubit_state = np.matmul(self.evaluate_sequence(
-            gate_seq_1, gate_seq_2, generator = generator), qubit_state)
-
-        # find recovery gate which makes qubit_state return to initial state
-        total_num_cliffords = 11520
-        recovery_seq_1 = []
-        recovery_seq_2 = []
+        group = cliffords.get_clifford_group(generator)
+        if clifford_index is None:
+            clifford_index = group.sequence_index(gate_seq_1, gate_seq_2)
 
         # Search the recovery gate in two Qubit clifford group
         find_cheapest = config['Find the cheapest recovery Clifford']
 
-        cheapest_recovery_seq_1 = []
-        cheapest_recovery_seq_2 = []
         log.info('*** get recovery gate *** ')
         if (find_cheapest == True):
-            min_N_2QB_gate = np.inf
-            min_N_1QB_gate = np.inf
-            max_N_I_gate = -np.inf
-            cheapest_index = None
-
             use_lookup_table = config['Use a look-up table']
             if (use_lookup_table == True):
                 filepath_lookup_table = config['File path of the look-up table']
@@ -909,101 +900,45 @@ class TwoQubit_RB(Sequence):
                         filepath_lookup_table = os.path.join(path_currentdir, 'recovery_rb_table.pickle')
                     elif (generator == 'iSWAP'):
                         filepath_lookup_table = os.path.join(path_currentdir, 'recovery_rb_table_iSWAP.pickle')
-                    
+
                 if filepath_lookup_table != self.filepath_lookup_table:
                     log.info("Load Look-up table.")
                     self.filepath_lookup_table = filepath_lookup_table
                     self.dict_lookup_table = cliffords.loadData(filepath_lookup_table)
+                    # hash the stabilizers, for constant-time look-ups
+                    self.dict_lookup_index = {
+                        tuple(item): index for index, item in
+                        enumerate(self.dict_lookup_table['psi_stabilizer'])}
+                # state after the gate sequence, starting from |00>
+                qubit_state = np.matrix(
+                    group.unitaries[clifford_index][:, 0]).T
                 stabilizer = cliffords.get_stabilizer(qubit_state)
-                for index, item in enumerate(self.dict_lookup_table['psi_stabilizer']):
-                    if stabilizer == item:
-                        seq1 = self.dict_lookup_table['recovery_gates_QB1'][index]
-                        for str_Gate in seq1:
-                            cheapest_recovery_seq_1.append(cliffords.strGate_to_Gate(str_Gate))
-                        seq2 = self.dict_lookup_table['recovery_gates_QB2'][index]
-                        for str_Gate in seq2:
-                            cheapest_recovery_seq_2.append(cliffords.strGate_to_Gate(str_Gate))
-
-                        log.info("=== FOUND THE CHEAPEST RECOVERY GATE IN THE LOOK-UP TABLE. ===")
-                        log.info("QB1 recovery gate sequence: " + str(seq1))
-                        log.info("QB2 recovery gate sequence: " + str(seq2))
-                        log.info("=================================================")
-                        return(cheapest_recovery_seq_1, cheapest_recovery_seq_2)
-
-            log.info("--- COULDN'T FIND THE RECOVERY GATE IN THE LOOK-UP TABLE... ---")
-
-
-        # Calculate the matrix of the clifford sequence
-        matrix_cliffords = self.evaluate_sequence(gate_seq_1,gate_seq_2, generator = generator)
-
-        for i in range(total_num_cliffords):
-            recovery_seq_1 = []
-            recovery_seq_2 = []
-            add_twoQ_clifford(i, recovery_seq_1, recovery_seq_2, generator = generator)
-
-            # Calculate the matrix of the recovery clifford
-            matrix_recovery = self.evaluate_sequence(recovery_seq_1, recovery_seq_2, generator = generator)
-
-            # Calculate the matrix of the total clifford sequence
-            matrix_total = np.matmul(matrix_recovery,matrix_cliffords)
-            if (CheckIdentity(matrix_total)):
-                if (find_cheapest == True):
-                    # Less 2QB Gates, Less 1QB Gates, and More I Gates = the cheapest gates.
-                    # The priority: less 2QB gates > less 1QB gates > more I gates
-                    N_2QB_gate = 0
-                    N_1QB_gate = 0
-                    N_I_gate = 0
-
-                    # count the numbers of the gates
-                    for j in range(len(recovery_seq_1)):
-                        if (recovery_seq_1[j] == gates.CZ or recovery_seq_2[j] == gates.CZ):
-                            N_2QB_gate += 1
-                        elif (recovery_seq_1[j] == gates.iSWAP or recovery_seq_2[j] == gates.iSWAP):
-                            N_2QB_gate += 1
-                        else:
-                            N_1QB_gate += 2
-                        if (recovery_seq_1[j] == gates.I):
-                            N_I_gate += 1
-                        if (recovery_seq_2[j] == gates.I):
-                            N_I_gate += 1
-
-                    if (N_2QB_gate <= min_N_2QB_gate): # if it has less 2QB gates, always update it
-                        min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-                        if (N_1QB_gate <= min_N_1QB_gate): # *only if it has less 2QB gates*, check whether it has less 1QB gates
-                            min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-                            if (N_I_gate >= max_N_I_gate): # *only if it has less 2QB gates & only if it has less 1QB gates*, check whether it has more I gates
-                                min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-
-                    # check whether it is the cheapest
-                    # if it has less 2QB gates, always update it.
-                    if (N_2QB_gate < min_N_2QB_gate):
-                        min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                        log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-                    else:
-                        # if it has equal # of 2QB gates and less 1QB gates, update it.
-                        if (N_2QB_gate == min_N_2QB_gate and
-                            N_1QB_gate < min_N_1QB_gate):
-                            min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                            log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-                        else:
-                            # if it has equal # of 2QB & 1QB gates, and more 1QB gates, update it.
-                            if (N_2QB_gate == min_N_2QB_gate and
-                                N_1QB_gate == min_N_1QB_gate and
-                                N_I_gate >= max_N_I_gate):
-                                min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index = (N_2QB_gate, N_1QB_gate, N_I_gate, j)
-                                log.info('the cheapest sequence update! [N_2QB_gate, N_1QB_gate, N_I_gate, seq. index] ' + str([min_N_2QB_gate, min_N_1QB_gate, max_N_I_gate, cheapest_index]))
-
-                else:
-                    return(recovery_seq_1,recovery_seq_2)
-
+                index = self.dict_lookup_index.get(tuple(stabilizer))
+                if index is not None:
+                    seq1 = self.dict_lookup_table['recovery_gates_QB1'][index]
+                    seq2 = self.dict_lookup_table['recovery_gates_QB2'][index]
+                    cheapest_recovery_seq_1 = [
+                        cliffords.strGate_to_Gate(str_Gate) for str_Gate in seq1]
+                    cheapest_recovery_seq_2 = [
+                        cliffords.strGate_to_Gate(str_Gate) for str_Gate in seq2]
+
+                    log.info("=== FOUND THE CHEAPEST RECOVERY GATE IN THE LOOK-UP TABLE. ===")
+                    log.info("QB1 recovery gate sequence: " + str(seq1))
+                    log.info("QB2 recovery gate sequence: " + str(seq2))
+                    log.info("=================================================")
+                    return(cheapest_recovery_seq_1, cheapest_recovery_seq_2)
+
+                log.info("--- COULDN'T FIND THE RECOVERY GATE IN THE LOOK-UP TABLE... ---")
+
+        # Less 2QB Gates, Less 1QB Gates, and More I Gates = the cheapest gates.
+        recovery_index = group.get_recovery_index(
+            clifford_index, find_cheapest=find_cheapest)
         if (find_cheapest == True):
-            recovery_seq_1 = []
-            recovery_seq_2 = []
-            log.info('The index of the cheapest recovery clifford: %d'%(cheapest_index))
-            add_twoQ_clifford(cheapest_index, recovery_seq_1, recovery_seq_2, generator = generator)
+            log.info('The index of the cheapest recovery clifford: %d'%(recovery_index))
 
+        recovery_seq_1 = []
+        recovery_seq_2 = []
+        add_twoQ_clifford(recovery_index, recovery_seq_1, recovery_seq_2, generator = generator)
 
         if (recovery_seq_1 == [] and recovery_seq_2 == []):
             recovery_seq_1 = [None]
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+from collections import OrderedDict
+
+import numpy as np
+
+# Allow logging to Labber's instrument log
+log = logging.getLogger('LabberDriver')
+
+# waveforms stored as lists of arrays, one per qubit or envelope
+LIST_KEYS = ('xy', 'z', 'gate', 'envelopes')
+
+
+def _get_code_version():
+    """Get identifier of the compiler code, to invalidate stored waveforms."""
+    h = hashlib.sha1()
+    path = os.path.dirname(os.path.abspath(__file__))
+    for filename in sorted(glob.glob(os.path.join(path, '*.py'))):
+        h.update(os.path.basename(filename).encode())
+        h.update(repr(os.path.getmtime(filename)).encode())
+    return h.hexdigest()
+
+
+CODE_VERSION = _get_code_version()
+
+
+def get_config_key(config, ignore=()):
+    """Get a stable hash of configuration values.
+
+    Values that are paths to existing files also include the modification
+    time of the file, so that updated files give a new key.
+
+    Parameters
+    ----------
+    config : dict
+        Configuration as defined by Labber driver configuration window
+    ignore : tuple of str
+        Quantities starting with any of these strings are not included.
+
+    Returns
+    -------
+    str
+        Hex digest identifying the configuration.
+
+    """
+    h = hashlib.sha1(CODE_VERSION.encode())
+    for name in sorted(config):
+        if name.startswith(ignore):
+            continue
+        value = config[name]
+        h.update(name.encode())
+        if isinstance(value, np.ndarray):
+            h.update(value.dtype.str.encode())
+            h.update(np.ascontiguousarray(value).tobytes())
+        elif isinstance(value, dict):
+            h.update(repr(sorted(
+                (k, np.asarray(v).tobytes() if isinstance(v, np.ndarray)
+                 else v) for k, v in value.items())).encode())
+        else:
+            h.update(repr(value).encode())
+            if isinstance(value, str) and os.path.isfile(value):
+                h.update(repr(os.path.getmtime(value)).encode())
+    return h.hexdigest()
+
+
+class WaveformCache:
+    """Least-recently-used cache of compiled waveforms.
+
+    Waveforms are stored in the format returned by
+    `SequenceToWaveforms.get_waveforms`. If a directory is given, waveforms
+    are also stored on disk as .npy files, and are memory-mapped when loaded
+    back by a new cache instance.
+
+    Parameters
+    ----------
+    max_size : float
+        Maximum total size of the waveforms kept in memory, in bytes.
+    directory : str, optional
+        Directory for storing waveforms on disk. If None, waveforms are only
+        kept in memory.
+
+    """
+
+    def __init__(self, max_size=256E6, directory=None):
+        self.max_size = max_size
+        self.directory = directory
+        self._waveforms = OrderedDict()
+        self._sizes = {}
+        self.size = 0
+
+    def __len__(self):
+        return len(self._waveforms)
+
+    def clear(self):
+        """Remove all waveforms kept in memory."""
+        self._waveforms.clear()
+        self._sizes.clear()
+        self.size = 0
+
+    @staticmethod
+    def _get_arrays(waveforms):
+        """Get dict of arrays with unique names from waveforms."""
+        arrays = dict()
+        for key, value in waveforms.items():
+            if key in LIST_KEYS:
+                for n, x in enumerate(value):
+                    arrays['%s_%d' % (key, n)] = x
+            else:
+                arrays[key] = value
+        return arrays
+
+    def get(self, key):
+        """Get waveforms for a key.
+
+        Parameters
+        ----------
+        key : str
+            Key identifying the compiled waveforms.
+
+        Returns
+        -------
+        dict
+            Waveforms, or None if not in cache.
+
+        """
+        waveforms = self._waveforms.get(key)
+        if waveforms is not None:
+            self._waveforms.move_to_end(key)
+            return self._copy(waveforms)
+        if self.directory is None:
+            return None
+        waveforms = self._load(key)
+        if waveforms is not None:
+            self._add(key, waveforms)
+            return self._copy(waveforms)
+        return None
+
+    def put(self, key, waveforms):
+        """Store compiled waveforms.
+
+        Parameters
+        ----------
+        key : str
+            Key identifying the compiled waveforms.
+        waveforms : dict
+            Waveforms, as returned by `SequenceToWaveforms.get_waveforms`.
+
+        """
+        # output lists are re-used by the compiler, only keep copies
+        waveforms = self._copy(waveforms)
+        self._add(key, waveforms)
+        if self.directory is not None:
+            self._save(key, waveforms)
+
+    @staticmethod
+    def _copy(waveforms):
+        return {key: (list(value) if isinstance(value, list) else value)
+                for key, value in waveforms.items()}
+
+    def _add(self, key, waveforms):
+        """Add waveforms to memory, removing least recently used entries."""
+        if key in self._waveforms:
+            self.size -= self._sizes.pop(key)
+        size = sum(np.asarray(x).nbytes
+                   for x in self._get_arrays(waveforms).values())
+        self._waveforms[key] = waveforms
+        self._sizes[key] = size
+        self.size += size
+        while self.size > self.max_size and len(self._waveforms) > 0:
+            old_key, _ = self._waveforms.popitem(last=False)
+            self.size -= self._sizes.pop(old_key)
+
+    def _save(self, key, waveforms):
+        """Save waveforms to disk, in a directory named after the key."""
+        path = os.path.join(self.directory, key)
+        if os.path.exists(path):
+            return
+        # write to temporary directory and rename, to never expose
+        # partially written waveforms
+        temp_path = '%s.%d.tmp' % (path, os.getpid())
+        try:
+            os.makedirs(temp_path, exist_ok=True)
+            layout = dict()
+            for name, value in waveforms.items():
+                if name in LIST_KEYS:
+                    layout[name] = len(value)
+            for name, x in self._get_arrays(waveforms).items():
+                np.save(os.path.join(temp_path, name + '.npy'),
+                        np.asarray(x))
+            with open(os.path.join(temp_path, 'layout.json'), 'w') as f:
+                json.dump(layout, f)
+            os.rename(temp_path, path)
+        except OSError as e:
+            log.warning('Could not store waveforms on disk: ' + str(e))
+            shutil.rmtree(temp_path, ignore_errors=True)
+
+    def _load(self, key):
+        """Load memory-mapped waveforms from disk, or None if not found."""
+        path = os.path.join(self.directory, key)
+        layout_file = os.path.join(path, 'layout.json')
+        if not os.path.exists(layout_file):
+            return None
+        try:
+            with open(layout_file) as f:
+                layout = json.load(f)
+            waveforms = dict()
+            for filename in sorted(glob.glob(os.path.join(path, '*.npy'))):
+                name = os.path.basename(filename)[:-4]
+                if name.rsplit('_', 1)[0] in layout:
+                    continue
+                waveforms[name] = np.load(filename, mmap_mode='r')
+            for name, n_wave in layout.items():
+                waveforms[name] = [
+                    np.load(os.path.join(path, '%s_%d.npy' % (name, n)),
+                            mmap_mode='r') for n in range(n_wave)]
+        except (OSError, ValueError) as e:
+            log.warning('Could not load waveforms from disk: ' + str(e))
+            return None
+        return waveforms
+
+
+if __name__ == '__main__':
+    pass
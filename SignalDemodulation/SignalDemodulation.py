@@ -12,7 +12,9 @@ class Driver(InstrumentDriver.InstrumentWorker):
 
     def performOpen(self, options={}):
         """Perform the operation of opening the instrument connection"""
-        pass
+        # cached demodulation kernels, and result for the current input data
+        self.dKernel = {}
+        self.lastSignal = None
 
 
     def performClose(self, bError=False, options={}):
@@ -23,7 +25,8 @@ class Driver(InstrumentDriver.InstrumentWorker):
     def performSetValue(self, quant, value, sweepRate=0.0, options={}):
         """Perform the Set Value instrument operation. This function should
         return the actual value set by the instrument"""
-        # do nothing here
+        # new data or parameters, the demodulated result has to be updated
+        self.lastSignal = None
         return value
 
 
@@ -36,77 +39,48 @@ class Driver(InstrumentDriver.InstrumentWorker):
             # calculate I/Q signal here
             value = self.getIQAmplitudes()
         elif quant.name.startswith('Value #'):
+            # all frequencies are demodulated at once
             index = int(quant.name[-1])
-            sDemodFreq = 'Mod. frequency #' + str(index)
-            dFreq = self.getValue(sDemodFreq)
-            value = np.mean(self.getIQAmplitudes_MultiFreq(dFreq))
+            value = np.mean(self.getIQAmplitudesAll()[index - 1])
         else:
             # just return the quantity value
             value = quant.getValue()
         return value
 
+    def getFrequencies(self):
+        """Return list with all modulation frequencies"""
+        lFreq = [self.getValue('Modulation frequency')]
+        for n in range(2, 10):
+            lFreq.append(self.getValue('Mod. frequency #' + str(n)))
+        return lFreq
+
     def getIQAmplitudes(self):
         """Calculate complex signal from data and reference"""
-        # get parameters
-        dFreq = self.getValue('Modulation frequency')
-        skipStart = self.getValue('Skip start')
-        nSegment = int(self.getValue('Number of segments'))
-        # get input data from dict, with keys {'y': value, 't0': t0, 'dt': dt}
-        traceIn = self.getValue('Input data')
-        if traceIn is None:
-            return complex(0.0)
-        vY = traceIn['y']     
-        dt = traceIn['dt']
-        # get shape of input data
-        shape = traceIn.get('shape', vY.shape)
-        # override segment parameter if input data has more than one dimension
-        if len(shape) > 1:
-            nSegment = shape[0]
-        # avoid exceptions if no time step is given
-        if dt==0:
-            dt = 1.0
-        skipIndex = int(round(skipStart/dt))
-        nTotLength = vY.size
-        length = 1 + int(round(self.getValue('Length')/dt))
-        length = min(length, int(nTotLength/nSegment)-skipIndex)
-        if length <=1:
-            return complex(0.0)
-        bUseRef = bool(self.getValue('Use phase reference signal'))
-        # define data to use, put in 2d array of segments
-        vData = np.reshape(vY, (nSegment, int(nTotLength/nSegment)))
-        # calculate cos/sin vectors, allow segmenting
-        vTime = dt * (skipIndex + np.arange(length, dtype=float))
-        vCos = np.cos(2*np.pi * vTime * dFreq)
-        vSin = np.sin(2*np.pi * vTime * dFreq)
-        # calc I/Q
-        dI = 2. * np.trapz(vCos * vData[:,skipIndex:skipIndex+length]) / float(length-1)
-        dQ = 2. * np.trapz(vSin * vData[:,skipIndex:skipIndex+length]) / float(length-1)
-        signal = dI + 1j*dQ
-        if bUseRef:
-            traceRef = self.getValue('Reference data')
-            # skip reference if trace length doesn't match
-            if len(traceRef['y']) != len(vY):
-                return signal
-            vRef = np.reshape(traceRef['y'], (nSegment, int(nTotLength/nSegment)))
-            dIref = 2. * np.trapz(vCos * vRef[:,skipIndex:skipIndex+length]) / float(length-1)
-            dQref = 2. * np.trapz(vSin * vRef[:,skipIndex:skipIndex+length]) / float(length-1)
-            # subtract the reference angle
-            dAngleRef = np.arctan2(dQref, dIref)
-            signal /= (np.cos(dAngleRef) + 1j*np.sin(dAngleRef))
-        return signal
-    
+        return self.getIQAmplitudesAll()[0]
 
-
-    def getIQAmplitudes_MultiFreq(self,dFreq):
+    def getIQAmplitudes_MultiFreq(self, dFreq):
         """Calculate complex signal from data and reference"""
+        return self.demodulate([dFreq])[0]
+
+    def getIQAmplitudesAll(self):
+        """Calculate complex signal for all modulation frequencies, the result
+        is kept until the input data or any parameter is changed"""
+        if self.lastSignal is None:
+            self.lastSignal = self.demodulate(self.getFrequencies())
+        return self.lastSignal
+
+    def demodulate(self, lFreq):
+        """Calculate complex signal from data and reference for a list of
+        frequencies, returns array with shape (frequencies, segments)"""
         # get parameters
         skipStart = self.getValue('Skip start')
         nSegment = int(self.getValue('Number of segments'))
+        nFreq = len(lFreq)
         # get input data from dict, with keys {'y': value, 't0': t0, 'dt': dt}
         traceIn = self.getValue('Input data')
         if traceIn is None:
-            return complex(0.0)
-        vY = traceIn['y']     
+            return np.zeros((nFreq, 1), dtype=complex)
+        vY = traceIn['y']
         dt = traceIn['dt']
         # get shape of input data
         shape = traceIn.get('shape', vY.shape)
@@ -121,31 +95,45 @@ class Driver(InstrumentDriver.InstrumentWorker):
         length = 1 + int(round(self.getValue('Length')/dt))
         length = min(length, int(nTotLength/nSegment)-skipIndex)
         if length <=1:
-            return complex(0.0)
+            return np.zeros((nFreq, 1), dtype=complex)
         bUseRef = bool(self.getValue('Use phase reference signal'))
         # define data to use, put in 2d array of segments
         vData = np.reshape(vY, (nSegment, int(nTotLength/nSegment)))
-        # calculate cos/sin vectors, allow segmenting
-        vTime = dt * (skipIndex + np.arange(length, dtype=float))
-        vCos = np.cos(2*np.pi * vTime * dFreq)
-        vSin = np.sin(2*np.pi * vTime * dFreq)
-        # calc I/Q
-        dI = 2. * np.trapz(vCos * vData[:,skipIndex:skipIndex+length]) / float(length-1)
-        dQ = 2. * np.trapz(vSin * vData[:,skipIndex:skipIndex+length]) / float(length-1)
-        signal = dI + 1j*dQ
+        # calc I/Q for all segments and frequencies with one matrix product
+        mKernel = self.getKernel(dt, skipIndex, length, lFreq)
+        mIQ = np.dot(vData[:,skipIndex:skipIndex+length], mKernel)
+        signal = mIQ[:,:nFreq].T + 1j*mIQ[:,nFreq:].T
         if bUseRef:
             traceRef = self.getValue('Reference data')
             # skip reference if trace length doesn't match
             if len(traceRef['y']) != len(vY):
                 return signal
             vRef = np.reshape(traceRef['y'], (nSegment, int(nTotLength/nSegment)))
-            dIref = 2. * np.trapz(vCos * vRef[:,skipIndex:skipIndex+length]) / float(length-1)
-            dQref = 2. * np.trapz(vSin * vRef[:,skipIndex:skipIndex+length]) / float(length-1)
+            mIQref = np.dot(vRef[:,skipIndex:skipIndex+length], mKernel)
             # subtract the reference angle
-            dAngleRef = np.arctan2(dQref, dIref)
+            dAngleRef = np.arctan2(mIQref[:,nFreq:], mIQref[:,:nFreq]).T
             signal /= (np.cos(dAngleRef) + 1j*np.sin(dAngleRef))
         return signal
 
+    def getKernel(self, dt, skipIndex, length, lFreq):
+        """Return demodulation kernel with cos/sin columns for all
+        frequencies, including the weights of the trapezoidal integration"""
+        key = (dt, skipIndex, length, tuple(lFreq))
+        if key not in self.dKernel:
+            # calculate cos/sin vectors, allow segmenting
+            vTime = dt * (skipIndex + np.arange(length, dtype=float))
+            mPhase = 2*np.pi * np.outer(vTime, lFreq)
+            vWeight = 2. * np.ones(length) / float(length-1)
+            vWeight[0] /= 2
+            vWeight[-1] /= 2
+            mKernel = vWeight[:,np.newaxis] * np.hstack((np.cos(mPhase),
+                                                          np.sin(mPhase)))
+            # parameters rarely change, only keep a few kernels
+            if len(self.dKernel) >= 8:
+                self.dKernel.clear()
+            self.dKernel[key] = mKernel
+        return self.dKernel[key]
+
 
 if __name__ == '__main__':
     pass
@@ -1,6 +1,9 @@
 #!/usr/bin/env python
 
 from BaseDriver import LabberDriver
+import hashlib
+import os
+import pickle
 import numpy as np
 from sklearn.svm import SVC
 from sklearn.metrics import accuracy_score
@@ -10,16 +13,162 @@ class Error(Exception):
     pass
 
 
+class MatrixDiscriminator(object):
+    """Discriminator with decision scores from a single matrix product.
+
+    Scores are calculated as features(X) @ weights + offset, where the
+    features are (I, Q), or (I^2, IQ, Q^2, I, Q) for quadratic boundaries.
+    If pairs are given, each score is a one-vs-one decision between two
+    states and the state with most votes wins, otherwise the state with
+    the highest score wins.
+    """
+
+    def __init__(self, labels, weights, offset, quadratic=False, pairs=None):
+        self.labels = np.asarray(labels, dtype=int)
+        self.weights = np.asarray(weights, dtype=float)
+        self.offset = np.asarray(offset, dtype=float)
+        self.quadratic = quadratic
+        self.pairs = pairs
+
+    def signature(self):
+        """Models with equal signatures can be evaluated together"""
+        return (self.quadratic, self.weights.shape,
+                None if self.pairs is None else tuple(self.pairs))
+
+    def predict(self, X):
+        """Predict states for data with shape (n_data, 2)"""
+        scores = np.dot(features(X, self.quadratic), self.weights)
+        return self.decide(scores + self.offset)
+
+    def decide(self, scores):
+        """Get states from scores, the last dimension is the score index"""
+        if self.pairs is None:
+            return self.labels[np.argmax(scores, axis=-1)]
+        # one-vs-one voting, ties go to the lowest index
+        positive = scores > 0
+        votes = np.zeros(scores.shape[:-1] + (len(self.labels),), dtype=int)
+        for k, (i, j) in enumerate(self.pairs):
+            votes[..., i] += positive[..., k]
+            votes[..., j] += ~positive[..., k]
+        return self.labels[np.argmax(votes, axis=-1)]
+
+
+def features(X, quadratic=False):
+    """Get features used by matrix discriminators, X has I/Q in last axis"""
+    if not quadratic:
+        return X
+    I, Q = X[..., 0], X[..., 1]
+    return np.stack((I * I, I * Q, Q * Q, I, Q), axis=-1)
+
+
+def predict_all(models, inputs):
+    """Predict states for all qubits, if possible as one array operation"""
+    matrix_models = [m for m in models if isinstance(m, MatrixDiscriminator)]
+    if (len(matrix_models) == len(models) > 0 and
+            len(set(m.signature() for m in models)) == 1 and
+            len(set(len(x) for x in inputs)) == 1):
+        # stack data and decision matrices, shapes (qubit, data, features)
+        X = features(np.stack(inputs), models[0].quadratic)
+        weights = np.stack([m.weights for m in models])
+        offset = np.stack([m.offset for m in models])[:, np.newaxis, :]
+        scores = np.matmul(X, weights) + offset
+        if models[0].pairs is None:
+            index = np.argmax(scores, axis=-1)
+            labels = np.stack([m.labels for m in models])
+            return list(np.take_along_axis(labels, index, axis=1))
+        return [m.decide(x) for m, x in zip(models, scores)]
+    # different models, evaluate one by one
+    output = []
+    for model, x in zip(models, inputs):
+        if model is None or len(x) == 0:
+            output.append(np.zeros(len(x), dtype=int))
+        else:
+            output.append(np.asarray(model.predict(x), dtype=int))
+    return output
+
+
+def _class_statistics(X, y):
+    """Get labels, mean values and data for each class"""
+    labels = np.unique(y)
+    data = [X[y == label] for label in labels]
+    means = np.array([x.mean(axis=0) for x in data])
+    return (labels, means, data)
+
+
+def _covariance(x, default):
+    """Get covariance of data, or the default if it can't be estimated"""
+    if len(x) < 3:
+        return default
+    cov = np.cov(x, rowvar=False)
+    if np.linalg.det(cov) <= 0:
+        return default
+    return cov
+
+
+def train_nearest_centroid(X, y):
+    """Nearest centroid discriminator, as linear decision functions"""
+    (labels, means, data) = _class_statistics(X, y)
+    # |x - m|^2 = |x|^2 - 2 x.m + |m|^2, the first term is common to all
+    return MatrixDiscriminator(labels, means.T, -0.5 * np.sum(means**2, axis=1))
+
+
+def train_lda(X, y):
+    """Linear discriminant analysis with equal priors"""
+    (labels, means, data) = _class_statistics(X, y)
+    # pooled within-class covariance
+    residuals = np.concatenate([x - m for x, m in zip(data, means)])
+    cov = _covariance(residuals, np.identity(2))
+    weights = np.linalg.solve(cov, means.T)
+    offset = -0.5 * np.sum(means.T * weights, axis=0)
+    return MatrixDiscriminator(labels, weights, offset)
+
+
+def train_qda(X, y):
+    """Quadratic discriminant analysis with equal priors"""
+    (labels, means, data) = _class_statistics(X, y)
+    residuals = np.concatenate([x - m for x, m in zip(data, means)])
+    pooled = _covariance(residuals, np.identity(2))
+    weights = np.zeros((5, len(labels)))
+    offset = np.zeros(len(labels))
+    for k, (x, m) in enumerate(zip(data, means)):
+        # -0.5 (x-m)^T A (x-m) - 0.5 log|cov|, with A the inverse covariance
+        cov = _covariance(x, pooled)
+        A = np.linalg.inv(cov)
+        Am = np.dot(A, m)
+        weights[:, k] = (-0.5 * A[0, 0], -A[0, 1], -0.5 * A[1, 1],
+                         Am[0], Am[1])
+        offset[k] = -0.5 * np.dot(m, Am) - 0.5 * np.log(np.linalg.det(cov))
+    return MatrixDiscriminator(labels, weights, offset, quadratic=True)
+
+
+def linear_svm(svc):
+    """Convert a trained linear SVM to a matrix discriminator"""
+    n_class = len(svc.classes_)
+    pairs = [(i, j) for i in range(n_class) for j in range(i + 1, n_class)]
+    # sklearn flips the sign of binary classifiers, positive decisions are
+    # for the second class. For multi-class, they are for the first class.
+    sign = -1.0 if n_class == 2 else 1.0
+    return MatrixDiscriminator(svc.classes_, sign * svc.coef_.T,
+                               sign * svc.intercept_, pairs=pairs)
+
+
 class Driver(LabberDriver):
     """ This class implements a Labber driver"""
 
     MAX_QUBITS = 9
+    # version of cached model data, (model, fidelity, assignment matrix)
+    MODEL_FORMAT = 2
+    # settings defining the discriminator, changes require re-training
+    DISCRIMINATOR_SETTINGS = ('Discriminator', 'Kernel', 'Degree', 'Gamma',
+                              'Coef0', 'C-parameter', 'Shrinking')
 
     def performOpen(self, options={}):
         """Perform the operation of opening the instrument connection"""
         # define variables for training data sets
         self.training_cfg = {}
         self.init_training_data()
+        # states are calculated once for each new input
+        self.states_valid = False
 
     def performClose(self, bError=False, options={}):
         """Perform the close instrument connection operation"""
@@ -28,6 +177,8 @@ class Driver(LabberDriver):
     def performSetValue(self, quant, value, sweepRate=0.0, options={}):
         """Perform the Set Value instrument operation. This function should
         return the actual value set by the instrument"""
+        # new input data or settings, states have to be re-calculated
+        self.states_valid = False
 
         # initialize training data
         if quant.name in (
@@ -70,6 +221,10 @@ class Driver(LabberDriver):
         elif quant.name.startswith('Use median value'):
             self.training_valid = False
 
+        # if changing discriminator settings, flag need for re-training
+        elif quant.name in self.DISCRIMINATOR_SETTINGS:
+            self.training_valid = False
+
         # if changing pointer states, flag need for for re-training
         elif (quant.name.startswith('Training source') or
                 (self.getValue('Training source') == 'Pointer states' and
@@ -80,8 +235,8 @@ class Driver(LabberDriver):
 
     def performGetValue(self, quant, options={}):
         """Perform the Get Value instrument operation"""
-        # get traces if first call
-        if self.isFirstCall(options):
+        # calculate states once for each new input
+        if not self.states_valid:
             self.calculate_states()
         # check input
         if quant.name.startswith('QB'):
@@ -91,16 +246,13 @@ class Driver(LabberDriver):
         elif quant.name.startswith('Average QB'):
             # qubit = int(quant.name[10]) - 1
             qubit = int(quant.name.split('QB')[1].split(' ')[0]) - 1
-            value = np.mean(self.qubit_states[qubit])
+            value = self.qubit_averages[qubit]
         elif quant.name.startswith('Assignment fidelity QB'):
             #qubit = int(quant.name[22]) - 1
             qubit = int(quant.name.split('QB')[1].split(' ')[0]) - 1
             value = self.assignment_fidelity[qubit]
         elif quant.name.startswith('Average state vector'):
-            # states are encoded in array of ints
-            m = self.n_state ** self.n_qubit
-            value = (np.bincount(self.state_vector, minlength=m) /
-                     len(self.state_vector))
+            value = self.state_histogram
 
         elif quant.name.startswith('System state'):
             value = self.state_vector
@@ -134,6 +286,7 @@ class Driver(LabberDriver):
         self.training_data = [
             [None for n1 in range(n_total)] for n2 in range(d['n_qubit'])]
         self.assignment_fidelity = [0.0] * self.MAX_QUBITS
+        self.assignment_matrix = [np.identity(d['n_state'])] * d['n_qubit']
 
     def _prepare_data(self, qubit, data, use_median=False):
         """Prepare data to right format for SVM"""
@@ -172,7 +325,8 @@ class Driver(LabberDriver):
         if self.training_valid:
             return
 
-        # get SVM configuration
+        # get discriminator configuration
+        method = self.getValue('Discriminator')
         kwargs = dict(
             kernel=self.getValue('Kernel'),
             degree=self.getValue('Degree'),
@@ -185,12 +339,13 @@ class Driver(LabberDriver):
 
         # special case if training from pointer states
         if self.getValue('Training source') == 'Pointer states':
-            self.train_from_pointer_states(kwargs)
+            self.train_from_pointer_states(method, kwargs)
             return
 
         # train for all active qubits
-        self.svm = [None] * self.n_qubit
+        self.models = [None] * self.n_qubit
         self.assignment_fidelity = [0.0] * self.n_qubit
+        self.assignment_matrix = [np.identity(self.n_state)] * self.n_qubit
         for qubit, data in enumerate(self.training_data):
             # prepare data both for full set and just median
             if np.any([x is None for x in data]):
@@ -198,25 +353,38 @@ class Driver(LabberDriver):
             (X, y) = self._prepare_data(qubit, data, use_median=False)
             (Xm, ym) = self._prepare_data(qubit, data, use_median=True)
 
-            # create SVM and fit data
-            svc = SVC(**kwargs)
+            # look for model trained on same data, from previous session
+            key = self._get_model_key(X, y, method, kwargs, use_median)
+            cached = self._load_model(key)
+            if isinstance(cached, tuple) and len(cached) == 3:
+                (self.models[qubit], self.assignment_fidelity[qubit],
+                 self.assignment_matrix[qubit]) = cached
+                continue
+
+            # create discriminator and fit data
             if use_median:
-                svc.fit(Xm, ym)
+                model = self.fit_model(Xm, ym, method, kwargs)
             else:
-                svc.fit(X, y)
-            # store in list of SVMs
-            self.svm[qubit] = svc
+                model = self.fit_model(X, y, method, kwargs)
+            # store in list of discriminators
+            self.models[qubit] = model
             # calculate assignment fidelity using full data set
-            self.assignment_fidelity[qubit] = accuracy_score(y, svc.predict(X))
+            y_predict = model.predict(X)
+            self.assignment_fidelity[qubit] = accuracy_score(y, y_predict)
+            self.assignment_matrix[qubit] = self._get_assignment_matrix(
+                y, y_predict)
+            self._save_model(key, (model, self.assignment_fidelity[qubit],
+                                   self.assignment_matrix[qubit]))
 
         # mark training as valid
         self.training_valid = True
 
 
-    def train_from_pointer_states(self, kwargs):
+    def train_from_pointer_states(self, method, kwargs):
         """Train discriminator based on pointer states"""
-        # train for all active qubits
-        self.svm = []
+        # train for all active qubits, without data for assignment errors
+        self.models = []
+        self.assignment_matrix = [np.identity(self.n_state)] * self.n_qubit
         for qubit in range(self.n_qubit):
             X = np.zeros((self.n_state, 2))
             y = np.zeros(self.n_state, dtype=int)
@@ -228,44 +396,148 @@ class Driver(LabberDriver):
                 X[m, 1] = x.imag
                 y[m] = m
 
-            # create SVM and fit data
-            svc = SVC(**kwargs)
-            svc.fit(X, y)
-            # store in list of SVMs
-            self.svm.append(svc)
+            # create discriminator and fit data
+            self.models.append(self.fit_model(X, y, method, kwargs))
 
         # mark training as valid
         self.training_valid = True
 
 
+    def _get_assignment_matrix(self, y, y_predict):
+        """Get matrix with probabilities P(measured i | prepared j)"""
+        counts = np.zeros((self.n_state, self.n_state))
+        np.add.at(counts, (y_predict, y), 1)
+        n_prepared = np.sum(counts, axis=0)
+        # states without data are assumed to be without errors
+        counts[:, n_prepared == 0] = np.identity(self.n_state)[
+            :, n_prepared == 0]
+        n_prepared[n_prepared == 0] = 1
+        return counts / n_prepared
+
+
+    def fit_model(self, X, y, method, kwargs):
+        """Create discriminator and fit data"""
+        if method == 'Nearest centroid':
+            return train_nearest_centroid(X, y)
+        elif method == 'LDA':
+            return train_lda(X, y)
+        elif method == 'QDA':
+            return train_qda(X, y)
+        svc = SVC(**kwargs)
+        svc.fit(X, y)
+        # linear SVMs don't need the kernel for predictions
+        if kwargs['kernel'] == 'linear':
+            return linear_svm(svc)
+        return svc
+
+
+    def _get_model_key(self, X, y, method, kwargs, use_median):
+        """Get hash of training data and discriminator configuration"""
+        h = hashlib.sha1()
+        h.update(repr((self.MODEL_FORMAT, method, sorted(kwargs.items()),
+                       bool(use_median),
+                       self.training_cfg['training_type'])).encode())
+        h.update(np.ascontiguousarray(X).tobytes())
+        h.update(np.ascontiguousarray(y).tobytes())
+        return h.hexdigest()
+
+
+    def _get_cache_dir(self):
+        """Get directory for storing trained models"""
+        path = self.getValue('Model cache directory')
+        if path == '':
+            # per-user folder, models are loaded with pickle and must not be
+            # stored where other users can write
+            path = os.path.join(os.path.expanduser('~'), '.labber',
+                                'State_Discriminator')
+        return path
+
+
+    def _load_model(self, key):
+        """Load trained model from disk cache, returns None if not found"""
+        if not self.getValue('Cache trained models'):
+            return None
+        filename = os.path.join(self._get_cache_dir(), key + '.pickle')
+        if not os.path.exists(filename):
+            return None
+        try:
+            with open(filename, 'rb') as f:
+                return pickle.load(f)
+        except Exception as e:
+            # corrupt or incompatible file, re-train
+            self.log('Could not load cached model: %s' % str(e), level=30)
+            return None
+
+
+    def _save_model(self, key, model):
+        """Save trained model to disk cache"""
+        if not self.getValue('Cache trained models'):
+            return
+        path = self._get_cache_dir()
+        try:
+            if not os.path.exists(path):
+                os.makedirs(path)
+            with open(os.path.join(path, key + '.pickle'), 'wb') as f:
+                pickle.dump(model, f)
+        except (OSError, pickle.PickleError) as e:
+            self.log('Could not save cached model: %s' % str(e), level=30)
+
+
     def calculate_states(self):
         """Calculate states using training data"""
         # train discriminator, if necessary
         self.train_discriminator()
-        self.state_vector = np.array([], dtype=int)
+        n_qubit = len(self.models)
+        # get input data for all active qubits, stacked if possible
+        data = [self.getValueArray('Input data, QB%d' % (n + 1))
+                for n in range(n_qubit)]
+        if len(set(len(x) for x in data)) == 1:
+            inputs = np.empty((n_qubit, len(data[0]), 2))
+        else:
+            inputs = [np.empty((len(x), 2)) for x in data]
+        for n, x in enumerate(data):
+            inputs[n][:, 0] = x.real
+            inputs[n][:, 1] = x.imag
         # calculate states for all active qubits
+        outputs = predict_all(self.models, inputs)
         self.qubit_states = [[]] * self.MAX_QUBITS
-        for n, svm in enumerate(self.svm):
-            x = self.getValueArray('Input data, QB%d' % (n + 1))
-            if len(x) > 0:
-                if svm is None:
-                    output = np.zeros(len(x), dtype=int)
-                else:
-                    input_data = np.zeros((len(x), 2))
-                    input_data[:, 0] = x.real
-                    input_data[:, 1] = x.imag
-                    output = svm.predict(input_data)
-            else:
-                output = np.array([], dtype=int)
+        self.qubit_averages = [np.nan] * self.MAX_QUBITS
+        for n, output in enumerate(outputs):
             self.qubit_states[n] = output
-
+            self.qubit_averages[n] = np.mean(output)
             # update mean value controls
-            self.setValue('Average QB%d state' % (n + 1), np.mean(output))
-
-            # calculate state vector, in integer form
-            if n == 0:
-                self.state_vector = np.zeros(len(output), dtype=int)
-            self.state_vector += (output * (self.n_state ** n))
+            self.setValue('Average QB%d state' % (n + 1),
+                          self.qubit_averages[n])
+
+        # calculate state vector in integer form, and the state histogram
+        if len(set(len(x) for x in outputs)) > 1:
+            raise Error('All qubits must have the same number of shots.')
+        m = self.n_state ** self.n_qubit
+        if n_qubit > 0:
+            weights = self.n_state ** np.arange(n_qubit)
+            self.state_vector = np.dot(weights, np.asarray(outputs))
+            histogram = (np.bincount(self.state_vector, minlength=m) /
+                         max(1, len(self.state_vector)))
+        else:
+            self.state_vector = np.array([], dtype=int)
+            histogram = np.zeros(m)
+        if self.getValue('Mitigate readout errors'):
+            histogram = self.mitigate_histogram(histogram)
+        self.state_histogram = histogram
+        self.states_valid = True
+
+
+    def mitigate_histogram(self, histogram):
+        """Correct state histogram for readout errors, using the inverse of
+        the assignment matrix of each qubit"""
+        n_qubit = len(self.assignment_matrix)
+        # first axis is the most significant digit, the last qubit
+        p = np.reshape(histogram, (self.n_state,) * n_qubit)
+        for qubit, matrix in enumerate(self.assignment_matrix):
+            axis = n_qubit - 1 - qubit
+            p = np.tensordot(np.linalg.pinv(matrix), p, axes=([1], [axis]))
+            p = np.moveaxis(p, 0, axis)
+        return p.reshape(-1)
 
 
 if __name__ == '__main__':
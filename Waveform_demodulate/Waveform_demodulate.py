@@ -2,11 +2,12 @@
 
 import InstrumentDriver
 import numpy as np
-from scipy.signal import resample
+from scipy.signal import resample, resample_poly
 from scipy.ndimage.filters import gaussian_filter
 from scipy.optimize import leastsq
 from numpy.fft import fft, fftshift, fftfreq
 import h5py
+from fractions import Fraction
 
 
 class Driver(InstrumentDriver.InstrumentWorker):
@@ -55,42 +56,86 @@ class Driver(InstrumentDriver.InstrumentWorker):
             value = quant.getValue()
         return value
         
-    def demodulate(self, vWaveform):   
-      
-        #demodulate
+    def demodulate(self, vWaveform):
+        """Demodulate waveform, averaging over each modulation period"""
         nModFreq = self.getValue('Modulation Freq')
         nSampleRate = self.getValue('Sample Rate')
         nWavLength = len(vWaveform)
-        vTvals = np.linspace(0,nWavLength/nSampleRate, nWavLength, endpoint = False)
-        
-        
-        
         mod_period = 1/nModFreq
-        #period_num = int(np.floor((self.vRTime[-1]+dt)/mod_period))
-        response_int = []
-        t_int = []
-        
-        period_num = (vTvals[-1] - vTvals[0]) * nModFreq
         samples_period = int(nSampleRate/nModFreq)
-        
-        vWaveform = resample(vWaveform, int(period_num*samples_period))#sinc function interpolation
-        
-        vTvals = np.linspace(0, nWavLength/nSampleRate, len(vWaveform), endpoint = False)
-
+        # resampling doesn't change the mean value, use the input data
         avg = np.mean(vWaveform)
-        demod = 2*(vWaveform-avg)*np.exp(-1j*(2*np.pi*(nModFreq)*vTvals))
 
+        if self.getValue('Resampling method') == 'Polyphase':
+            # resample to samples_period points per modulation period
+            ratio = Fraction(samples_period*nModFreq/nSampleRate)
+            ratio = ratio.limit_denominator(1000)
+            up, down = ratio.numerator, ratio.denominator
+            dt = down/(up*nSampleRate)
+            if self.getValue('Stream in chunks'):
+                vResponse = self.demodulateChunks(
+                    vWaveform, up, down, avg, dt, nModFreq, samples_period)
+            else:
+                vWaveform = resample_poly(vWaveform, up, down)
+                vResponse = self.averagePeriods(
+                    vWaveform, avg, dt, nModFreq, samples_period)
+            return mod_period, vResponse
+
+        period_num = (nWavLength - 1)/nSampleRate * nModFreq
+        vWaveform = resample(vWaveform, int(period_num*samples_period))#sinc function interpolation
+        dt = nWavLength/(nSampleRate*len(vWaveform))
         #integrate over each modulation period
-        vResponse = np.array([], dtype = complex)
-        t_int = []
-        for n in range(0,int(np.floor(period_num))):
-            start = n*samples_period
-            end = (n+1)*samples_period
-            vResponse = np.append(vResponse, np.mean(demod[start:end]))
-            t_int.append(np.mean(vTvals[start:end]))
+        n_period = int(np.floor(period_num))
+        vResponse = self.averagePeriods(vWaveform[:n_period*samples_period],
+                                        avg, dt, nModFreq, samples_period)
+        return mod_period, vResponse
+
+    def demodulateChunks(self, vWaveform, up, down, avg, dt, nModFreq,
+                         samples_period):
+        """Resample and demodulate waveform in chunks, to limit memory use"""
+        nWavLength = len(vWaveform)
+        # chunk size and padding must be multiples of the downsampling factor
+        nChunk = max(1, int(self.getValue('Chunk size')) // down) * down
+        # the resampling filter spans 10*max(up, down) upsampled points
+        nPad = (10*max(up, down)//up + down) // down * down + down
+        lResponse = []
+        vCarry = np.zeros(0)
+        n0 = 0
+        for start in range(0, nWavLength, nChunk):
+            end = min(start + nChunk, nWavLength)
+            # resample with padding from neighbouring data, then crop
+            first = max(0, start - nPad)
+            vChunk = resample_poly(vWaveform[first:min(nWavLength, end + nPad)],
+                                   up, down)
+            i0 = (start - first)*up//down
+            n_out = -(-(end - start)*up//down)
+            vChunk = np.concatenate((vCarry, vChunk[i0:i0 + n_out]))
+            # keep samples not making up a full period for the next chunk
+            n_period = len(vChunk)//samples_period
+            lResponse.append(self.averagePeriods(
+                vChunk[:n_period*samples_period], avg, dt, nModFreq,
+                samples_period, n0))
+            vCarry = vChunk[n_period*samples_period:]
+            n0 += n_period*samples_period
+        return np.concatenate(lResponse)
+
+    def averagePeriods(self, vWaveform, avg, dt, nModFreq, samples_period,
+                       n0=0):
+        """Demodulate and average over each modulation period, the first
+        sample of the waveform has index n0 in the resampled trace"""
+        n_period = len(vWaveform)//samples_period
+        mData = np.reshape(vWaveform[:n_period*samples_period],
+                           (n_period, samples_period))
+        # demodulate each period with the phase relative to its first sample
+        vPhase = 2*np.pi*nModFreq*dt*np.arange(samples_period)
+        vCos = 2*np.cos(vPhase)/samples_period
+        vSin = 2*np.sin(vPhase)/samples_period
+        vResponse = ((np.dot(mData, vCos) - avg*np.sum(vCos)) -
+                     1j*(np.dot(mData, vSin) - avg*np.sum(vSin)))
+        # phase of the first sample of each period
+        vStart = n0 + samples_period*np.arange(n_period)
+        return vResponse*np.exp(-1j*(2*np.pi*nModFreq*dt*vStart))
 
-        return mod_period, vResponse      
-      
 
 if __name__ == '__main__':
     pass
\ No newline at end of file